@@ -0,0 +1,9 @@
+# Gunicorn settings loaded from the working directory (see Dockerfile CMD)
+# Workers share the container's background job table (scripts/jobs.py), which is not shared
+# between containers: scale with workers here, not with more instances
+
+
+def post_fork(server, worker):
+    # Each worker builds its own storage client and opens a connection before taking requests
+    from scripts.debiflow_gcs import warm_up
+    warm_up()
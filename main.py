@@ -1,6 +1,5 @@
 import os
 from flask import Flask, render_template, request, redirect, flash, session
-from google.cloud import storage
 from datetime import datetime
 from scripts.file_tracker import get_reporting_dates
 
@@ -18,11 +17,14 @@ from scripts.utilisation_request import generate_utilisation_request
 
 from io import StringIO
 import pandas as pd
-from scripts.validate_uploads import validate_file
+from scripts.validate_uploads import validate_stream
+from scripts.staged_uploads import split_findings
 
 from flask import send_file, request, redirect, flash
 
 from scripts.utils import build_investor_path, require_investor
+from scripts.debiflow_gcs import get_bucket, DebiFlowGCS, GCS_UPLOAD_CHUNK_SIZE
+from scripts.catalog import load_catalog, record_blobs, complete_raw_dates
 
 # Config
 ALLOWED_PREFIXES = ['HP_Repayments_', 'CustomerDetails_', 'Schedule_', 'Payments_']
@@ -37,36 +39,38 @@ def allowed_file(filename):
 
 @app.route("/", methods=["GET"])
 def landing_page():
-    from google.cloud import storage
 
-    client = storage.Client()
-    bucket = client.bucket(GCS_BUCKET)
+    from scripts.portfolio import list_investors
+
+    bucket = get_bucket(GCS_BUCKET)
 
     # List all folders under Investors/
-    iterator = bucket.list_blobs(prefix="Investors/", delimiter="/")
-    prefixes = set()
+    investors = list_investors(bucket)
+
+    return render_template("landing.html", investors=investors)
 
-    # This forces iteration and fills prefixes
-    for page in iterator.pages:
-        prefixes.update(page.prefixes)
 
-    # Clean investor names (remove "Investors/" and trailing "/")
-    investors = [p.replace("Investors/", "").strip("/") for p in sorted(prefixes)]
+@app.route("/portfolio", methods=["GET"])
+def portfolio():
+    from scripts.portfolio import portfolio_overview
 
-    return render_template("landing.html", investors=investors)
+    bucket = get_bucket(GCS_BUCKET)
+
+    # Every investor at its latest period, computed in parallel and cached per output generation
+    overviews, totals = portfolio_overview(bucket)
+
+    return render_template(
+        "portfolio.html",
+        overviews=overviews,
+        totals=totals,
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M")
+    )
 
 
 @app.route("/upload", methods=["GET", "POST"])
 @require_investor
 def upload_routes(investor):
-    from google.cloud import storage
-    import re
-    from collections import defaultdict
-    from io import StringIO
-    import pandas as pd
-
-    client = storage.Client()
-    bucket = client.bucket(GCS_BUCKET)
+    bucket = get_bucket(GCS_BUCKET)
 
     if request.method == "POST":
         files = request.files.getlist("files[]")
@@ -84,18 +88,15 @@ def upload_routes(investor):
                 errors.append(f"{fn}: Invalid filename prefix.")
                 continue
 
+            # Streamed in chunks: header first, stops at the first chunk with a hard error
             try:
                 f.stream.seek(0)
-                df = pd.read_csv(StringIO(f.stream.read().decode("utf-8")), dtype=str)
+                file_errors, file_warnings = split_findings(fn, validate_stream(fn, f.stream))
             except Exception as e:
                 errors.append(f"{fn}: Could not parse CSV ({e}).")
                 continue
-
-            for err in validate_file(fn, df):
-                if err.startswith("Warning"):
-                    warnings.append(f"{fn}: {err}")
-                else:
-                    errors.append(f"{fn}: {err}")
+            errors.extend(file_errors)
+            warnings.extend(file_warnings)
 
         # If any hard errors, abort with filenames only
         #if errors:
@@ -107,24 +108,13 @@ def upload_routes(investor):
             bad = sorted({e.split(":", 1)[0] for e in errors})
             flash(f"❌ Upload failed. Issue in file{'s' if len(bad)>1 else ''}: {', '.join(bad)}.")
             # Show the errors in the same page without redirecting
-            blobs = bucket.list_blobs(prefix=f"Investors/{investor}/raw/")
-            REQUIRED_PREFIXES = {"Schedule_", "CustomerDetails_", "Payments_", "HP_Repayments_"}
-            raw_dates = defaultdict(set)
-            for blob in blobs:
-                name = blob.name.split("/")[-1]
-                for prefix in REQUIRED_PREFIXES:
-                    m = re.match(rf"^{prefix}(\d{{8}})\.csv$", name)
-                    if m:
-                        raw_dates[m.group(1)].add(prefix)
-            complete_dates = sorted(
-                [d for d, ps in raw_dates.items() if ps == REQUIRED_PREFIXES],
-                reverse=True
-            )
+            complete_dates = sorted(complete_raw_dates(load_catalog(bucket, investor)), reverse=True)
             return render_template(
                 "upload.html",
                 available_dates=complete_dates,
                 investor=investor,
-                errors=errors
+                errors=errors,
+                upload_chunk_bytes=GCS_UPLOAD_CHUNK_SIZE
             )
 
 
@@ -133,36 +123,87 @@ def upload_routes(investor):
             warn = sorted({w.split(":", 1)[0] for w in warnings})
             flash(f"⚠️ Uploaded with formatting warnings in: {', '.join(warn)}. Please check those files.")
 
-        # All good – upload each file
-        for f in files:
-            f.stream.seek(0)
-            bucket.blob(build_investor_path(investor, "raw",f.filename)) \
-                  .upload_from_file(f.stream, content_type="text/csv")
+        # All good – stream the files to GCS concurrently in resumable chunks
+        uploads = [(build_investor_path(investor, "raw", f.filename), f.stream, "text/csv") for f in files]
+        DebiFlowGCS.from_bucket(bucket).put_streams(uploads)
+        record_blobs(bucket, investor, [path for path, _, _ in uploads])
 
         # Single success message
         count = len(files)
         flash(f"✅ Successfully uploaded {count} file{'s' if count>1 else ''}!")
         return redirect(url_for("upload_routes", investor=investor))
 
-    # === GET logic unchanged ===
-    blobs = bucket.list_blobs(prefix=f"Investors/{investor}/raw/")
-    REQUIRED_PREFIXES = {"Schedule_", "CustomerDetails_", "Payments_", "HP_Repayments_"}
-    raw_dates = defaultdict(set)
-    for blob in blobs:
-        name = blob.name.split("/")[-1]
-        for prefix in REQUIRED_PREFIXES:
-            m = re.match(rf"^{prefix}(\d{{8}})\.csv$", name)
-            if m:
-                raw_dates[m.group(1)].add(prefix)
-    complete_dates = sorted(
-        [d for d, ps in raw_dates.items() if ps == REQUIRED_PREFIXES],
-        reverse=True
-    )
-    return render_template("upload.html", available_dates=complete_dates, investor=investor)
+    # === GET: complete raw dates from the investor's catalog ===
+    complete_dates = sorted(complete_raw_dates(load_catalog(bucket, investor)), reverse=True)
+    return render_template("upload.html", available_dates=complete_dates, investor=investor,
+                           upload_chunk_bytes=GCS_UPLOAD_CHUNK_SIZE)
 
 
+@app.route("/upload/sessions", methods=["POST"])
+@require_investor
+def upload_sessions(investor):
+    """
+    Start a direct upload: one resumable GCS session per file, on a staging blob.
+    """
+    from flask import jsonify
+    from scripts.staged_uploads import create_upload_sessions
 
+    file_names = (request.get_json(silent=True) or {}).get("files") or []
+    bad = [fn for fn in file_names if not allowed_file(fn) or "/" in fn]
+    if not file_names or bad:
+        return jsonify(error=f"Invalid filename prefix: {', '.join(bad)}" if bad else "No files selected."), 400
 
+    origin = request.headers.get("Origin") or request.host_url.rstrip("/")
+    sessions = create_upload_sessions(get_bucket(GCS_BUCKET), investor, file_names, origin=origin)
+    return jsonify(files=sessions)
+
+
+@app.route("/upload/complete", methods=["POST"])
+@require_investor
+def upload_complete(investor):
+    """
+    Finish a direct upload: validate the staged files and move them into raw/ if all pass.
+    """
+    from flask import jsonify
+    from scripts.staged_uploads import finalize_staged, is_staging_path
+
+    staged = [
+        (item.get("filename", ""), item.get("staging_path", ""))
+        for item in (request.get_json(silent=True) or {}).get("files") or []
+    ]
+    if not staged or not all(allowed_file(fn) and is_staging_path(investor, path, fn) for fn, path in staged):
+        return jsonify(error="Invalid upload."), 400
+
+    errors, warnings, raw_paths = finalize_staged(get_bucket(GCS_BUCKET), investor, staged)
+    if errors:
+        bad = sorted({e.split(":", 1)[0] for e in errors})
+        return jsonify(
+            error=f"❌ Upload failed. Issue in file{'s' if len(bad)>1 else ''}: {', '.join(bad)}.",
+            errors=errors
+        )
+
+    if warnings:
+        warn = sorted({w.split(":", 1)[0] for w in warnings})
+        flash(f"⚠️ Uploaded with formatting warnings in: {', '.join(warn)}. Please check those files.")
+    count = len(raw_paths)
+    flash(f"✅ Successfully uploaded {count} file{'s' if count>1 else ''}!")
+    return jsonify(redirect=url_for("upload_routes", investor=investor))
+
+
+
+
+
+
+@app.route("/rebuild-catalog", methods=["POST"])
+@require_investor
+def rebuild_catalog_route(investor):
+    from scripts.catalog import rebuild_catalog
+
+    # Picks up files added or removed in the bucket outside the app
+    catalog = rebuild_catalog(get_bucket(GCS_BUCKET), investor)
+    flash(f"✅ Rescanned bucket: {len(complete_raw_dates(catalog))} complete raw dates, "
+          f"{len(catalog['masters'])} master dates.")
+    return redirect(url_for("upload_routes", investor=investor))
 
 
 @app.route("/pending", methods=["POST"])
@@ -207,12 +248,9 @@ def pending_confirmations(investor):
 @app.route("/confirm", methods=["POST"])
 @require_investor
 def confirm_and_merge(investor):
-    import pandas as pd
-    from io import BytesIO
-    from datetime import datetime
     from scripts.file_tracker import get_reporting_dates
-    from scripts.receivables_allocated import generate_receivables_allocated
-    import scripts.output_generators
+    from scripts.jobs import submit_job
+    from scripts.period_jobs import confirm_period
 
     # Use the date selected by the user
     report_date = request.form.get("report_date")
@@ -226,116 +264,17 @@ def confirm_and_merge(investor):
         flash("❌ No previous master reporting period found.")
         return redirect(url_for("pending_confirmations", investor=investor))
 
-    print(f"\n📦 Confirming merge for report_date={report_date}, previous={previous}")
-
-    client = storage.Client()
-    bucket = client.bucket(GCS_BUCKET)
-
-    prefixes = ["Schedule_", "CustomerDetails_", "Payments_", "HP_Repayments_"]
-    updated_files = []
-
-    for prefix in prefixes:
-        try:
-            raw_name = f"{prefix}{report_date}.csv"
-            master_prev_name = f"{prefix}Master_{previous}.csv"
-            master_new_name = f"{prefix}Master_{report_date}.csv"
-
-            print(f"\n🔄 Merging {raw_name} + {master_prev_name} → {master_new_name}")
-
-            # Prefetch bytes
-            blob_prev = bucket.blob(build_investor_path(investor, "master",master_prev_name))
-            blob_new = bucket.blob(build_investor_path(investor, "raw",raw_name))
-            prev_bytes = blob_prev.download_as_bytes()
-            new_bytes = blob_new.download_as_bytes()
-
-            # Load all columns as string for fast read
-            df_prev = pd.read_csv(BytesIO(prev_bytes), dtype=str, low_memory=False)
-            df_new = pd.read_csv(BytesIO(new_bytes), dtype=str, low_memory=False)
-
-            # Clean columns
-            df_prev.columns = df_prev.columns.str.strip()
-            df_new.columns = df_new.columns.str.strip()
-
-            print(f"✅ Loaded previous: {master_prev_name} ({len(df_prev)} rows)")
-            print(f"✅ Loaded new raw: {raw_name} ({len(df_new)} rows)")
-            print(f"🧾 Columns in {raw_name}: {df_new.columns.tolist()}")
-
-            # Convert date columns if present
-            for date_col in ["Purchase_Date", "Due_Date", "Paid_Date"]:
-                for df in [df_prev, df_new]:
-                    if date_col in df.columns:
-                        df[date_col] = pd.to_datetime(df[date_col], errors="coerce").dt.normalize()
-
-            # Example numeric columns (adjust if needed)
-            numeric_cols = ["Amount", "SomeOtherNumeric"]
-            for df in [df_prev, df_new]:
-                for col in numeric_cols:
-                    if col in df.columns:
-                        df[col] = pd.to_numeric(df[col], errors="coerce")
-
-            # Drop fully blank rows
-            df_prev = df_prev.dropna(how="all")
-            df_new = df_new.dropna(how="all")
-
-            # Drop missing LoanIDs if Schedule_
-            if prefix.startswith("Schedule_") and "LoanID" in df_new.columns:
-                df_prev = df_prev[df_prev["LoanID"].notna()]
-                df_new = df_new[df_new["LoanID"].notna()]
-
-            # Ensure same column order
-            df_prev = df_prev[df_new.columns.tolist()]
-
-            # Combine dataframes
-            df_combined = pd.concat([df_prev, df_new], ignore_index=True)
-
-            # Upload combined master file
-            output = BytesIO()
-            df_combined.to_csv(output, index=False)
-            output.seek(0)
-            bucket.blob(build_investor_path(investor, "master",master_new_name)).upload_from_file(output, content_type="text/csv")
-            print(f"☁️ Uploaded: {master_new_name} ({len(df_combined)} rows)")
-
-            updated_files.append(master_new_name)
-
-        except Exception as e:
-            print(f"❌ Error processing {prefix}: {e}")
-            flash(f"❌ Failed to merge {prefix}: {str(e)}")
-            return redirect(url_for("pending_confirmations", investor=investor))
-
-
-    # Check that all required masters exist before proceeding
-    required_files = [
-        build_investor_path(investor, "master", f"Schedule_Master_{report_date}.csv"),
-        build_investor_path(investor, "master", f"Payments_Master_{report_date}.csv"),
-        build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv")
-    ]
-    missing_files = [f for f in required_files if not bucket.blob(f).exists()]
-    if missing_files:
-        print("❌ Missing required files:", missing_files)
-        flash("❌ Missing required files for output generation:\n" + ", ".join(missing_files))
-        return redirect(url_for("pending_confirmations", investor=investor))
-
-
-    # Run allocation steps
-    try:
-        scripts.output_generators.generate_payments_allocated(report_date=report_date, bucket=GCS_BUCKET, investor=investor)
-        print(f"✅ Payments_Allocated_{report_date}.csv generated")
-        flash(f"✅ Payments_Allocated_{report_date}.csv generated")
-    except Exception as e:
-        print(f"❌ Error generating Payments_Allocated: {e}")
-        flash(f"⚠️ Failed to generate Payments_Allocated: {str(e)}")
-
-    try:
-        generate_receivables_allocated(report_date=report_date, bucket=GCS_BUCKET, prior_report_date=previous, investor=investor)
-        print(f"✅ Receivables_Allocated_{report_date}.csv generated")
-        flash(f"✅ Receivables_Allocated_{report_date}.csv generated")
-    except Exception as e:
-        print(f"❌ Error generating Receivables_Allocated: {e}")
-        flash(f"⚠️ Failed to generate Receivables_Allocated: {str(e)}")
+    # Merge + generators run on the job pool; the status page follows their progress
+    job_id = submit_job(
+        "confirm", confirm_period,
+        bucket_name=GCS_BUCKET,
+        investor=investor,
+        report_date=report_date,
+        previous=previous,
+        full_recompute=request.form.get("full_recompute") == "1"
+    )
+    return redirect(url_for("job_status", job_id=job_id, investor=investor))
 
-    print(f"\n✅ All files merged and outputs generated for {report_date}: {updated_files}\n")
-    flash(f"✅ Master file merges complete for {report_date}: " + ", ".join(updated_files))
-    return redirect(url_for("summary", report_date=report_date, investor=investor))
 
 
 
@@ -344,7 +283,6 @@ def confirm_and_merge(investor):
 
 import pandas as pd
 import os
-from scripts.summary_generator import generate_summary_outputs
 
 @app.route('/summary', methods=["GET", "POST"])
 @require_investor
@@ -374,7 +312,7 @@ def summary(investor):
 
     # Step 2: Fallback to latest date in GCS if missing
     if not report_date:
-        reporting_dates = get_reporting_dates(reference_date=report_date, investor=investor)
+        reporting_dates = dates_tuple
         report_date = max(reporting_dates) if reporting_dates else None
 
     # Step 3: Abort if still missing
@@ -393,28 +331,22 @@ def summary(investor):
         threshold = session.get('dpd_threshold', 999)
 
     # Load from GCS
-    from google.cloud import storage
-    import io
-    client = storage.Client()
-    bucket = client.bucket(GCS_BUCKET)
-
-    # === Receivables Allocated ===
-    recv_blob = bucket.blob(build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv"))
-    df_recv = pd.read_csv(io.StringIO(recv_blob.download_as_text()), dtype={"LoanID": str}, low_memory=False)
-    # Force clean dates/numeric
-    df_recv['Due_Date'] = pd.to_datetime(df_recv['Due_Date'], errors='coerce').dt.normalize()
-    df_recv['Repurchase_Date'] = pd.to_datetime(df_recv['Repurchase_Date'], errors='coerce').dt.normalize()
-    df_recv['Days_Past_Due'] = pd.to_numeric(df_recv['Days_Past_Due'], errors='coerce')
-    if 'Minimum_Recovery_Amount' in df_recv.columns:
-        df_recv['Minimum_Recovery_Amount'] = pd.to_numeric(df_recv['Minimum_Recovery_Amount'], errors='coerce')
-
-    # === HP Repayments Master ===
-    repay_blob = bucket.blob(build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv"))
-    df_repay = pd.read_csv(io.StringIO(repay_blob.download_as_text()), low_memory=False)
-
-
-    summary_df, totals = generate_summary_outputs(
-        df_recv, df_repay, report_date, threshold, None
+    from scripts.frame_cache import cached_table
+    from scripts.receivables_allocated import read_loan_snapshot
+    from scripts.summary_generator import summary_from_snapshot, par_bucket_edges
+    bucket = get_bucket(GCS_BUCKET)
+
+    # === Loan snapshot + HP repayments (cached per generation, so threshold changes stay in memory) ===
+    df_snapshot = read_loan_snapshot(bucket, investor, report_date)
+    df_repay = cached_table(
+        bucket,
+        build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv"),
+        columns=["HP_Repayment_Date", "HP_Repayment_Amount"],
+        master=True
+    )
+
+    summary_df, totals = summary_from_snapshot(
+        df_snapshot, df_repay["HP_Repayment_Amount"].sum(), threshold, edges=par_bucket_edges(investor)
     )
 
     return render_template(
@@ -431,12 +363,9 @@ def summary(investor):
 @app.route('/finalise-repurchases', methods=["POST"])
 @require_investor
 def finalise_repurchase_overrides(investor):
-    import pandas as pd
-    from google.cloud import storage
-    import io
-    from datetime import datetime
     from scripts.file_tracker import get_reporting_dates
-    from scripts.receivables_allocated import generate_receivables_allocated
+    from scripts.jobs import submit_job
+    from scripts.period_jobs import finalise_repurchases
 
     report_date = request.form.get("report_date")
     threshold = int(request.form.get("dpd_threshold", 999))
@@ -452,58 +381,59 @@ def finalise_repurchase_overrides(investor):
         flash("❌ No prior Repurchases_Master file found.")
         return redirect(url_for("summary", investor=investor))
 
-    gcs = storage.Client()
-    bucket = gcs.bucket(GCS_BUCKET)
-
-    # Load Receivables_Allocated for the current period
-    recv_blob = bucket.blob(build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv"))
-    df_recv = pd.read_csv(io.StringIO(recv_blob.download_as_text()), dtype={"LoanID": str})
-    df_recv["Due_Date"] = pd.to_datetime(df_recv["Due_Date"], errors="coerce").dt.normalize()
-    df_recv["Repurchase_Date"] = pd.to_datetime(df_recv["Repurchase_Date"], errors="coerce").dt.normalize()
-    df_recv["Days_Past_Due"] = pd.to_numeric(df_recv["Days_Past_Due"], errors="coerce").fillna(0).astype(int)
-
-    # Select candidates
-    to_repurchase = df_recv[
-        (df_recv["Days_Past_Due"] >= threshold) & (df_recv["Repurchase_Date"].isna())
-    ][["LoanID", "Due_Date"]].copy()
-
-    if not to_repurchase.empty:
-        to_repurchase["Repurchase_Date"] = pd.to_datetime(report_date, format="%Y%m%d").normalize()
-        to_repurchase["Finalized"] = "TRUE"
-
-    # Load prior Repurchases_Master
-    prior_blob = bucket.blob(build_investor_path(investor, "master", f"Repurchases_Master_{prior_date}.csv"))
-    try:
-        existing = pd.read_csv(io.StringIO(prior_blob.download_as_text()), dtype={"LoanID": str})
-        existing["Due_Date"] = pd.to_datetime(existing["Due_Date"], errors="coerce").dt.normalize()
-        existing["Repurchase_Date"] = pd.to_datetime(existing["Repurchase_Date"], errors="coerce").dt.normalize()
-        print(f"[INFO] Loaded cumulative Repurchases_Master from {prior_date}")
-    except Exception as e:
-        print(f"[WARN] No prior Repurchases_Master found: {e}")
-        existing = pd.DataFrame(columns=["LoanID", "Due_Date", "Repurchase_Date", "Finalized"])
-
-    # Combine and deduplicate
-    updated = pd.concat([existing, to_repurchase], ignore_index=True)
-    updated.drop_duplicates(subset=["LoanID", "Due_Date"], keep="last", inplace=True)
-
-    # Format dates
-    updated["Due_Date"] = pd.to_datetime(updated["Due_Date"], errors="coerce").dt.strftime("%Y-%m-%d")
-    updated["Repurchase_Date"] = pd.to_datetime(updated["Repurchase_Date"], errors="coerce").dt.strftime("%Y-%m-%d")
-
-    # Always save back under current report date
-    master_blob = bucket.blob(build_investor_path(investor, "master", f"Repurchases_Master_{report_date}.csv"))
-    buffer = io.StringIO()
-    updated.to_csv(buffer, index=False)
-    master_blob.upload_from_string(buffer.getvalue(), content_type="text/csv")
-
-    # Re-generate Receivables_Allocated using this cumulative file
-    generate_receivables_allocated(report_date=report_date, bucket=GCS_BUCKET, prior_report_date=prior_date, investor=investor)
-
-    if to_repurchase.empty:
-        flash("✅ No new repurchases needed. Prior repurchases were carried forward.")
-    else:
-        flash(f"✅ Finalised {len(to_repurchase)} new repurchases and updated receivables.")
-    return redirect(url_for("payment_summary_route", report_date=report_date, investor=investor))
+    job_id = submit_job(
+        "finalise-repurchases", finalise_repurchases,
+        bucket_name=GCS_BUCKET,
+        investor=investor,
+        report_date=report_date,
+        prior_date=prior_date,
+        threshold=threshold
+    )
+    return redirect(url_for("job_status", job_id=job_id, investor=investor))
+
+
+@app.route("/jobs/<job_id>")
+@require_investor
+def job_status(investor, job_id):
+    """
+    Progress page for a background job; redirects to the job's result page once it is done.
+    """
+    from scripts.jobs import get_job
+
+    job = get_job(job_id)
+    if job is None or job["investor"] != investor:
+        # Jobs are only known to the instance that started them (see scripts/jobs.py)
+        flash("❌ Unknown job. If it was just started, the app may be running on more than one instance.")
+        return redirect(url_for("upload_routes", investor=investor))
+
+    if job["status"] == "failed":
+        for message in job["messages"]:
+            flash(message)
+        flash(f"❌ {job['kind'].capitalize()} failed: {job['error']}")
+        return redirect(url_for("upload_routes", investor=investor))
+    if job["status"] == "done":
+        for message in job["messages"]:
+            flash(message)
+        return redirect(url_for(job["redirect"]["endpoint"], **job["redirect"]["params"]))
+
+    return render_template("job_status.html", job=job, investor=investor)
+
+
+@app.route("/jobs/<job_id>/status")
+@require_investor
+def job_status_json(investor, job_id):
+    """
+    Job status as JSON: status, current stage, rows and elapsed seconds per stage.
+    """
+    from flask import jsonify
+    from scripts.jobs import get_job
+
+    job = get_job(job_id)
+    if job is None or job["investor"] != investor:
+        return jsonify(error="Unknown job."), 404
+    return jsonify({key: job[key] for key in (
+        "id", "kind", "report_date", "status", "stage", "stages", "elapsed", "error", "created_at", "updated_at"
+    )})
 
 
 @app.route("/payment-summary")
@@ -537,92 +467,64 @@ def download_utilisation_route(investor):
 @app.route("/download_all_masters")
 @require_investor
 def download_all_masters(investor):
-    import io
-    import zipfile
-    from flask import send_file, request, redirect, flash
-    from google.cloud import storage
+    from flask import request, redirect, flash
+    from scripts.masters import master_blob_paths
+    from scripts.zip_downloads import zip_response
 
     report_date = request.args.get("report_date")
     if not report_date:
         flash("❌ No report date provided.")
         return redirect(url_for("summary", investor=investor))
 
-    client = storage.Client()
-    bucket = client.bucket(GCS_BUCKET)
+    bucket = get_bucket(GCS_BUCKET)
 
-    # 1. List every blob under master/ and filter by date suffix
-    blobs = bucket.list_blobs(prefix=f"Investors/{investor}/master/")
-    master_blobs = [
-        b for b in blobs
-        if b.name.lower().endswith(f"_{report_date}.csv")
+    # 1. Master files for the date, from the investor's catalog
+    #    (segmented masters are listed under their CSV name)
+    catalog = load_catalog(bucket, investor)
+    master_paths = [
+        build_investor_path(investor, "master", name)
+        for name in catalog["masters"].get(report_date, [])
     ]
 
-    if not master_blobs:
+    if not master_paths:
         flash(f"❌ No master files found for {report_date}.")
         return redirect(url_for("summary", investor=investor))
 
-    # 2. Zip them in-memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for blob in master_blobs:
-            data = blob.download_as_bytes()
-            filename = blob.name.split("/")[-1]
-            zipf.writestr(filename, data)
-
-    zip_buffer.seek(0)
-
-    # 3. Send as a single ZIP download
-    return send_file(
-        zip_buffer,
-        mimetype="application/zip",
-        as_attachment=True,
-        download_name=f"Master_Files_{report_date}.zip"
-    )
+    # 2. Stream them as a single ZIP, joining a segmented master's segments into one CSV
+    entries = [(path.split("/")[-1], master_blob_paths(bucket, path)) for path in master_paths]
+    return zip_response(bucket, investor, "master_files_zip", entries, f"Master_Files_{report_date}.zip")
 
 
 @app.route("/download_allocations")
 @require_investor
 def download_allocations(investor):
-    import io
-    import zipfile
-    from flask import send_file, request, redirect, flash
-    from google.cloud import storage
+    from flask import request, redirect, flash
+    from scripts.zip_downloads import zip_response
 
     report_date = request.args.get("report_date")
     if not report_date:
         flash("❌ No report date provided.")
         return redirect(url_for("summary", investor=investor))
 
-    client = storage.Client()
-    bucket = client.bucket(GCS_BUCKET)
-
-    # find all outputs ending in _{report_date}.csv
-    blobs = bucket.list_blobs(prefix=f"Investors/{investor}/outputs/")
-    alloc_blobs = [
-        b for b in blobs
-        if b.name.lower().endswith(f"_{report_date}.csv")
-           and ("receivables_allocated" in b.name.lower()
-                or "payments_allocated" in b.name.lower())
+    bucket = get_bucket(GCS_BUCKET)
+
+    # find all outputs ending in _{report_date}.csv (from the investor's catalog)
+    catalog = load_catalog(bucket, investor)
+    alloc_paths = [
+        build_investor_path(investor, "outputs", name)
+        for name in catalog["outputs"].get(report_date, [])
+        if name.lower().endswith(f"_{report_date}.csv")
+           and ("receivables_allocated" in name.lower()
+                or "payments_allocated" in name.lower()
+                or "payment_allocations" in name.lower())
     ]
 
-    if not alloc_blobs:
+    if not alloc_paths:
         flash(f"❌ No allocation files found for {report_date}.")
         return redirect(url_for("summary", investor=investor))
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-        for blob in alloc_blobs:
-            data = blob.download_as_bytes()
-            fname = blob.name.split("/")[-1]
-            z.writestr(fname, data)
-    buf.seek(0)
-
-    return send_file(
-        buf,
-        mimetype="application/zip",
-        as_attachment=True,
-        download_name=f"Allocations_{report_date}.zip"
-    )
+    entries = [(path.split("/")[-1], [path]) for path in alloc_paths]
+    return zip_response(bucket, investor, "allocations_zip", entries, f"Allocations_{report_date}.zip")
 
 
 
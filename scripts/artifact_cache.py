@@ -0,0 +1,193 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from flask import send_file
+from scripts.debiflow_gcs import GCS_UPLOAD_CHUNK_SIZE
+from scripts.masters import source_generations
+from scripts.utils import build_investor_path
+
+# Content-addressed cache of rendered downloads (PDFs, ZIPs). An artifact's key is
+# <kind>_<slot>_<digest>: the slot hashes what is rendered (its kind and input paths), the
+# digest what it was rendered from (template version, any rendered values not read from
+# blobs such as the date printed on a PDF, and the GCS generation of every input blob). A
+# regenerated input gives a new key, so stale artifacts are never hit again. Artifacts are
+# kept in ARTIFACT_CACHE_DIR (oldest dropped past ARTIFACT_CACHE_MB) and under the
+# investor's cache/ folder, which every container shares; storing an artifact there
+# deletes the earlier entries of its slot.
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "/tmp/debiflow_artifacts")
+ARTIFACT_CACHE_MB = int(os.getenv("ARTIFACT_CACHE_MB", "256"))
+CACHE_FOLDER = "cache"
+
+
+def artifact_key(bucket, kind, version, input_paths, extra=()):
+    """
+    Cache key for an artifact built from input_paths, or None when an input is missing
+    (the artifact is then built without caching). A master CSV path is keyed by its
+    manifest's generation when it is segmented.
+    """
+    generations = source_generations(bucket, input_paths)
+    slot = hashlib.sha256(kind.encode())
+    digest = hashlib.sha256(f"{version}\0{chr(0).join(map(str, extra))}".encode())
+    for path, generation in generations.items():
+        if generation is None:
+            print(f"[INFO] {path} not found, {kind} will not be cached")
+            return None
+        slot.update(f"\0{path}".encode())
+        digest.update(f"\0{generation}".encode())
+    return f"{kind}_{slot.hexdigest()[:16]}_{digest.hexdigest()[:16]}"
+
+
+def _local_path(key, suffix):
+    return os.path.join(ARTIFACT_CACHE_DIR, f"{key}{suffix}")
+
+
+def _cache_blob_path(investor, key, suffix):
+    return build_investor_path(investor, CACHE_FOLDER, f"{key}{suffix}")
+
+
+def cached_artifact(bucket, investor, key, suffix):
+    """
+    Local path of a cached artifact, copying it from the bucket on a local miss; None when
+    it has not been built yet.
+    """
+    t0 = time.time()
+    path = _local_path(key, suffix)
+    try:
+        os.utime(path)
+        print(f"[TIMER] Artifact cache hit for {key}{suffix} (local) in {time.time() - t0:.2f}s")
+        return path
+    except FileNotFoundError:
+        pass  # not cached here, or just pruned by another worker
+
+    blob = bucket.get_blob(_cache_blob_path(investor, key, suffix))
+    if blob is None:
+        print(f"[INFO] Artifact cache miss for {key}{suffix}")
+        return None
+    os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=ARTIFACT_CACHE_DIR, suffix=".part")
+    os.close(fd)
+    try:
+        blob.download_to_filename(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    print(f"[TIMER] Artifact cache hit for {key}{suffix} (bucket) in {time.time() - t0:.2f}s")
+    _prune()
+    return path
+
+
+def store_artifact(bucket, investor, key, suffix, data=None, tmp_path=None):
+    """
+    Add an artifact (data bytes, or a finished temporary file in ARTIFACT_CACHE_DIR) to the
+    local cache and upload it to the bucket in the background. Returns its local path.
+    """
+    os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+    if tmp_path is None:
+        fd, tmp_path = tempfile.mkstemp(dir=ARTIFACT_CACHE_DIR, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    path = _local_path(key, suffix)
+    os.replace(tmp_path, path)
+    threading.Thread(target=_upload, args=(bucket, investor, key, suffix, path), daemon=True).start()
+    _prune()
+    return path
+
+
+def _upload(bucket, investor, key, suffix, local_path):
+    blob_path = _cache_blob_path(investor, key, suffix)
+    try:
+        blob = bucket.blob(blob_path, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
+        blob.upload_from_filename(local_path)
+        print(f"[INFO] Cached artifact uploaded to gs://{bucket.name}/{blob_path}")
+    except Exception as e:
+        # The local copy may already have been pruned; the artifact is simply rebuilt later
+        print(f"[WARN] Could not upload cached artifact {blob_path}: {e}")
+        return
+
+    # Earlier entries of the slot were built from older inputs, version or render date
+    slot_prefix = _cache_blob_path(investor, key.rsplit("_", 1)[0] + "_", "")
+    try:
+        for stale in bucket.list_blobs(prefix=slot_prefix):
+            if stale.name != blob_path:
+                stale.delete()
+                print(f"[INFO] Deleted stale cached artifact gs://{bucket.name}/{stale.name}")
+    except Exception as e:
+        print(f"[WARN] Could not delete stale cached artifacts under {slot_prefix}: {e}")
+
+
+def _prune():
+    """
+    Drop the least recently used local artifacts once the cache is over ARTIFACT_CACHE_MB.
+    Other workers prune the same directory, so files may vanish at any point.
+    """
+    try:
+        entries = []
+        for entry in os.scandir(ARTIFACT_CACHE_DIR):
+            if entry.name.endswith(".part"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        # The newest artifact is kept even on its own over the limit: it is about to be sent
+        while len(entries) > 1 and size > ARTIFACT_CACHE_MB * 1024 * 1024:
+            _, entry_size, path = entries.pop(0)
+            size -= entry_size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    except OSError as e:
+        print(f"[WARN] Artifact cache prune failed: {e}")
+
+
+def tee_artifact(chunks, bucket, investor, key, suffix):
+    """
+    Pass a streamed artifact's chunks through while spooling them to a temporary file,
+    which is stored as the artifact once the stream completes (and discarded if it does not).
+    """
+    os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=ARTIFACT_CACHE_DIR, suffix=".part")
+    stored = False
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            for chunk in chunks:
+                spool.write(chunk)
+                yield chunk
+        store_artifact(bucket, investor, key, suffix, tmp_path=tmp_path)
+        stored = True
+    finally:
+        if not stored and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def send_artifact(path, mimetype, download_name):
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
+
+def serve_artifact(bucket, investor, kind, version, input_paths, build, mimetype, download_name, extra=()):
+    """
+    Response for an artifact built by build() -> bytes from input_paths: served from the
+    cache when this kind, version, extra and input generations were built before,
+    otherwise built, cached and sent.
+    """
+    key = artifact_key(bucket, kind, version, input_paths, extra)
+    if key is not None:
+        path = cached_artifact(bucket, investor, key, os.path.splitext(download_name)[1])
+        if path is not None:
+            return send_artifact(path, mimetype, download_name)
+
+    t0 = time.time()
+    data = build()
+    print(f"[TIMER] Built {download_name} in {time.time() - t0:.2f}s")
+    if key is None:
+        return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True, download_name=download_name)
+    path = store_artifact(bucket, investor, key, os.path.splitext(download_name)[1], data=data)
+    return send_artifact(path, mimetype, download_name)
@@ -0,0 +1,206 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+# Headless batch runs of the /confirm pipeline (merge masters, Payments_Allocated,
+# Receivables_Allocated) for many investors and report dates, e.g. at month end:
+#
+#   python -m scripts.batch --investors Acme Beta --from 20240101 --to 20240131
+#   python -m scripts.batch --all-investors --dates 20240126
+#   python -m scripts.batch --investors Acme --from 20240112 --plan
+#
+# Each investor runs in its own process (at most --workers at once) and confirms its dates
+# in order, since every period merges onto the previous one; an investor stops at its
+# first failed date. Prints per-stage timings and exits with status 1 if anything failed.
+# Stages whose build records show them up to date are skipped (see scripts.builds); --plan
+# only prints which stages would run and why.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+
+
+class BatchProgress:
+    """
+    Stands in for jobs.JobProgress outside the web app: keeps stage timings, row counts and
+    messages in memory for the report instead of writing them to the jobs table.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.stages = []
+        self.messages = []
+
+    @contextmanager
+    def stage(self, name):
+        entry = {"name": name, "rows": 0, "elapsed": None}
+        self.stages.append(entry)
+        t0 = time.time()
+        try:
+            yield entry
+        finally:
+            entry["elapsed"] = round(time.time() - t0, 2)
+            print(f"[TIMER] {self.label} stage '{name}': {entry['elapsed']:.2f}s ({entry['rows']:,} rows)")
+
+    def rows(self, count):
+        if self.stages and count:
+            self.stages[-1]["rows"] += int(count)
+
+    def message(self, text):
+        self.messages.append(text)
+
+
+def investor_dates(bucket_name, investor, dates=None, date_from=None, date_to=None):
+    """
+    Report dates to confirm for the investor, ascending: the given dates, or every date
+    with a complete raw batch between date_from and date_to (inclusive).
+    """
+    from scripts.catalog import load_catalog, complete_raw_dates
+    from scripts.debiflow_gcs import get_bucket
+
+    if dates:
+        return sorted(set(dates))
+    complete = complete_raw_dates(load_catalog(get_bucket(bucket_name), investor))
+    return [d for d in complete if (not date_from or d >= date_from) and (not date_to or d <= date_to)]
+
+
+def run_investor(bucket_name, investor, dates=None, date_from=None, date_to=None, full_recompute=False):
+    """
+    Confirm each of the investor's report dates in order (confirm_period, as /confirm runs
+    it). Returns one result per date attempted; a failed date ends the run.
+    """
+    from scripts.file_tracker import get_reporting_dates
+    from scripts.period_jobs import confirm_period
+
+    results = []
+    report_dates = investor_dates(bucket_name, investor, dates, date_from, date_to)
+    if not report_dates:
+        print(f"[WARN] No report dates to confirm for {investor}")
+    for report_date in report_dates:
+        t0 = time.time()
+        progress = BatchProgress(f"{investor} {report_date}")
+        result = {"investor": investor, "report_date": report_date, "previous": None,
+                  "stages": progress.stages, "messages": progress.messages}
+        try:
+            _, previous = get_reporting_dates(bucket_name, reference_date=report_date, investor=investor)
+            result["previous"] = previous
+            if not previous:
+                raise RuntimeError("No previous master reporting period found")
+            # Raises unless every output of the period was produced and saved
+            confirm_period(progress, bucket_name, investor, report_date, previous, full_recompute=full_recompute)
+            result["ok"], result["error"] = True, None
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        result["elapsed"] = round(time.time() - t0, 2)
+        results.append(result)
+        if not result["ok"]:
+            print(f"[ERROR] {investor} {report_date} failed, skipping its later dates: {result['error']}")
+            break
+    return results
+
+
+def run_batch(bucket_name, investors, dates=None, date_from=None, date_to=None, full_recompute=False, workers=None):
+    """
+    run_investor for every investor on a process pool. Returns all results, by investor.
+    """
+    workers = max(1, min(workers or BATCH_WORKERS, len(investors)))
+    results = []
+    # spawn: workers must not inherit this process's storage connections (as in scripts.jobs)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(run_investor, bucket_name, investor, dates, date_from, date_to, full_recompute): investor
+            for investor in investors
+        }
+        for future in as_completed(futures):
+            investor = futures[future]
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                results.append({"investor": investor, "report_date": None, "ok": False, "error": str(e),
+                                "stages": [], "messages": [], "elapsed": None})
+    return sorted(results, key=lambda r: (r["investor"], r["report_date"] or ""))
+
+
+def print_report(results, elapsed):
+    print("\n==== Batch report ====")
+    for result in results:
+        status = "OK" if result["ok"] else "FAILED"
+        took = f"{result['elapsed']:.2f}s" if result["elapsed"] is not None else "-"
+        print(f"{result['investor']} {result['report_date'] or '-'} (previous {result.get('previous') or '-'}): {status} in {took}")
+        for stage in result["stages"]:
+            elapsed_s = f"{stage['elapsed']:.2f}s" if stage["elapsed"] is not None else "-"
+            print(f"    {stage['name']:<32} {elapsed_s:>9} {stage['rows']:>12,} rows")
+        if result["error"]:
+            print(f"    error: {result['error']}")
+            for message in result["messages"]:
+                if message.startswith("❌"):
+                    print(f"    {message}")
+    failed = [r for r in results if not r["ok"]]
+    print(f"{len(results) - len(failed)} of {len(results)} periods confirmed in {elapsed:.2f}s, {len(failed)} failed")
+
+
+def print_plan(bucket_name, investors, dates=None, date_from=None, date_to=None, full_recompute=False):
+    """
+    The stages a batch run would rebuild, with the reason, without running anything.
+    """
+    from scripts.builds import plan
+    from scripts.debiflow_gcs import get_bucket
+
+    bucket = get_bucket(bucket_name)
+    print("\n==== Build plan ====")
+    for investor in investors:
+        report_dates = investor_dates(bucket_name, investor, dates, date_from, date_to)
+        for report_date, previous, stages in plan(bucket, investor, report_dates, force=full_recompute):
+            print(f"{investor} {report_date} (previous {previous or '-'}): "
+                  f"{'up to date' if not stages else f'{len(stages)} stages to run'}")
+            for stage, reason in stages:
+                print(f"    {stage:<32} {reason}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Confirm report dates for one or more investors without the web app.")
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument("--investors", nargs="+", help="investor names")
+    who.add_argument("--all-investors", action="store_true", help="every investor in the bucket")
+    when = parser.add_mutually_exclusive_group(required=True)
+    when.add_argument("--dates", nargs="+", help="report dates (YYYYMMDD)")
+    when.add_argument("--from", dest="date_from", help="first report date of a range (YYYYMMDD)")
+    parser.add_argument("--to", dest="date_to", help="last report date of a range (YYYYMMDD, default: latest)")
+    parser.add_argument("--bucket", default=os.getenv("GCS_BUCKET", "debiflow-staging"))
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="investors processed at once")
+    parser.add_argument("--full-recompute", action="store_true", help="recompute allocations from scratch")
+    parser.add_argument("--plan", action="store_true", help="only show the stages that would be rebuilt")
+    args = parser.parse_args(argv)
+
+    from scripts.debiflow_gcs import get_bucket
+    from scripts.portfolio import list_investors
+
+    known = list_investors(get_bucket(args.bucket))
+    investors = known if args.all_investors else args.investors
+    unknown = sorted(set(investors) - set(known))
+    if unknown:
+        print(f"[ERROR] Unknown investors: {', '.join(unknown)}")
+        return 1
+    if not investors:
+        print("[ERROR] No investors to process")
+        return 1
+
+    if args.plan:
+        print_plan(args.bucket, investors, dates=args.dates, date_from=args.date_from, date_to=args.date_to,
+                   full_recompute=args.full_recompute)
+        return 0
+
+    t0 = time.time()
+    print(f"[INFO] Batch confirm for {len(investors)} investors on gs://{args.bucket} ({args.workers} workers)")
+    results = run_batch(
+        args.bucket, investors, dates=args.dates, date_from=args.date_from, date_to=args.date_to,
+        full_recompute=args.full_recompute, workers=args.workers
+    )
+    print_report(results, time.time() - t0)
+    return 0 if results and all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import json
+import time
+from datetime import datetime
+from scripts.catalog import load_catalog, master_dates
+from scripts.debiflow_gcs import DebiFlowGCS
+from scripts.masters import source_blobs
+from scripts.utils import build_investor_path
+
+# Build records: each /confirm stage that runs writes meta/builds/<stage>_<date>.json
+# listing its input and output blobs with their content fingerprints (crc32c, or the
+# generation when a blob has none) and the stage's code version. A stage is up to date
+# when its record matches the blobs as they are now. The planner works through a period's
+# stages in order (merges, then Payments_Allocated, then Receivables_Allocated), and from
+# one period to the next: a stage that has to run will rewrite its outputs, so every later
+# stage reading one of them has to run as well. This is how correcting an earlier master
+# reaches the later periods built on top of it.
+#
+# Bump a stage's version when its logic changes, so existing outputs are rebuilt
+BUILD_VERSIONS = {"merge": "1", "payments": "1", "receivables": "1"}
+MERGE_PREFIXES = ["Schedule_", "CustomerDetails_", "Payments_", "HP_Repayments_"]
+PERIOD_STAGES = [f"merge:{prefix}" for prefix in MERGE_PREFIXES] + ["payments", "receivables"]
+
+
+def stage_io(investor, stage, report_date, previous):
+    """
+    (inputs, outputs) blob paths of a period stage: "merge:<prefix>", "payments" or
+    "receivables". Payments_Allocated only depends on the two masters: an incremental
+    allocation reproduces a full one. Its allocation state is a cache, not an output.
+    """
+    def master(name):
+        return build_investor_path(investor, "master", name)
+
+    def output(name):
+        return build_investor_path(investor, "outputs", name)
+
+    if stage.startswith("merge:"):
+        prefix = stage.split(":", 1)[1]
+        inputs = [build_investor_path(investor, "raw", f"{prefix}{report_date}.csv"), master(f"{prefix}Master_{previous}.csv")]
+        return inputs, [master(f"{prefix}Master_{report_date}.csv")]
+    if stage == "payments":
+        inputs = [master(f"Payments_Master_{report_date}.csv"), master(f"Schedule_Master_{report_date}.csv")]
+        return inputs, [output(f"Payments_Allocated_{report_date}.csv"), output(f"Payment_Allocations_{report_date}.csv")]
+    if stage == "receivables":
+        inputs = [
+            master(f"Schedule_Master_{report_date}.csv"),
+            output(f"Payment_Allocations_{report_date}.csv"),
+            master(f"Repurchases_Master_{previous}.csv"),
+            master(f"Repurchases_Master_{report_date}.csv"),
+        ]
+        return inputs, [output(f"Receivables_Allocated_{report_date}.csv"), output(f"Loan_Snapshot_{report_date}.csv")]
+    raise ValueError(f"Unknown build stage: {stage}")
+
+
+def record_path(investor, stage, report_date):
+    return build_investor_path(investor, "meta", f"builds/{stage.replace(':', '_').rstrip('_')}_{report_date}.json")
+
+
+def fingerprint(blob):
+    if blob is None:
+        return None
+    return f"crc32c:{blob.crc32c}" if blob.crc32c else f"generation:{blob.generation}"
+
+
+def plan_period(bucket, investor, report_date, previous, stages=None, changing=None, force=False):
+    """
+    Stages of the period that have to run, as [(stage, reason)] in build order. changing is
+    the set of blobs earlier planned stages will rewrite; it is extended with the outputs
+    of the stages planned here. force plans every stage.
+    """
+    t0 = time.time()
+    stages = stages or PERIOD_STAGES
+    changing = set() if changing is None else changing
+    io = {stage: stage_io(investor, stage, report_date, previous) for stage in stages}
+    paths = sorted({path for inputs, outputs in io.values() for path in inputs + outputs})
+    current = {path: fingerprint(blob) for path, blob in source_blobs(bucket, paths).items()}
+    records = DebiFlowGCS.from_bucket(bucket).fetch_many(
+        [record_path(investor, stage, report_date) for stage in stages], missing_ok=True
+    )
+
+    planned = []
+    for stage in stages:
+        inputs, outputs = io[stage]
+        data = records[record_path(investor, stage, report_date)]
+        record = json.loads(data) if data is not None else None
+        reason = None
+        if force:
+            reason = "full recompute requested"
+        elif any(path in changing for path in inputs):
+            reason = f"input rebuilt: {', '.join(p.rsplit('/', 1)[-1] for p in inputs if p in changing)}"
+        elif record is None:
+            reason = "no build record"
+        elif record.get("version") != BUILD_VERSIONS[stage.split(':')[0]]:
+            reason = f"code version {record.get('version')} → {BUILD_VERSIONS[stage.split(':')[0]]}"
+        elif record.get("previous") != previous:
+            reason = f"previous period {record.get('previous')} → {previous}"
+        else:
+            changed = [p for p in inputs if record["inputs"].get(p) != current[p]]
+            missing = [p for p in outputs if current[p] is None or record["outputs"].get(p) != current[p]]
+            if changed:
+                reason = f"input changed: {', '.join(p.rsplit('/', 1)[-1] for p in changed)}"
+            elif missing:
+                reason = f"output missing or replaced: {', '.join(p.rsplit('/', 1)[-1] for p in missing)}"
+        if reason:
+            planned.append((stage, reason))
+            changing.update(outputs)
+    print(f"[TIMER] Build plan for {investor} {report_date} in {time.time() - t0:.2f}s: "
+          f"{', '.join(stage for stage, _ in planned) or 'up to date'}")
+    return planned
+
+
+def plan(bucket, investor, dates, force=False):
+    """
+    Build plan over several report dates (ascending), cascading rebuilt outputs into the
+    later periods. Returns [(report_date, previous, [(stage, reason)])].
+    """
+    catalog = load_catalog(bucket, investor)
+    known = master_dates(catalog) | set(dates)
+    changing = set()
+    result = []
+    for report_date in sorted(dates):
+        earlier = sorted(d for d in known if d < report_date)
+        previous = earlier[-1] if earlier else None
+        result.append((report_date, previous, plan_period(bucket, investor, report_date, previous, changing=changing, force=force)))
+    return result
+
+
+def record_build(bucket, investor, stage, report_date, previous):
+    """
+    Record what the stage was just built from: the fingerprints of its inputs and of the
+    outputs it wrote. Call once the outputs are uploaded.
+    """
+    inputs, outputs = stage_io(investor, stage, report_date, previous)
+    blobs = source_blobs(bucket, inputs + outputs)
+    record = {
+        "stage": stage,
+        "version": BUILD_VERSIONS[stage.split(":")[0]],
+        "report_date": report_date,
+        "previous": previous,
+        "inputs": {path: fingerprint(blobs[path]) for path in inputs},
+        "outputs": {path: fingerprint(blobs[path]) for path in outputs},
+        "built_at": datetime.utcnow().isoformat(timespec="seconds"),
+    }
+    bucket.blob(record_path(investor, stage, report_date)).upload_from_string(
+        json.dumps(record, indent=2), content_type="application/json"
+    )
+
+
+def later_periods(bucket, investor, report_date):
+    """
+    Confirmed periods after report_date, which build on its masters.
+    """
+    return sorted(d for d in master_dates(load_catalog(bucket, investor)) if d > report_date)
@@ -0,0 +1,127 @@
+import json
+import re
+import time
+from datetime import datetime
+from google.api_core import exceptions as gcs_exceptions
+from scripts.utils import build_investor_path
+
+# Per-investor index of what exists under raw/, master/ and outputs/, so resolving reporting
+# dates is one small read instead of listing every blob. The app records each blob it writes
+# with record_blobs(); rebuild_catalog() re-derives the whole index from a full listing
+# (first use, or after files were added or removed outside the app).
+REQUIRED_PREFIXES = ["Payments_", "Schedule_", "CustomerDetails_", "HP_Repayments_"]
+RAW_PATTERN = re.compile(r"(" + "|".join(REQUIRED_PREFIXES) + r")(\d{8})\.csv$")
+MASTER_PATTERN = re.compile(r"_Master_(\d{8})\.(?:csv|json)$")
+OUTPUT_PATTERN = re.compile(r"_(\d{8})\.csv(?:\.gz)?$")
+MAX_UPDATE_ATTEMPTS = 5
+
+
+def catalog_path(investor):
+    return build_investor_path(investor, "meta", "catalog.json")
+
+
+def _empty_catalog():
+    return {"raw": {}, "masters": {}, "outputs": {}}
+
+
+def _add_entry(entries, date, name):
+    names = entries.setdefault(date, [])
+    if name in names:
+        return False
+    names.append(name)
+    names.sort()
+    return True
+
+
+def _add_path(catalog, path):
+    """
+    Record one blob path in the catalog. Returns True if the catalog changed.
+    """
+    parts = path.split("/")
+    if len(parts) < 4:
+        return False
+    folder, name = parts[2], parts[-1]
+
+    if folder == "raw":
+        m = RAW_PATTERN.match(name)
+        return bool(m) and _add_entry(catalog["raw"], m.group(2), m.group(1))
+    if folder == "master":
+        m = MASTER_PATTERN.search(name)
+        # Segmented masters are listed under their CSV name, as downloads present them
+        return bool(m) and _add_entry(catalog["masters"], m.group(1), name[:-len(".json")] + ".csv" if name.endswith(".json") else name)
+    if folder == "outputs":
+        m = OUTPUT_PATTERN.search(name)
+        return bool(m) and _add_entry(catalog["outputs"], m.group(1), name)
+    return False
+
+
+def _save_catalog(bucket, investor, catalog, if_generation_match=None):
+    catalog["updated_at"] = datetime.utcnow().isoformat(timespec="seconds")
+    bucket.blob(catalog_path(investor)).upload_from_string(
+        json.dumps(catalog, indent=2, sort_keys=True),
+        content_type="application/json",
+        if_generation_match=if_generation_match
+    )
+
+
+def rebuild_catalog(bucket, investor):
+    """
+    Rebuild the catalog from a full listing of raw/, master/ and outputs/ and save it.
+    """
+    t0 = time.time()
+    catalog = _empty_catalog()
+    for folder in ("raw", "master", "outputs"):
+        for blob in bucket.list_blobs(prefix=build_investor_path(investor, folder, "")):
+            _add_path(catalog, blob.name)
+    _save_catalog(bucket, investor, catalog)
+    print(f"[TIMER] Rebuilt catalog for {investor} in {time.time() - t0:.2f}s")
+    return catalog
+
+
+def load_catalog(bucket, investor):
+    """
+    The investor's catalog, built from a listing the first time it is needed.
+    """
+    blob = bucket.get_blob(catalog_path(investor))
+    if blob is None:
+        print(f"[INFO] No catalog for {investor} yet, building it")
+        return rebuild_catalog(bucket, investor)
+    return json.loads(blob.download_as_text())
+
+
+def record_blobs(bucket, investor, paths):
+    """
+    Add blobs the app has just written. The update is guarded by the catalog's generation,
+    so two writers retry instead of overwriting each other's entries.
+    """
+    paths = list(paths)
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        blob = bucket.get_blob(catalog_path(investor))
+        if blob is None:
+            # A fresh listing already contains the new blobs
+            return rebuild_catalog(bucket, investor)
+        catalog = json.loads(blob.download_as_text())
+        changed = [_add_path(catalog, path) for path in paths]
+        if not any(changed):
+            return catalog
+        try:
+            _save_catalog(bucket, investor, catalog, if_generation_match=blob.generation)
+            return catalog
+        except gcs_exceptions.PreconditionFailed:
+            print(f"[INFO] Catalog for {investor} changed concurrently, retrying update")
+    print(f"[WARN] Catalog update for {investor} kept conflicting, rebuilding from listing")
+    return rebuild_catalog(bucket, investor)
+
+
+def complete_raw_dates(catalog):
+    """
+    Sorted raw dates for which all four required files are present.
+    """
+    return sorted(
+        date for date, prefixes in catalog["raw"].items()
+        if len(prefixes) == len(REQUIRED_PREFIXES)
+    )
+
+
+def master_dates(catalog):
+    return set(catalog["masters"])
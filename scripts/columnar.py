@@ -0,0 +1,199 @@
+import csv
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from scripts.debiflow_gcs import DebiFlowGCS
+
+# Every *_Master_<date>.csv / *_Allocated_<date>.csv gets a typed Parquet copy next to it.
+# CSV stays the user-facing format; the copy is only used when it was written from the
+# current generation of the CSV, so a CSV replaced by hand is never shadowed by a stale copy.
+# The copy holds what the typed loader reads from that CSV (loader.parse_table: the schema's
+# types, never inferred ones), so loading either gives the same frame.
+# Compact mode (COMPACT_FRAMES=1, the default) keeps frames in their smallest lossless form:
+# see loader.apply_schema
+COMPACT_FRAMES = os.getenv("COMPACT_FRAMES", "1") == "1"
+# Copies typed by an earlier, inference-based writer carry no "typing" tag and are ignored
+PARQUET_TYPING = "schema"
+ARROW_TYPES = {
+    "str": pa.string(), "category": pa.dictionary(pa.int32(), pa.string()), "float": pa.float64(), "int": pa.int64()
+}
+
+
+def parquet_path(csv_path):
+    return csv_path[:-len(".csv")] + ".parquet"
+
+
+def write_table(bucket, csv_path, df):
+    """
+    Upload df as CSV, then its typed Parquet copy tagged with the CSV blob's generation.
+    A failed Parquet write only logs a warning: readers fall back to the CSV. Returns the
+    typed frame (what load_table will load), or None if it could not be built.
+    """
+    return write_tables(bucket, [(csv_path, df)])[0]
+
+
+def write_tables(bucket, tables, uploads=()):
+    """
+    write_table for several (csv_path, df) at once: the CSVs, plus any ready-made uploads
+    in put_many form, go up together, then the Parquet copies do. Returns the typed frames
+    in table order.
+    """
+    # Imported here: the loader reads tables through this module
+    from scripts.loader import parse_table
+
+    t0 = time.time()
+    tables = list(tables)
+    gcs = DebiFlowGCS.from_bucket(bucket)
+    csv_data = []
+    for _, df in tables:
+        buffer = io.BytesIO()
+        df.to_csv(buffer, index=False, encoding="utf-8")
+        csv_data.append(buffer.getvalue())
+    csv_blobs = gcs.put_many([(path, data, "text/csv") for (path, _), data in zip(tables, csv_data)] + list(uploads))
+
+    typed_frames, copies = [], []
+    for (csv_path, _), data, csv_blob in zip(tables, csv_data, csv_blobs):
+        try:
+            typed = parse_table(csv_path, data)
+            buffer = io.BytesIO()
+            typed.to_parquet(buffer, index=False)
+            metadata = {"csv_generation": str(csv_blob.generation), "typing": PARQUET_TYPING}
+            copies.append((parquet_path(csv_path), buffer.getvalue(), "application/vnd.apache.parquet", metadata))
+        except Exception as e:
+            typed = None
+            print(f"[WARN] Parquet copy not written for {csv_path}: {e}")
+        typed_frames.append(typed)
+    try:
+        gcs.put_many(copies)
+    except Exception as e:
+        typed_frames = [None] * len(tables)
+        print(f"[WARN] Parquet copies not written for {', '.join(path for path, _ in tables)}: {e}")
+    print(f"[TIMER] Wrote {', '.join(path for path, _ in tables)} (+ parquet) in {time.time() - t0:.2f}s")
+    return typed_frames
+
+
+def parse_dates(values, date_format="%Y-%m-%d"):
+    """
+    pd.to_datetime with an explicit format, so the common case is one vectorised pass.
+    Values that do not match it (e.g. a legacy file in another format) fall back to
+    format inference, which is what the readers did for every value before.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values, format=date_format, errors="coerce")
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], errors="coerce")
+    return parsed
+
+
+def parse_csv(data, schema, columns=None):
+    """
+    Parse CSV bytes with pyarrow's multithreaded reader, typing the columns schema declares
+    and parsing its date columns with the schema's date_format. A value that does not fit
+    a declared type makes the read fall back to text for those columns, so apply_schema can
+    coerce them the way the old to_datetime / to_numeric(errors="coerce") cleaning did.
+    "category" columns are dictionary-encoded by the reader and arrive as categoricals.
+    """
+    header = next(csv.reader([data.split(b"\n", 1)[0].decode("utf-8-sig").rstrip("\r")]), [])
+    include = [col for col in header if columns is None or col in columns]
+    types = {col: ARROW_TYPES[kind] for col, kind in schema["dtypes"].items()}
+    types.update({col: pa.timestamp("ns") for col in schema["date_columns"]})
+    types = {col: kind for col, kind in types.items() if col in include}
+
+    def read(column_types):
+        return pa_csv.read_csv(
+            io.BytesIO(data),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types, include_columns=include, strings_can_be_null=True,
+                timestamp_parsers=[schema["date_format"]]
+            )
+        )
+
+    try:
+        table = read(types)
+    except pa.ArrowInvalid:
+        table = read({col: pa.string() for col in types})
+    df = table.to_pandas()
+    # Match read_csv: missing text is NaN (not None) and an all-blank column is float NaN
+    for field in table.schema:
+        if pa.types.is_null(field.type):
+            df[field.name] = np.nan
+        elif table.column(field.name).null_count and df[field.name].dtype == object:
+            df[field.name] = df[field.name].fillna(np.nan)
+    return df
+
+
+def _is_current_copy(metadata, csv_blob):
+    return metadata.get("csv_generation") == str(csv_blob.generation) and metadata.get("typing") == PARQUET_TYPING
+
+
+def _parse(source, data, columns, csv_kwargs):
+    if source.endswith(".parquet"):
+        buffer = io.BytesIO(data)
+        if columns is not None:
+            available = pq.ParquetFile(buffer).schema_arrow.names
+            columns = [col for col in available if col in columns]
+        return pd.read_parquet(buffer, columns=columns)
+
+    csv_kwargs = dict(csv_kwargs)
+    if csv_kwargs.get("schema") is not None:
+        return parse_csv(data, csv_kwargs["schema"], columns)
+    csv_kwargs.pop("schema", None)
+    csv_kwargs.setdefault("low_memory", False)
+    if columns is not None:
+        wanted = set(columns)
+        csv_kwargs["usecols"] = lambda col: col in wanted
+    return pd.read_csv(io.StringIO(data.decode("utf-8")), **csv_kwargs)
+
+
+def read_tables(bucket, csv_paths, columns=None, missing_ok=False, **csv_kwargs):
+    """
+    Load several tables at once, each from its Parquet copy when that copy matches the current
+    CSV. Metadata lookups and downloads go through DebiFlowGCS.stat_many / fetch_many, so they
+    overlap. columns is a list for every table or a {csv_path: list} dict (missing columns are
+    skipped, as with the CSV); csv_kwargs only apply to CSV fallbacks, and schema=<SCHEMAS
+    entry> parses those with parse_csv instead. Returns frames in path order, None for a
+    missing table when missing_ok.
+    """
+    t0 = time.time()
+    gcs = DebiFlowGCS.from_bucket(bucket)
+    csv_paths = list(csv_paths)
+    blobs = gcs.stat_many(csv_paths + [parquet_path(path) for path in csv_paths])
+    csv_blobs, pq_blobs = blobs[:len(csv_paths)], blobs[len(csv_paths):]
+
+    sources = []
+    for path, csv_blob, pq_blob in zip(csv_paths, csv_blobs, pq_blobs):
+        if csv_blob is None:
+            if not missing_ok:
+                raise FileNotFoundError(f"{path} not found")
+            sources.append(None)
+        elif pq_blob is not None and _is_current_copy(pq_blob.metadata or {}, csv_blob):
+            sources.append(parquet_path(path))
+        else:
+            sources.append(path)
+
+    payloads = gcs.fetch_many([source for source in sources if source])
+    frames = []
+    for path, source in zip(csv_paths, sources):
+        if source is None:
+            frames.append(None)
+            continue
+        table_columns = columns.get(path) if isinstance(columns, dict) else columns
+        frames.append(_parse(source, payloads[source], table_columns, csv_kwargs))
+        print(f"[TIMER] Loaded {source} in {time.time() - t0:.2f}s")
+    return frames
+
+
+def read_table(bucket, csv_path, columns=None, **csv_kwargs):
+    """
+    Load one table, preferring its Parquet copy when that copy matches the current CSV.
+    columns limits the load to the named columns (missing ones are skipped, as with the CSV).
+    csv_kwargs only apply to the CSV fallback.
+    """
+    return read_tables(bucket, [csv_path], columns=columns, **csv_kwargs)[0]
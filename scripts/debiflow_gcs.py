@@ -1,10 +1,107 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import google.auth
+from google.api_core import exceptions as gcs_exceptions
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from requests import exceptions as http_exceptions
+from requests.adapters import HTTPAdapter
 from scripts.utils import build_investor_path, require_investor
 
+# Batch blob I/O: at most GCS_MAX_CONCURRENCY transfers in flight, each retried on transient
+# errors with exponential backoff plus full jitter
+GCS_MAX_CONCURRENCY = int(os.getenv("GCS_MAX_CONCURRENCY", "8"))
+GCS_MAX_ATTEMPTS = int(os.getenv("GCS_MAX_ATTEMPTS", "5"))
+GCS_BACKOFF_BASE = 0.5
+GCS_BACKOFF_CAP = 16.0
+
+DEFAULT_BUCKET = os.getenv("GCS_BUCKET", "debiflow-staging")
+# Chunk size for streamed (resumable) uploads; must be a multiple of 256 KB
+GCS_UPLOAD_CHUNK_SIZE = int(os.getenv("GCS_UPLOAD_CHUNK_MB", "8")) * 1024 * 1024
+# Connections kept per host by the shared client: batch calls from several request threads share it
+GCS_HTTP_POOL_SIZE = int(os.getenv("GCS_HTTP_POOL_SIZE", "32"))
+
+TRANSIENT_ERRORS = (
+    gcs_exceptions.TooManyRequests,
+    gcs_exceptions.InternalServerError,
+    gcs_exceptions.BadGateway,
+    gcs_exceptions.ServiceUnavailable,
+    gcs_exceptions.GatewayTimeout,
+    http_exceptions.ConnectionError,
+    http_exceptions.Timeout,
+    ConnectionError,
+)
+
+# One authenticated client per process, shared by every route and generator. Created lazily
+# under a lock and re-created after a fork (gunicorn workers must not share the parent's sockets).
+_registry_lock = threading.Lock()
+_registry = {"pid": None, "client": None, "buckets": {}}
+
+
+def _new_client():
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=GCS_HTTP_POOL_SIZE, pool_maxsize=GCS_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+def get_client():
+    """
+    The process-wide storage client (credential discovery and connection pool are paid once).
+    """
+    with _registry_lock:
+        if _registry["client"] is None or _registry["pid"] != os.getpid():
+            t0 = time.time()
+            _registry.update(pid=os.getpid(), client=_new_client(), buckets={})
+            print(f"[TIMER] Storage client created in {time.time() - t0:.2f}s (pid {os.getpid()})")
+        return _registry["client"]
+
+
+def get_bucket(bucket_name: str = None):
+    """
+    Shared bucket handle for bucket_name (default GCS_BUCKET) on the process-wide client.
+    """
+    client = get_client()
+    bucket_name = bucket_name or DEFAULT_BUCKET
+    with _registry_lock:
+        if bucket_name not in _registry["buckets"]:
+            _registry["buckets"][bucket_name] = client.bucket(bucket_name)
+        return _registry["buckets"][bucket_name]
+
+
+def warm_up(bucket_name: str = None):
+    """
+    Create the client and open a connection with one cheap listing, so the first request
+    of a worker does not pay for credential discovery and TLS setup.
+    """
+    t0 = time.time()
+    try:
+        bucket = get_bucket(bucket_name)
+        list(bucket.list_blobs(max_results=1))
+        print(f"[TIMER] GCS warm-up for gs://{bucket.name}: {time.time() - t0:.2f}s")
+    except Exception as e:
+        print(f"[WARN] GCS warm-up failed: {e}")
+
+
 class DebiFlowGCS:
-    def __init__(self, bucket_name: str):
-        self.client = storage.Client()
-        self.bucket = self.client.bucket(bucket_name)
+    def __init__(self, bucket_name: str, client=None):
+        self.client = client or get_client()
+        self.bucket = get_bucket(bucket_name) if client is None else self.client.bucket(bucket_name)
+
+    @classmethod
+    def from_bucket(cls, bucket):
+        """
+        Wrap an existing bucket handle (reuses its client instead of creating one).
+        """
+        gcs = cls.__new__(cls)
+        gcs.client = bucket.client
+        gcs.bucket = bucket
+        return gcs
 
     def upload_file(self, local_path: str, gcs_path: str):
         blob = self.bucket.blob(gcs_path)
@@ -33,3 +130,128 @@ class DebiFlowGCS:
         blob.delete()
         print(f"🗑️ Deleted: gs://{self.bucket.name}/{gcs_path}")
 
+    def _with_retry(self, fn, *args):
+        for attempt in range(1, GCS_MAX_ATTEMPTS + 1):
+            try:
+                return fn(*args)
+            except TRANSIENT_ERRORS as e:
+                if attempt == GCS_MAX_ATTEMPTS:
+                    raise
+                delay = random.uniform(0, min(GCS_BACKOFF_CAP, GCS_BACKOFF_BASE * 2 ** (attempt - 1)))
+                print(f"[WARN] GCS attempt {attempt}/{GCS_MAX_ATTEMPTS} failed ({e}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _run_many(self, label, fn, items, max_workers=None):
+        """
+        Run fn(item) for every item on a bounded thread pool, with retries. Returns the
+        results in item order and prints batch timing plus the slowest call.
+        """
+        items = list(items)
+        if not items:
+            return []
+        t0 = time.time()
+        timings = []
+
+        def timed(item):
+            t_item = time.time()
+            result = self._with_retry(fn, item)
+            timings.append((time.time() - t_item, item))
+            return result
+
+        workers = max(1, min(max_workers or GCS_MAX_CONCURRENCY, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(timed, items))
+        slowest, slowest_item = max(timings, key=lambda t: t[0])
+        name = slowest_item[0] if isinstance(slowest_item, tuple) else slowest_item
+        print(f"[TIMER] {label}: {len(items)} blobs ({workers} concurrent) in {time.time() - t0:.2f}s, "
+              f"slowest {slowest:.2f}s ({name})")
+        return results
+
+    def stat_many(self, gcs_paths, max_workers=None):
+        """
+        Blob metadata (generation, metadata, size) for every path, None where it does not exist.
+        """
+        return self._run_many("stat_many", self.bucket.get_blob, gcs_paths, max_workers)
+
+    def fetch_many(self, gcs_paths, missing_ok=False, max_workers=None):
+        """
+        Download several blobs concurrently. Returns {path: bytes}; with missing_ok a missing
+        blob maps to None instead of raising NotFound.
+        """
+        def fetch(path):
+            try:
+                return self.bucket.blob(path).download_as_bytes()
+            except gcs_exceptions.NotFound:
+                if missing_ok:
+                    return None
+                raise
+
+        gcs_paths = list(gcs_paths)
+        return dict(zip(gcs_paths, self._run_many("fetch_many", fetch, gcs_paths, max_workers)))
+
+    def iter_many(self, gcs_paths, window=None):
+        """
+        Download blobs in path order, yielding (path, bytes) as each is ready while at most
+        window (default GCS_MAX_CONCURRENCY) of the following ones are prefetched, so memory
+        is bounded by the window rather than the batch. Closing the generator early cancels
+        the downloads not yet started.
+        """
+        gcs_paths = list(gcs_paths)
+        if not gcs_paths:
+            return
+        window = max(1, min(window or GCS_MAX_CONCURRENCY, len(gcs_paths)))
+        t0 = time.time()
+
+        def fetch(path):
+            return self._with_retry(lambda p: self.bucket.blob(p).download_as_bytes(), path)
+
+        pool = ThreadPoolExecutor(max_workers=window)
+        remaining = iter(gcs_paths)
+        pending = deque()
+        try:
+            for path in remaining:
+                pending.append((path, pool.submit(fetch, path)))
+                if len(pending) == window:
+                    break
+            while pending:
+                path, future = pending.popleft()
+                data = future.result()
+                following = next(remaining, None)
+                if following is not None:
+                    pending.append((following, pool.submit(fetch, following)))
+                elif not pending:
+                    print(f"[TIMER] iter_many: {len(gcs_paths)} blobs ({window} prefetched) in {time.time() - t0:.2f}s")
+                yield path, data
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def put_many(self, uploads, max_workers=None):
+        """
+        Upload several blobs concurrently. uploads is an iterable of
+        (path, data, content_type) or (path, data, content_type, metadata); data may be
+        bytes or str. Returns the uploaded blobs.
+        """
+        def put(upload):
+            path, data, content_type, *metadata = upload
+            blob = self.bucket.blob(path)
+            if metadata:
+                blob.metadata = metadata[0]
+            blob.upload_from_string(data, content_type=content_type)
+            return blob
+
+        return self._run_many("put_many", put, uploads, max_workers)
+
+    def put_streams(self, uploads, max_workers=None):
+        """
+        Stream several file objects to GCS concurrently as chunked resumable uploads, so no
+        file is held in memory. uploads is an iterable of (path, fileobj, content_type);
+        each file is rewound before every attempt. Returns the uploaded blobs.
+        """
+        def put(upload):
+            path, fileobj, content_type = upload
+            fileobj.seek(0)
+            blob = self.bucket.blob(path, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
+            blob.upload_from_file(fileobj, content_type=content_type)
+            return blob
+
+        return self._run_many("put_streams", put, uploads, max_workers)
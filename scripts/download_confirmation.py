@@ -1,13 +1,18 @@
-from flask import make_response, request, redirect, flash
-from io import BytesIO, StringIO
+from flask import request, redirect, flash
+from io import BytesIO
 from datetime import datetime
-import pandas as pd
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from google.cloud import storage
-from scripts.utils import build_investor_path, require_investor
+from scripts.debiflow_gcs import get_bucket
+from scripts.utils import build_investor_path
+from scripts.period_metrics import period_metrics
+from scripts.artifact_cache import serve_artifact
+
+# Bump when the PDF layout or wording changes, so cached copies are rebuilt
+TEMPLATE_VERSION = "1"
+
 
 def download_confirmation(bucket_name, investor):
     report_date = request.args.get("report_date")
@@ -15,32 +20,30 @@ def download_confirmation(bucket_name, investor):
         flash("❌ No report date provided.")
         return redirect("/")
 
-    # Initialize GCS client
-    gcs = storage.Client()
-    bucket = gcs.bucket(bucket_name)
-
-    # Load Receivables and Repayments data
-    recv_blob = bucket.blob(
-    build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv")
-)
-    df_recv = pd.read_csv(
-        StringIO(recv_blob.download_as_text()),
-        dtype={"LoanID": str},
-        low_memory=False
-    )
-    repay_blob = bucket.blob(
-    build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv")
-)
-    df_repay = pd.read_csv(
-        StringIO(repay_blob.download_as_text()),
-        low_memory=False
+    bucket = get_bucket(bucket_name)
+    today = datetime.now().strftime("%d %B %Y")
+
+    # Served from the artifact cache unless an input was regenerated (or the date changed)
+    inputs = [
+        build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv"),
+        build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv"),
+    ]
+    return serve_artifact(
+        bucket, investor, "repayment_request", TEMPLATE_VERSION, inputs,
+        lambda: build_repayment_request(bucket, investor, report_date, today),
+        "application/pdf", f"Repayment_Request_{report_date}.pdf", extra=[today]
     )
 
-    # Compute totals
-    total_due      = df_recv["Minimum_Recovery_Amount"].sum()
-    total_repaid   = df_repay["HP_Repayment_Amount"].sum()
+
+def build_repayment_request(bucket, investor, report_date, today):
+    """
+    Repayment Request PDF bytes for report_date, dated today.
+    """
+    # Totals from the period metrics sidecar
+    metrics = period_metrics(bucket, investor, report_date, ["receivables", "repayments"])
+    total_due      = metrics["receivables_sum"]
+    total_repaid   = metrics["repayments_sum"]
     net_amount_due = total_due - total_repaid
-    today = datetime.now().strftime("%d %B %Y")
 
     # Setup PDF canvas (A4 with 25 mm margins)
     buffer = BytesIO()
@@ -151,11 +154,4 @@ def download_confirmation(bucket_name, investor):
     # Finish PDF
     p.showPage()
     p.save()
-    buffer.seek(0)
-
-    response = make_response(buffer.read())
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = (
-        f"attachment; filename=Repayment_Request_{report_date}.pdf"
-    )
-    return response
+    return buffer.getvalue()
@@ -1,17 +1,16 @@
-from google.cloud import storage
-import re
-from collections import defaultdict
-from scripts.utils import build_investor_path
+from scripts.debiflow_gcs import get_bucket
+from scripts.catalog import REQUIRED_PREFIXES, load_catalog, rebuild_catalog, complete_raw_dates
+from scripts.catalog import master_dates as catalog_master_dates
 import os
 
-REQUIRED_PREFIXES = ["Payments_", "Schedule_", "CustomerDetails_", "HP_Repayments_"]
 RAW_FOLDER       = "raw/"
 MASTER_FOLDER    = "master/"
 DEFAULT_BUCKET   = os.getenv("GCS_BUCKET", "debiflow-staging")
 
 def get_reporting_dates(bucket_name: str = DEFAULT_BUCKET,
                         reference_date: str = None,
-                        investor: str = None):
+                        investor: str = None,
+                        rebuild: bool = False):
     """
     Always returns a tuple: (latest_raw, previous_master)
     
@@ -19,35 +18,16 @@ def get_reporting_dates(bucket_name: str = DEFAULT_BUCKET,
       ≤ reference_date (if given), or overall latest otherwise.
     - previous_master: the most recent master date < cutoff, where cutoff is
       reference_date if provided, or latest_raw otherwise.
-    """
-
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-
-    # === Collect master dates ===
-    master_prefix = build_investor_path(investor, "master", "")
-    master_dates = {
-        m.group(1)
-        for blob in bucket.list_blobs(prefix=master_prefix)
-        for m in [re.search(r"_Master_(\d{8})\.csv$", blob.name)]
-        if m
-    }
 
+    Dates are read from the investor's catalog; rebuild=True re-lists the bucket first.
+    """
 
-    # === Collect raw dates with complete prefixes ===
-    raw_map = defaultdict(set)
-    raw_prefix = build_investor_path(investor, "raw", "")
-    for blob in bucket.list_blobs(prefix=raw_prefix):
-        fname = os.path.basename(blob.name)
-        for prefix in REQUIRED_PREFIXES:
-            m = re.match(rf"{prefix}(\d{{8}})\.csv$", fname)
-            if m:
-                raw_map[m.group(1)].add(prefix)
+    bucket = get_bucket(bucket_name)
 
-    complete_raw = sorted(
-        dt for dt, prefixes in raw_map.items()
-        if len(prefixes) == len(REQUIRED_PREFIXES)
-    )
+    # === Master dates and complete raw dates come from the investor's catalog ===
+    catalog = rebuild_catalog(bucket, investor) if rebuild else load_catalog(bucket, investor)
+    master_dates = catalog_master_dates(catalog)
+    complete_raw = complete_raw_dates(catalog)
 
     # === If reference_date is given, filter both lists to ≤ reference_date ===
     if reference_date:
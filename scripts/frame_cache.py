@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from scripts.loader import load_table
+from scripts.masters import manifest_path
+
+# In-process LRU of cleaned, typed DataFrames keyed by (blob path, GCS generation, cleaner).
+# A regenerated blob has a new generation, so its old entry is simply never hit again (and is
+# dropped as soon as the new one is stored). Entries are evicted least-recently-used first
+# once their combined in-memory size passes FRAME_CACHE_MB.
+FRAME_CACHE_MB = int(os.getenv("FRAME_CACHE_MB", "512"))
+
+
+class FrameCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            print(f"[WARN] {key[0]} ({nbytes / 1e6:.1f} MB) exceeds the frame cache, not cached")
+            return
+        with self._lock:
+            # Older generations of the same blob can no longer be hit
+            for stale in [k for k in self.entries if k[0] == key[0] and k != key]:
+                self._drop(stale)
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (df, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, nbytes = self.entries.pop(key)
+        self.size -= nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "size_mb": round(self.size / 1e6, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+FRAME_CACHE = FrameCache(FRAME_CACHE_MB * 1024 * 1024)
+
+
+def cached_table(bucket, csv_path, clean=None, columns=None, master=False):
+    """
+    Load csv_path with the typed loader (all columns) and apply clean once per blob
+    generation; later calls for the same generation are served from FRAME_CACHE. Returns a
+    copy limited to columns (missing ones are skipped, as with read_table). master=True keys
+    a master by its manifest's generation when it is segmented.
+    """
+    t0 = time.time()
+    blob = (master and bucket.get_blob(manifest_path(csv_path))) or bucket.get_blob(csv_path)
+    if blob is None:
+        raise FileNotFoundError(f"{csv_path} not found")
+    key = (csv_path, blob.generation, clean.__name__ if clean else None)
+
+    df = FRAME_CACHE.get(key)
+    status = "hit"
+    if df is None:
+        status = "miss"
+        df = load_table(bucket, csv_path)
+        if clean is not None:
+            df = clean(df)
+        FRAME_CACHE.put(key, df)
+
+    if columns is not None:
+        df = df[[col for col in df.columns if col in columns]]
+    stats = FRAME_CACHE.stats()
+    print(f"[TIMER] Frame cache {status} for {csv_path} in {time.time() - t0:.2f}s "
+          f"(hits {stats['hits']}, misses {stats['misses']}, {stats['size_mb']} MB cached)")
+    return df.copy()
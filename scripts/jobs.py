@@ -0,0 +1,180 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+# Long-running period jobs (/confirm, /finalise-repurchases) run on a local process pool
+# instead of inside the HTTP request. Each job is a row in a small SQLite table that the
+# worker process updates as it moves through its stages, so any request in the same
+# container can report progress. No broker: the web worker that accepts a job owns the
+# pool that runs it; a job whose owner has died is reported as interrupted. The table and
+# the owner check are local to the container, so the app runs as a single instance (README).
+JOBS_DB = os.getenv("JOBS_DB", "/tmp/debiflow_jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+FINISHED = ("done", "failed")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            investor TEXT NOT NULL,
+            report_date TEXT,
+            status TEXT NOT NULL,
+            stage TEXT,
+            stages TEXT NOT NULL DEFAULT '[]',
+            messages TEXT NOT NULL DEFAULT '[]',
+            redirect TEXT,
+            error TEXT,
+            owner_pid INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )"""
+    )
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _update(job_id, **fields):
+    fields["updated_at"] = _now()
+    for key in ("stages", "messages", "redirect"):
+        if key in fields and not isinstance(fields[key], str) and fields[key] is not None:
+            fields[key] = json.dumps(fields[key])
+    with _connect() as conn:
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+            [*fields.values(), job_id]
+        )
+
+
+class JobProgress:
+    """
+    Handed to a job function in the worker process: records the current stage, rows
+    processed and elapsed time per stage, and the messages the UI shows when it finishes.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.stages = []
+        self.messages = []
+
+    @contextmanager
+    def stage(self, name):
+        entry = {"name": name, "rows": 0, "elapsed": None}
+        self.stages.append(entry)
+        _update(self.job_id, stage=name, stages=self.stages)
+        t0 = time.time()
+        try:
+            yield entry
+        finally:
+            entry["elapsed"] = round(time.time() - t0, 2)
+            print(f"[TIMER] Job {self.job_id} stage '{name}': {entry['elapsed']:.2f}s ({entry['rows']:,} rows)")
+            _update(self.job_id, stages=self.stages)
+
+    def rows(self, count):
+        if self.stages and count:
+            self.stages[-1]["rows"] += int(count)
+            _update(self.job_id, stages=self.stages)
+
+    def message(self, text):
+        self.messages.append(text)
+        _update(self.job_id, messages=self.messages)
+
+
+def _run_job(job_id, fn, kwargs):
+    progress = JobProgress(job_id)
+    _update(job_id, status="running", stage="starting")
+    try:
+        endpoint, params = fn(progress, **kwargs)
+        _update(job_id, status="done", stage=None, redirect={"endpoint": endpoint, "params": params})
+    except Exception as e:
+        traceback.print_exc()
+        _update(job_id, status="failed", error=str(e))
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the worker must not inherit the web worker's open storage connections
+            _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def submit_job(kind, fn, **kwargs):
+    """
+    Record a queued job and run fn(progress, **kwargs) on the local pool. kwargs must
+    include investor and report_date; fn returns the (endpoint, params) the UI should go
+    to when the job is done. Returns the job id.
+    """
+    global _pool
+    investor, report_date = kwargs["investor"], kwargs["report_date"]
+    job_id = uuid.uuid4().hex[:12]
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, investor, report_date, status, owner_pid, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, investor, report_date, os.getpid(), _now(), _now())
+        )
+    try:
+        _get_pool().submit(_run_job, job_id, fn, kwargs)
+    except Exception:
+        # A broken pool (e.g. a worker process was killed) is replaced once
+        with _pool_lock:
+            _pool = None
+        _get_pool().submit(_run_job, job_id, fn, kwargs)
+    print(f"[INFO] Queued {kind} job {job_id} for {investor} {report_date or ''}")
+    return job_id
+
+
+def _owner_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except (OSError, TypeError):
+        return False
+
+
+def get_job(job_id):
+    """
+    The job as a dict (None if unknown). Unfinished jobs whose web worker has gone away
+    are marked failed, since nothing will run them any more.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    if job["status"] not in FINISHED and not _owner_alive(job["owner_pid"]):
+        _update(job_id, status="failed", error="Interrupted: the server restarted before the job finished.")
+        return get_job(job_id)
+
+    job["stages"] = json.loads(job["stages"])
+    job["messages"] = json.loads(job["messages"])
+    job["redirect"] = json.loads(job["redirect"]) if job["redirect"] else None
+    created = datetime.fromisoformat(job["created_at"])
+    end = datetime.fromisoformat(job["updated_at"]) if job["status"] in FINISHED else datetime.utcnow()
+    job["elapsed"] = round((end - created).total_seconds(), 1)
+    return job
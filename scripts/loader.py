@@ -0,0 +1,211 @@
+import io
+import re
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from scripts.columnar import COMPACT_FRAMES, read_tables, parse_csv, parse_dates
+from scripts.masters import read_master
+from scripts.validate_uploads import SCHEMAS
+
+# One typed loader for every CSV type in validate_uploads.SCHEMAS: declared dtypes and date
+# formats replace the per-module read_csv variants and their follow-up cleaning. Parquet
+# copies are used when current (see columnar); CSVs are parsed with pyarrow's reader.
+# In compact mode (columnar.COMPACT_FRAMES) LoanID is a categorical, encoded against one
+# LoanID dictionary shared by every stage of a period job (loan_id_scope); elsewhere each
+# frame keeps its own sorted categories. "category" columns load as categoricals and "int"
+# columns in the narrowest integer type that holds them. Amounts stay float64: a narrower float would change the
+# values written back to CSV. COMPACT_FRAMES=0 loads text columns as object strings.
+DATED_NAME = re.compile(r"_\d{8}\.csv$")
+# Master segments (masters.SEGMENT_FOLDER): <Prefix>Base_/Segment_<date>_<written>.csv
+SEGMENT_NAME = re.compile(r"_(Base|Segment)_\d{8}_\d{8}T\d+\.csv$")
+
+
+class LoanIDs:
+    """
+    LoanID dictionary shared by the frames of one period job: LoanID becomes a categorical
+    over one sorted set of IDs, so each loan is a single integer code in every stage and a
+    sort on LoanID gives the same order as on the text. A load with IDs not seen before
+    grows the dictionary; frames typed earlier keep the smaller one, which pandas still
+    joins and concatenates correctly, just as text.
+    """
+
+    def __init__(self):
+        # The job's fetch and write-behind threads load tables concurrently
+        self._lock = threading.Lock()
+        self.dtype = pd.CategoricalDtype(pd.Index([], dtype=object))
+
+    def encode(self, values):
+        if values.dtype == self.dtype:
+            return values
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            distinct = values.cat.categories
+        else:
+            distinct = pd.Index(values.dropna().unique())
+        with self._lock:
+            new = distinct.difference(self.dtype.categories)
+            if len(new):
+                self.dtype = pd.CategoricalDtype(self.dtype.categories.append(new).sort_values())
+            dtype = self.dtype
+        return values.astype(dtype)
+
+
+# Dictionary of the period job running in this process. Jobs run one per pool process, and
+# web workers never open a scope, so they keep no LoanIDs between requests.
+_loan_ids = None
+
+
+@contextmanager
+def loan_id_scope():
+    """
+    Share one LoanID dictionary between every frame loaded inside the block (also usable as
+    a decorator), and drop it afterwards.
+    """
+    global _loan_ids
+    outer, _loan_ids = _loan_ids, LoanIDs()
+    try:
+        yield _loan_ids
+    finally:
+        _loan_ids = outer
+
+
+def encode_loan_ids(values):
+    """
+    LoanID as a categorical with sorted categories: against the job's dictionary inside a
+    loan_id_scope, otherwise over this column's own IDs.
+    """
+    if _loan_ids is not None:
+        return _loan_ids.encode(values)
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype("category")
+    if not values.cat.categories.is_monotonic_increasing:
+        return values.cat.reorder_categories(values.cat.categories.sort_values())
+    return values
+
+
+def file_type(csv_path):
+    """
+    SCHEMAS key for a path such as .../Schedule_Master_20240119.csv,
+    .../Receivables_Allocated_20240119.csv or a master segment, or None for files without a schema.
+    """
+    stem = DATED_NAME.sub("", SEGMENT_NAME.sub("", csv_path.rsplit("/", 1)[-1]))
+    for key in (stem, stem.replace("_Master", "")):
+        if key in SCHEMAS:
+            return key
+    return None
+
+
+def apply_schema(df, file_type):
+    """
+    Give a loaded (or handed-off) frame its schema types: text keys, numeric amounts and
+    normalised dates, in their compact form when COMPACT_FRAMES is on. Columns that already
+    have the right type are left as they are.
+    """
+    schema = SCHEMAS[file_type]
+    for col, kind in schema["dtypes"].items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if kind in ("str", "category"):
+            if not (values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype)):
+                values = values.astype(str)
+            if COMPACT_FRAMES and col == "LoanID":
+                values = encode_loan_ids(values)
+            elif COMPACT_FRAMES and kind == "category" and values.dtype == object:
+                values = values.astype("category")
+            df[col] = values
+        elif kind == "int":
+            if not pd.api.types.is_integer_dtype(values):
+                values = pd.to_numeric(values, errors="coerce").fillna(0).astype(int)
+            df[col] = pd.to_numeric(values, downcast="integer") if COMPACT_FRAMES else values
+        elif not pd.api.types.is_float_dtype(values):
+            df[col] = pd.to_numeric(values, errors="coerce").astype(float)
+    for col in schema["date_columns"]:
+        if col in df.columns:
+            df[col] = parse_dates(df[col], schema["date_format"]).dt.normalize()
+    return df
+
+
+def load_tables(bucket, csv_paths, columns=None, missing_ok=False, file_types=None):
+    """
+    Typed frames for csv_paths (masters assembled from their segments), in path order.
+    columns is a list for every table or a {csv_path: list} dict; file_types overrides the
+    type taken from each file name. Files without a schema load with LoanID as text.
+    Returns None for a missing table when missing_ok.
+    """
+    csv_paths = list(csv_paths)
+    types = file_types or [file_type(path) for path in csv_paths]
+    frames = {}
+
+    # Masters may be segmented, so each goes through read_master; the rest load together
+    flat = [path for path in csv_paths if "/master/" not in path]
+    if flat:
+        by_type = {}
+        for path, kind in zip(csv_paths, types):
+            if path in flat:
+                by_type.setdefault(kind, []).append(path)
+        for kind, paths in by_type.items():
+            loaded = read_tables(bucket, paths, columns=columns, missing_ok=missing_ok, **_read_kwargs(kind))
+            frames.update(zip(paths, loaded))
+    for path, kind in zip(csv_paths, types):
+        if path in flat:
+            continue
+        table_columns = columns.get(path) if isinstance(columns, dict) else columns
+        try:
+            frames[path] = read_master(bucket, path, columns=table_columns, **_read_kwargs(kind))
+        except FileNotFoundError:
+            if not missing_ok:
+                raise
+            frames[path] = None
+
+    result = []
+    for path, kind in zip(csv_paths, types):
+        df = frames[path]
+        result.append(apply_schema(df, kind) if df is not None and kind else df)
+    return result
+
+
+def load_table(bucket, csv_path, columns=None, missing_ok=False, file_type=None):
+    """
+    Typed frame for one CSV (see load_tables).
+    """
+    return load_tables(
+        bucket, [csv_path], columns=columns, missing_ok=missing_ok, file_types=[file_type] if file_type else None
+    )[0]
+
+
+def parse_table(csv_path, data):
+    """
+    The typed frame load_table gives for CSV bytes stored at csv_path, parsed by the same
+    schema-driven reader. write_table stores it as the table's Parquet copy.
+    """
+    kind = file_type(csv_path)
+    if kind is None:
+        return pd.read_csv(io.BytesIO(data), low_memory=False, **_read_kwargs(kind))
+    return apply_schema(parse_csv(data, _read_kwargs(kind)["schema"]), kind)
+
+
+def loan_ids_as_text(values):
+    """
+    values.astype(str).str.strip() for a LoanID column (missing IDs become "nan"). On an
+    encoded column only the distinct IDs are checked, and the codes are kept when they are
+    already clean.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(str).str.strip()
+    categories = values.cat.categories
+    if categories.equals(categories.astype(str).str.strip()) and not values.isna().any():
+        return values
+    return encode_loan_ids(values.astype(str).str.strip())
+
+
+def _read_kwargs(kind):
+    if kind is None:
+        return {"dtype": {"LoanID": str}}
+    schema = SCHEMAS[kind]
+    # The CSV reader dictionary-encodes LoanID too in compact mode, so no per-row strings are built
+    compact = {"LoanID": "category"} if COMPACT_FRAMES else {}
+    dtypes = {
+        col: compact.get(col, dtype if COMPACT_FRAMES or dtype != "category" else "str")
+        for col, dtype in schema["dtypes"].items()
+    }
+    return {"schema": {**schema, "dtypes": dtypes}}
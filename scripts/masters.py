@@ -0,0 +1,230 @@
+import io
+import json
+import time
+from datetime import datetime
+import pandas as pd
+from scripts.utils import build_investor_path
+from scripts.columnar import read_table, read_tables, write_table, parquet_path, parse_dates
+from scripts.debiflow_gcs import DebiFlowGCS
+
+# Segmented masters: master/<Prefix>Master_<date>.json is a manifest listing immutable CSV
+# segments under master/segments/. Each confirm appends one segment holding that period's
+# rows; segment names carry a write timestamp, so re-confirming a period never rewrites a
+# segment that a later manifest already lists. The full master is only re-laid (as a base
+# segment) the first time a prefix is segmented or when the raw file's columns change.
+# Segments that no manifest lists any more are deleted after a re-confirm.
+# Legacy masters are plain master/<Prefix>Master_<date>.csv files and are read directly.
+SEGMENT_FOLDER = "master/segments"
+
+
+def manifest_path(csv_path):
+    return csv_path[:-len(".csv")] + ".json"
+
+
+def load_manifest(bucket, csv_path):
+    """
+    Manifest for a master CSV path, or None when that master is a legacy single CSV.
+    """
+    blob = bucket.get_blob(manifest_path(csv_path))
+    if blob is None:
+        return None
+    return json.loads(blob.download_as_text())
+
+
+def master_exists(bucket, csv_path):
+    return bucket.blob(manifest_path(csv_path)).exists() or bucket.blob(csv_path).exists()
+
+
+def source_blobs(bucket, paths):
+    """
+    {path: blob} for blobs that derived data is keyed on (None where missing), fetched
+    together. A master CSV path maps to its manifest when it is segmented.
+    """
+    paths = list(paths)
+    manifests = {path: manifest_path(path) for path in paths if path.split("/")[-2] == "master"}
+    blobs = DebiFlowGCS.from_bucket(bucket).stat_many(paths + list(manifests.values()))
+    by_name = {blob.name: blob for blob in blobs if blob is not None}
+    return {path: by_name.get(manifests.get(path)) or by_name.get(path) for path in paths}
+
+
+def source_generations(bucket, paths):
+    """
+    {path: GCS generation} for source_blobs (None where missing).
+    """
+    return {
+        path: blob.generation if blob is not None else None
+        for path, blob in source_blobs(bucket, paths).items()
+    }
+
+
+def read_master(bucket, csv_path, columns=None, **csv_kwargs):
+    """
+    Drop-in for read_table on a master path: assembles the segments listed in the manifest,
+    or reads the legacy CSV when there is none.
+    """
+    manifest = load_manifest(bucket, csv_path)
+    if manifest is None:
+        return read_table(bucket, csv_path, columns=columns, **csv_kwargs)
+
+    t0 = time.time()
+    frames = read_tables(bucket, [seg["path"] for seg in manifest["segments"]], columns=columns, **csv_kwargs)
+    df = concat_segments(frames)
+    print(f"[TIMER] Assembled {csv_path} from {len(frames)} segments in {time.time() - t0:.2f}s")
+    return df
+
+
+def concat_segments(frames):
+    # A segment whose dates are all blank comes back as float; give it the datetime type of the others
+    for col in frames[0].columns:
+        if any(pd.api.types.is_datetime64_any_dtype(df[col]) for df in frames):
+            for df in frames:
+                if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                    df[col] = pd.to_datetime(df[col], errors="coerce")
+    return pd.concat(frames, ignore_index=True)
+
+
+def master_blob_paths(bucket, csv_path):
+    """
+    Blobs holding a master's rows in order: its segments, or the CSV itself for a legacy
+    master. Every segment starts with the header line.
+    """
+    manifest = load_manifest(bucket, csv_path)
+    if manifest is None:
+        return [csv_path]
+    return [seg["path"] for seg in manifest["segments"]]
+
+
+def materialize_master(bucket, csv_path):
+    """
+    Full master CSV bytes (one header, then every segment's rows), for downloads and for
+    re-laying a base segment. Legacy masters are returned as stored.
+    """
+    paths = master_blob_paths(bucket, csv_path)
+    if paths == [csv_path]:
+        return bucket.blob(csv_path).download_as_bytes()
+
+    payloads = DebiFlowGCS.from_bucket(bucket).fetch_many(paths)
+    parts = [payloads[path] if i == 0 else payloads[path].split(b"\n", 1)[1] for i, path in enumerate(paths)]
+    return b"".join(parts)
+
+
+def normalise_master_rows(df, prefix):
+    """
+    Clean rows read as text before they go into a master: strip headers, normalise date
+    columns, coerce numeric columns and drop blank rows (and Schedule rows without a LoanID).
+    """
+    df.columns = df.columns.str.strip()
+
+    # Convert date columns if present
+    for date_col in ["Purchase_Date", "Due_Date", "Paid_Date"]:
+        if date_col in df.columns:
+            df[date_col] = parse_dates(df[date_col]).dt.normalize()
+
+    # Example numeric columns (adjust if needed)
+    numeric_cols = ["Amount", "SomeOtherNumeric"]
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    # Drop fully blank rows
+    df = df.dropna(how="all")
+
+    # Drop missing LoanIDs if Schedule_
+    if prefix.startswith("Schedule_") and "LoanID" in df.columns:
+        df = df[df["LoanID"].notna()]
+    return df
+
+
+def _write_segment(bucket, investor, name, df):
+    path = build_investor_path(investor, SEGMENT_FOLDER, name)
+    typed = write_table(bucket, path, df)
+    return {"path": path, "rows": len(df)}, typed
+
+
+def delete_replaced_segments(bucket, investor, prefix, replaced, manifest):
+    """
+    After a re-confirm, delete the segments of the replaced manifest that neither the new
+    manifest nor any other period's manifest of the prefix still lists (a later period keeps
+    this period's old segments until it is re-confirmed itself). Failures only log: an
+    orphaned segment wastes space but is never read.
+    """
+    t0 = time.time()
+    candidates = {seg["path"] for seg in replaced["segments"]} - {seg["path"] for seg in manifest["segments"]}
+    if not candidates:
+        return
+    try:
+        listing = build_investor_path(investor, "master", f"{prefix}Master_")
+        others = [blob.name for blob in bucket.list_blobs(prefix=listing) if blob.name.endswith(".json")]
+        for data in DebiFlowGCS.from_bucket(bucket).fetch_many(others, missing_ok=True).values():
+            if data is not None:
+                candidates -= {seg["path"] for seg in json.loads(data)["segments"]}
+        for path in sorted(candidates):
+            for stale in (path, parquet_path(path)):
+                blob = bucket.get_blob(stale)
+                if blob is not None:
+                    blob.delete()
+    except Exception as e:
+        print(f"[WARN] Replaced {prefix} segments not deleted: {e}")
+        return
+    print(f"[TIMER] Deleted {len(candidates)} replaced {prefix} segments in {time.time() - t0:.2f}s")
+
+
+def append_master(bucket, investor, prefix, report_date, previous, df_new, assemble=False):
+    """
+    Write <prefix>Master_<report_date> as the previous master plus df_new (already normalised).
+    Only df_new is uploaded when the previous master is segmented with the same columns;
+    otherwise the previous master is loaded and normalised once, as the old full merge did,
+    and stored as a base segment.
+
+    Returns (manifest, master frame). The frame is only built when assemble=True and is what
+    load_table would load for the new master, without downloading the new segment back.
+    """
+    # Imported here: the loader reads masters through this module
+    from scripts.loader import load_table
+
+    prev_csv = build_investor_path(investor, "master", f"{prefix}Master_{previous}.csv")
+    new_csv = build_investor_path(investor, "master", f"{prefix}Master_{report_date}.csv")
+    columns = df_new.columns.tolist()
+    written = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+
+    replaced_manifest = load_manifest(bucket, new_csv)
+    prev_manifest = load_manifest(bucket, prev_csv)
+    if prev_manifest is not None and prev_manifest["columns"] == columns:
+        segments = list(prev_manifest["segments"])
+        print(f"✅ Previous master is segmented ({len(segments)} segments, {prev_manifest['rows']} rows)")
+        df_base = load_table(bucket, prev_csv) if assemble else None
+    else:
+        prev_bytes = materialize_master(bucket, prev_csv)
+        df_prev = normalise_master_rows(pd.read_csv(io.BytesIO(prev_bytes), dtype=str, low_memory=False), prefix)
+        print(f"✅ Loaded previous: {prefix}Master_{previous}.csv ({len(df_prev)} rows), re-laying as base segment")
+        # Ensure same column order
+        df_prev = df_prev[columns]
+        base, df_base = _write_segment(bucket, investor, f"{prefix}Base_{report_date}_{written}.csv", df_prev)
+        segments = [base]
+
+    segment, df_segment = _write_segment(bucket, investor, f"{prefix}Segment_{report_date}_{written}.csv", df_new)
+    segments.append(segment)
+    manifest = {
+        "prefix": prefix,
+        "report_date": report_date,
+        "columns": columns,
+        "rows": sum(seg["rows"] for seg in segments),
+        "segments": segments,
+    }
+    bucket.blob(manifest_path(new_csv)).upload_from_string(json.dumps(manifest, indent=2), content_type="application/json")
+
+    # The manifest supersedes a full CSV written for this date by an earlier confirm
+    for stale in (new_csv, parquet_path(new_csv)):
+        blob = bucket.get_blob(stale)
+        if blob is not None:
+            blob.delete()
+    if replaced_manifest is not None:
+        delete_replaced_segments(bucket, investor, prefix, replaced_manifest, manifest)
+
+    df_master = None
+    if assemble:
+        if df_base is None or df_segment is None:
+            df_master = load_table(bucket, new_csv)
+        else:
+            df_master = concat_segments([df_base, df_segment])
+    return manifest, df_master
@@ -1,37 +1,476 @@
+import os
 import pandas as pd
 import numpy as np
 import io
 import time
-from debiflow_gcs import DebiFlowGCS
+from scripts.debiflow_gcs import DebiFlowGCS
 from scripts.utils import build_investor_path, require_investor
+from scripts.sharding import SHARD_WORKERS, loan_shards, run_sharded, concat_shards
+from scripts.columnar import write_tables
+from scripts.loader import load_table, load_tables, apply_schema, file_type
 
-MAX_ALLOCATIONS = 3  # You can adjust this
+# Long-format allocation rows: one per (payment, receivable) a payment allocated to or flagged
+ALLOCATION_COLUMNS = ["Payment_ID", "LoanID", "Paid_Date", "Receivable_Index", "Payment_allocated", "Flag"]
 
-def generate_payments_allocated(report_date: str, bucket: str, investor):
+# "vectorized" (default) or "reference" (the original row-by-row loop, kept for diffing outputs)
+ALLOCATION_MODE = os.getenv("ALLOCATION_MODE", "vectorized")
+
+
+def _round_2dp(values):
+    """
+    Round to 2 decimals exactly like Python's round(x, 2), which the reference loop uses.
+    np.round only disagrees with it when x * 100 sits on a .5 boundary, so those values
+    are re-rounded in Python.
+    """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    frac = np.abs(scaled - np.trunc(scaled))
+    near_half = np.abs(frac - 0.5) <= np.maximum(1e-9, np.abs(scaled) * 4 * np.finfo(float).eps)
+    if near_half.any():
+        rounded[near_half] = [round(v, 2) for v in values[near_half].tolist()]
+    return rounded
+
+
+def allocate_payments_reference(df_payments, df_schedule):
+    """
+    Original row-by-row allocation loop. Expects both frames already renamed and sorted, with a
+    Payment_ID column. Returns (payments with Unallocated_Reason, long allocation rows).
+    """
+    # Build schedule dictionaries
+    t_dicts = time.time()
+    schedule_dict = {
+        loan_id: grp['Receivable_Outstandings'].fillna(0).tolist()
+        for loan_id, grp in df_schedule.groupby('LoanID', observed=True)
+    }
+    cumulative_allocated = {loan_id: [0.0] * len(receivables) for loan_id, receivables in schedule_dict.items()}
+    flag_locked = {loan_id: [False] * len(receivables) for loan_id, receivables in schedule_dict.items()}
+    print(f"[TIMER] Schedule dict build time: {time.time() - t_dicts:.2f}s")
+
+    # Allocation loop
+    t_alloc = time.time()
+    allocation_results = []
+    allocation_rows = []
+
+    for idx, row in df_payments.iterrows():
+        loan_id = row['LoanID']
+        payment_remaining = row.get('Amount_Paid', 0)
+        allocated_total = 0.0
+        unallocated_reason = ""
+
+        if pd.isnull(loan_id) or pd.isnull(payment_remaining) or payment_remaining == 0:
+            unallocated_reason = "Invalid LoanID or corrupted data"
+        elif loan_id not in schedule_dict:
+            unallocated_reason = "No receivables found for LoanID"
+        else:
+            receivables = schedule_dict[loan_id]
+            cum_alloc = cumulative_allocated[loan_id]
+            flags_done = flag_locked[loan_id]
+
+            if np.nansum(receivables) == 0:
+                unallocated_reason = "Zero or null receivables"
+            else:
+                for i in range(len(receivables)):
+                    if payment_remaining <= 0:
+                        break
+                    receivable_total = receivables[i]
+                    allocatable = receivable_total - cum_alloc[i]
+                    alloc_amt = min(allocatable, payment_remaining)
+                    alloc_amt = round(max(alloc_amt, 0), 2)
+                    cum_alloc[i] += alloc_amt
+                    payment_remaining -= alloc_amt
+                    allocated_total += alloc_amt
+
+                    flag = 0
+                    if not flags_done[i] and np.isclose(cum_alloc[i], receivable_total, atol=0.01):
+                        flag = 1
+                        flags_done[i] = True
+
+                    if alloc_amt > 0 or flag:
+                        allocation_rows.append({
+                            'Payment_ID': row['Payment_ID'],
+                            'LoanID': loan_id,
+                            'Paid_Date': row['Paid_Date'],
+                            'Receivable_Index': i + 1,
+                            'Payment_allocated': float(alloc_amt),
+                            'Flag': flag,
+                        })
+
+                if allocated_total == 0:
+                    total_receivables = sum(receivables)
+                    if np.isclose(sum(cum_alloc), total_receivables, atol=0.01):
+                        unallocated_reason = "Receivables already fully allocated"
+                    else:
+                        unallocated_reason = "Duplicate payment for already settled receivable"
+
+        result = row.to_dict()
+        result['Unallocated_Reason'] = unallocated_reason
+
+        allocation_results.append(result)
+
+        if (idx + 1) % 1000 == 0 or idx == len(df_payments) - 1:
+            print(f"[INFO] Processed {idx+1:,} of {len(df_payments):,} payments")
+
+    print(f"[TIMER] Allocation loop time: {time.time() - t_alloc:.2f}s")
+
+    # DataFrame assembly and rounding
+    t_df = time.time()
+    df_final = pd.DataFrame(allocation_results)
+    # Explicit dtypes, as allocate_payments_vectorized builds them: with no rows they would be object
+    df_long = pd.DataFrame(allocation_rows, columns=ALLOCATION_COLUMNS).astype(
+        {'Payment_ID': np.int64, 'Receivable_Index': np.int64, 'Payment_allocated': float, 'Flag': np.int64}
+    )
+    df_long['Payment_allocated'] = df_long['Payment_allocated'].round(2)
+    print(f"[TIMER] DataFrame assembly time: {time.time() - t_df:.2f}s")
+    return df_final, df_long
+
+
+def allocate_payments_vectorized(df_payments, df_schedule, state=None):
+    """
+    Array implementation of the allocation waterfall, producing the same output as
+    allocate_payments_reference. Receivables are held in flat arrays grouped by LoanID;
+    the n-th payment of every loan is allocated in one array step, so the loop runs
+    (max payments per loan) x (max receivables per loan) times instead of once per payment.
+    Each step performs the same float operations in the same order as the reference loop,
+    which is what keeps the rounding and np.isclose flag decisions bit-for-bit identical.
+
+    Returns (payments with Unallocated_Reason, long allocation rows, per-receivable state).
+    Passing a previous state seeds cumulative_allocated / flag_locked for the receivables
+    it covers.
+    """
+    # Flat receivables, grouped by loan in schedule order
+    t_dicts = time.time()
+    sched = df_schedule[df_schedule['LoanID'].notna()]
+    recv_codes, loan_ids = pd.factorize(sched['LoanID'])
+    recv_order = np.argsort(recv_codes, kind="stable")
+    sched = sched.iloc[recv_order]
+    recv_codes = recv_codes[recv_order]
+    receivables = sched['Receivable_Outstandings'].fillna(0).to_numpy(dtype=float)
+    n_receivables = np.bincount(recv_codes, minlength=len(loan_ids))
+    offsets = np.concatenate([[0], np.cumsum(n_receivables)[:-1]]).astype(np.int64)
+    recv_positions = np.arange(len(receivables)) - offsets[recv_codes]
+
+    # Per-loan receivable totals, summed left to right like Python's sum()
+    total_receivables = np.zeros(len(loan_ids))
+    for pos in range(int(n_receivables.max()) if len(loan_ids) else 0):
+        loans = np.flatnonzero(n_receivables > pos)
+        total_receivables[loans] += receivables[offsets[loans] + pos]
+
+    cum_alloc = np.zeros(len(receivables))
+    flags_done = np.zeros(len(receivables), dtype=bool)
+    if state is not None and len(state):
+        state_codes = loan_ids.get_indexer(state['LoanID'])
+        state_pos = state['Receivable_Index'].to_numpy(dtype=np.int64) - 1
+        known = state_pos < np.append(n_receivables, 0)[state_codes]
+        slot = offsets[state_codes[known]] + state_pos[known]
+        cum_alloc[slot] = state['Cumulative_Allocated'].to_numpy(dtype=float)[known]
+        flags_done[slot] = state['Flag_Locked'].to_numpy(dtype=bool)[known]
+    print(f"[TIMER] Schedule array build time: {time.time() - t_dicts:.2f}s")
+
+    # Classify payments
+    t_alloc = time.time()
+    df_final = df_payments.reset_index(drop=True)
+    n_payments = len(df_final)
+    if 'Amount_Paid' in df_final.columns:
+        amounts = df_final['Amount_Paid'].to_numpy(dtype=float)
+    else:
+        amounts = np.zeros(n_payments)
+    pay_codes = loan_ids.get_indexer(df_final['LoanID'])
+
+    invalid = df_final['LoanID'].isna().to_numpy() | np.isnan(amounts) | (amounts == 0)
+    unknown = ~invalid & (pay_codes < 0)
+    zero_recv = ~invalid & ~unknown & (np.append(total_receivables, np.nan)[pay_codes] == 0)
+    live = np.flatnonzero(~invalid & ~unknown & ~zero_recv)
+
+    reasons = np.full(n_payments, "", dtype=object)
+    reasons[invalid] = "Invalid LoanID or corrupted data"
+    reasons[unknown] = "No receivables found for LoanID"
+    reasons[zero_recv] = "Zero or null receivables"
+
+    # Rank of each live payment within its loan (0 = first in sorted order)
+    live_codes = pay_codes[live]
+    by_loan = np.argsort(live_codes, kind="stable")
+    sorted_codes = live_codes[by_loan]
+    group_start = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_sizes = np.diff(np.r_[group_start, len(sorted_codes)])
+    rank = np.empty(len(live), dtype=np.int64)
+    rank[by_loan] = np.arange(len(live)) - np.repeat(group_start, group_sizes)
+    by_rank = live[np.argsort(rank, kind="stable")]
+    step_bounds = np.searchsorted(np.sort(rank), np.arange(rank.max() + 2 if len(live) else 1))
+
+    allocated = np.zeros(n_payments, dtype=bool)
+    long_rows, long_index, long_amount, long_flag = [], [], [], []
+    max_receivables = int(n_receivables.max()) if len(loan_ids) else 0
+
+    for step in range(len(step_bounds) - 1):
+        rows = by_rank[step_bounds[step]:step_bounds[step + 1]]
+        codes = pay_codes[rows]
+        remaining = amounts[rows].copy()
+
+        for i in range(max_receivables):
+            active = np.flatnonzero((remaining > 0) & (n_receivables[codes] > i))
+            if not len(active):
+                break
+            slot = offsets[codes[active]] + i
+            allocatable = receivables[slot] - cum_alloc[slot]
+            alloc_amt = _round_2dp(np.maximum(np.minimum(allocatable, remaining[active]), 0))
+            cum_alloc[slot] += alloc_amt
+            remaining[active] -= alloc_amt
+
+            newly_flagged = ~flags_done[slot] & np.isclose(cum_alloc[slot], receivables[slot], atol=0.01)
+            flags_done[slot[newly_flagged]] = True
+
+            touched = (alloc_amt > 0) | newly_flagged
+            long_rows.append(rows[active[touched]])
+            long_index.append(np.full(touched.sum(), i + 1))
+            long_amount.append(alloc_amt[touched])
+            long_flag.append(newly_flagged[touched].astype(np.int64))
+            allocated[rows[active[alloc_amt > 0]]] = True
+
+        # Payments that allocated nothing: already settled vs duplicate
+        unallocated = np.flatnonzero(~allocated[rows])
+        if len(unallocated):
+            unalloc_codes = codes[unallocated]
+            allocated_sum = np.zeros(len(unallocated))
+            for i in range(int(n_receivables[unalloc_codes].max())):
+                has_slot = n_receivables[unalloc_codes] > i
+                allocated_sum[has_slot] += cum_alloc[offsets[unalloc_codes[has_slot]] + i]
+            settled = np.isclose(allocated_sum, total_receivables[unalloc_codes], atol=0.01)
+            reasons[rows[unallocated]] = np.where(
+                settled,
+                "Receivables already fully allocated",
+                "Duplicate payment for already settled receivable"
+            )
+
+    print(f"[INFO] Processed {n_payments:,} payments in {len(step_bounds) - 1} allocation steps")
+    print(f"[TIMER] Allocation time: {time.time() - t_alloc:.2f}s")
+
+    # DataFrame assembly and rounding
+    t_df = time.time()
+    df_final = df_final.copy()
+    df_final['Unallocated_Reason'] = reasons
+
+    long_rows = np.concatenate(long_rows) if long_rows else np.zeros(0, dtype=np.int64)
+    long_index = np.concatenate(long_index) if long_index else np.zeros(0, dtype=np.int64)
+    long_order = np.lexsort((long_index, long_rows))
+    long_rows = long_rows[long_order]
+    df_long = pd.DataFrame({
+        'Payment_ID': df_final['Payment_ID'].to_numpy()[long_rows],
+        'LoanID': df_final['LoanID'].to_numpy()[long_rows],
+        'Paid_Date': df_final['Paid_Date'].to_numpy()[long_rows],
+        'Receivable_Index': long_index[long_order],
+        'Payment_allocated': np.concatenate(long_amount)[long_order] if long_amount else np.zeros(0),
+        'Flag': np.concatenate(long_flag)[long_order] if long_flag else np.zeros(0, dtype=np.int64),
+    })
+    df_long['Payment_allocated'] = df_long['Payment_allocated'].round(2)
+
+    df_state = pd.DataFrame({
+        'LoanID': loan_ids[recv_codes],
+        'Receivable_Index': recv_positions + 1,
+        'Due_Date': sched['Due_Date'].to_numpy(),
+        'Receivable_Outstandings': sched['Receivable_Outstandings'].to_numpy(),
+        'Cumulative_Allocated': cum_alloc,
+        'Flag_Locked': flags_done,
+    })
+    print(f"[TIMER] DataFrame assembly time: {time.time() - t_df:.2f}s")
+    return df_final, df_long, df_state
+
+
+def allocate_payments_sharded(df_payments, df_schedule, state=None, workers=None):
+    """
+    Run allocate_payments_vectorized on LoanID hash shards in a process pool. Allocation
+    never crosses loans, so each shard is independent; the shard outputs are put back in
+    input payment order and match a single-process run exactly.
+    """
+    workers = workers or SHARD_WORKERS
+    if workers <= 1:
+        return allocate_payments_vectorized(df_payments, df_schedule, state)
+
+    pay_shard = loan_shards(df_payments['LoanID'], workers)
+    sched_shard = loan_shards(df_schedule['LoanID'], workers)
+    state_shard = loan_shards(state['LoanID'], workers) if state is not None else None
+    tasks = [
+        (
+            df_payments[pay_shard == k],
+            df_schedule[sched_shard == k],
+            state[state_shard == k] if state is not None else None,
+        )
+        for k in range(workers)
+    ]
+    results = run_sharded(allocate_payments_vectorized, tasks, workers)
+
+    # Payments back in input order; allocation rows by payment, then receivable
+    positions = np.concatenate([np.flatnonzero(pay_shard == k) for k in range(workers)])
+    df_final = pd.concat([r[0] for r in results], ignore_index=True)
+    df_final = df_final.iloc[np.argsort(positions, kind="stable")].reset_index(drop=True)
+
+    df_long = concat_shards([r[1] for r in results])
+    payment_position = pd.Series(np.arange(len(df_final)), index=df_final['Payment_ID'])
+    long_order = np.lexsort((
+        df_long['Receivable_Index'].to_numpy(),
+        payment_position.reindex(df_long['Payment_ID']).to_numpy(),
+    ))
+    df_long = df_long.iloc[long_order].reset_index(drop=True)
+
+    df_state = concat_shards([r[2] for r in results])
+    df_state = df_state.sort_values(by=["LoanID", "Receivable_Index"]).reset_index(drop=True)
+    return df_final, df_long, df_state
+
+
+# Sort key standing in for a missing Paid_Date / Due_Date: sort_values puts NaN last
+_NAN_SORT_KEY = "~"
+
+
+def _dates_as_text(df):
+    """
+    Allocation sorts and keys on Paid_Date / Due_Date as YYYY-MM-DD text; the typed loader
+    and Parquet copies hold them as datetime64, so turn them back into text.
+    """
+    for col in ("Paid_Date", "Due_Date"):
+        if col in df.columns and pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d")
+    return df
+
+
+def _with_last_paid(df_state, df_payments, prior_last=None):
+    """
+    Attach Last_Paid_Date per loan: the latest Paid_Date processed so far ("~" when an
+    undated payment was processed, empty when the loan has had no payments).
+    """
+    last_paid = df_payments['Paid_Date'].fillna(_NAN_SORT_KEY).groupby(df_payments['LoanID'], observed=True).max()
+    if prior_last is not None:
+        last_paid = pd.concat([prior_last.dropna(), last_paid]).groupby(level=0).max()
+    df_state = df_state.copy()
+    df_state['Last_Paid_Date'] = df_state['LoanID'].map(last_paid)
+    return df_state
+
+
+def allocate_payments_incremental(df_payments, df_schedule, prior_output, prior_long, prior_state,
+                                  payments_done, schedule_done):
+    """
+    Allocate only the payment and schedule rows appended to the masters since the prior
+    period, continuing from that period's allocation state. Both frames must keep the
+    RangeIndex from read_csv (master row numbers); masters are append-only, so rows below
+    payments_done / schedule_done are the ones the prior run already consumed.
+
+    Loans that would allocate differently under a full recompute are re-run from scratch:
+    loans that gained schedule rows after they already had payments (earlier payments may
+    now reach the new receivables), and loans with a new payment that sorts before one
+    already processed. Returns (allocated payments, long allocation rows, state) like
+    allocate_payments_vectorized.
+    """
+    is_new_payment = df_payments.index >= payments_done
+    new_payments = df_payments[is_new_payment]
+    new_schedule = df_schedule[(df_schedule.index >= schedule_done) & df_schedule['LoanID'].notna()]
+
+    last_paid = prior_state.drop_duplicates('LoanID').set_index('LoanID')['Last_Paid_Date']
+    history_loans = prior_output['LoanID'].dropna().unique()
+
+    # Dirty loans: new schedule rows on a loan with history, or a new payment out of date order
+    prior_last = new_payments['LoanID'].map(last_paid).fillna("")
+    out_of_order = new_payments.loc[new_payments['Paid_Date'].fillna(_NAN_SORT_KEY) < prior_last, 'LoanID']
+    dirty = pd.Index(new_schedule['LoanID'].unique()).intersection(history_loans).union(out_of_order.unique())
+    affected = pd.Index(new_payments['LoanID'].dropna().unique()).union(new_schedule['LoanID'].unique())
+    print(f"[INFO] Incremental allocation: {len(new_payments):,} new payments, {len(new_schedule):,} new schedule rows, "
+          f"{len(affected):,} loans affected, {len(dirty):,} re-run from scratch")
+
+    # Receivables of affected loans: prior state rows plus appended schedule rows, in schedule order
+    schedule_cols = ['LoanID', 'Due_Date', 'Receivable_Outstandings']
+    schedule_in = pd.concat(
+        [prior_state.loc[prior_state['LoanID'].isin(affected), schedule_cols], new_schedule[schedule_cols]],
+        ignore_index=True
+    ).sort_values(by=["LoanID", "Due_Date"])
+    state_in = prior_state[prior_state['LoanID'].isin(affected) & ~prior_state['LoanID'].isin(dirty)]
+
+    in_dirty = df_payments['LoanID'].isin(dirty).to_numpy()
+    payments_in = df_payments[(is_new_payment & ~in_dirty) | in_dirty]
+    df_new, long_new, state_new = allocate_payments_sharded(payments_in, schedule_in, state_in)
+
+    # Splice into the prior output; a stable sort on the same keys reproduces the full-run order
+    kept_output = prior_output[~prior_output['LoanID'].isin(dirty)]
+    df_final = concat_shards([kept_output, df_new])
+    df_final = df_final.sort_values(by=["LoanID", "Paid_Date"]).reset_index(drop=True)
+
+    kept_long = prior_long[~prior_long['LoanID'].isin(dirty)]
+    df_long = concat_shards([kept_long, long_new])
+    df_long = df_long.sort_values(by=["LoanID", "Paid_Date", "Payment_ID", "Receivable_Index"]).reset_index(drop=True)
+
+    state_new = _with_last_paid(state_new, payments_in, prior_last=last_paid[last_paid.index.isin(state_new['LoanID'])])
+    kept_state = prior_state[~prior_state['LoanID'].isin(affected)]
+    df_state = concat_shards([kept_state, state_new])
+    df_state = df_state.sort_values(by=["LoanID", "Receivable_Index"]).reset_index(drop=True)
+    return df_final, df_long, df_state
+
+
+def generate_payments_allocated(report_date: str, bucket: str, investor, mode: str = None,
+                                prior_report_date: str = None, full_recompute: bool = False, pipeline=None):
+    """
+    Allocate Payments_Master against Schedule_Master for report_date. Writes Payments_Allocated
+    (one row per payment) and Payment_Allocations (one row per payment/receivable pair, with
+    no cap on how many receivables a payment covers). In vectorized mode the
+    per-receivable allocation state is saved next to the output; when prior_report_date has
+    a usable state, only the new week's rows are allocated. full_recompute=True ignores the
+    prior state (e.g. for audits). With SHARD_WORKERS > 1 the allocation runs on LoanID
+    shards in a process pool. Given a Pipeline, the masters are taken from it when an earlier
+    stage produced them, and the outputs are handed on in memory with write-behind uploads.
+    """
     t_start = time.time()
-    print("[INFO] Starting generate_payments_allocated()")
+    mode = mode or ALLOCATION_MODE
+    print(f"[INFO] Starting generate_payments_allocated() [{mode}]")
 
     gcs = DebiFlowGCS(bucket)
 
     def read_csv_from_gcs(investor, folder, filename):
-        t0 = time.time()
         path = build_investor_path(investor, folder, filename)
-        blob = gcs.bucket.blob(path)
-        df = pd.read_csv(io.StringIO(blob.download_as_text()), dtype={"LoanID": str}, low_memory=False)
-        print(f"[TIMER] Loaded {path} in {time.time() - t0:.2f}s")
-        return df
+        df = pipeline.get(path) if pipeline else None
+        if df is None:
+            df = load_table(gcs.bucket, path)
+        else:
+            df = apply_schema(df, file_type(path))
+        return _dates_as_text(df)
 
+    def write_outputs(tables, state=None):
+        """
+        Upload the output tables and the allocation state (path, df, metadata) together;
+        with a pipeline the tables are handed on and the uploads run as write-behind.
+        """
+        def upload():
+            uploads = []
+            if state is not None:
+                path, df, metadata = state
+                buffer = io.BytesIO()
+                df.to_csv(buffer, index=False, compression="gzip")
+                uploads.append((path, buffer.getvalue(), "application/gzip", metadata))
+            write_tables(gcs.bucket, tables, uploads)
 
-    def write_csv_to_gcs(df, path):
+        if pipeline:
+            for path, df in tables:
+                pipeline.put(path, df)
+            paths = [path for path, _ in tables] + ([state[0]] if state is not None else [])
+            pipeline.write_behind(paths, upload)
+        else:
+            upload()
+
+    def read_state_from_gcs(investor, report_date):
         t0 = time.time()
-        blob = gcs.bucket.blob(path)
-        blob.upload_from_string(df.to_csv(index=False), content_type="text/csv")
-        print(f"[TIMER] Wrote {path} in {time.time() - t0:.2f}s")
+        path = build_investor_path(investor, "outputs", f"Payments_Allocation_State_{report_date}.csv.gz")
+        blob = gcs.bucket.get_blob(path)
+        if blob is None:
+            return None, {}
+        df = pd.read_csv(
+            io.BytesIO(blob.download_as_bytes()),
+            compression="gzip",
+            dtype={"LoanID": str, "Due_Date": str, "Last_Paid_Date": str},
+            float_precision="round_trip"
+        )
+        print(f"[TIMER] Loaded {path} in {time.time() - t0:.2f}s")
+        return df, blob.metadata or {}
 
     try:
         # Load Inputs
         t_load = time.time()
         output_blob = build_investor_path(investor, "outputs", f"Payments_Allocated_{report_date}.csv")
+        long_blob = build_investor_path(investor, "outputs", f"Payment_Allocations_{report_date}.csv")
+        state_blob = build_investor_path(investor, "outputs", f"Payments_Allocation_State_{report_date}.csv.gz")
 
         df_payments = read_csv_from_gcs(investor, "master", f"Payments_Master_{report_date}.csv")
         df_schedule = read_csv_from_gcs(investor, "master", f"Schedule_Master_{report_date}.csv")
@@ -42,90 +481,72 @@ def generate_payments_allocated(report_date: str, bucket: str, investor):
         t_norm = time.time()
         df_payments.rename(columns={"originatorLoanID": "LoanID"}, inplace=True)
         df_schedule.rename(columns={"originator_LoanID": "LoanID"}, inplace=True)
+        df_payments["Payment_ID"] = df_payments.index
         df_payments.sort_values(by=["LoanID", "Paid_Date"], inplace=True)
         df_schedule.sort_values(by=["LoanID", "Due_Date"], inplace=True)
         print(f"[TIMER] Normalisation and sorting time: {time.time() - t_norm:.2f}s")
 
-        # Build schedule dictionaries
-        t_dicts = time.time()
-        schedule_dict = {
-            loan_id: grp['Receivable_Outstandings'].fillna(0).tolist()
-            for loan_id, grp in df_schedule.groupby('LoanID')
-        }
-        cumulative_allocated = {loan_id: [0.0] * len(receivables) for loan_id, receivables in schedule_dict.items()}
-        flag_locked = {loan_id: [False] * len(receivables) for loan_id, receivables in schedule_dict.items()}
-        print(f"[TIMER] Schedule dict build time: {time.time() - t_dicts:.2f}s")
-
-        # Allocation loop
-        t_alloc = time.time()
-        allocation_results = []
-
-        for idx, row in df_payments.iterrows():
-            loan_id = row['LoanID']
-            payment_remaining = row.get('Amount_Paid', 0)
-            alloc_row = [0.0] * MAX_ALLOCATIONS
-            flag_row = [0] * MAX_ALLOCATIONS
-            unallocated_reason = ""
-
-            if pd.isnull(loan_id) or pd.isnull(payment_remaining) or payment_remaining == 0:
-                unallocated_reason = "Invalid LoanID or corrupted data"
-            elif loan_id not in schedule_dict:
-                unallocated_reason = "No receivables found for LoanID"
+        df_state = None
+        recompute = "full"
+        if mode == "reference":
+            df_final, df_long = allocate_payments_reference(df_payments, df_schedule)
+        else:
+            prior_state, prior_meta = None, {}
+            if full_recompute:
+                print("[INFO] Full recompute requested, ignoring prior allocation state")
+            elif prior_report_date:
+                prior_state, prior_meta = read_state_from_gcs(investor, prior_report_date)
+
+            prior_output, prior_long = None, None
+            payments_done = int(prior_meta.get("payments_rows", -1))
+            schedule_done = int(prior_meta.get("schedule_rows", -1))
+            if prior_state is not None and 0 <= payments_done <= len(df_payments) and 0 <= schedule_done <= len(df_schedule):
+                try:
+                    # Exact float parsing so carried-over rows are written back unchanged; both fetched together
+                    prior_paths = [
+                        build_investor_path(investor, "outputs", f"Payments_Allocated_{prior_report_date}.csv"),
+                        build_investor_path(investor, "outputs", f"Payment_Allocations_{prior_report_date}.csv"),
+                    ]
+                    prior_output, prior_long = (
+                        _dates_as_text(df) for df in
+                        load_tables(gcs.bucket, prior_paths)
+                    )
+                except Exception as e:
+                    print(f"[WARN] Prior allocation outputs not available: {e}")
+                    prior_output = None
+                if prior_output is not None and "Payment_ID" not in prior_output.columns:
+                    print("[WARN] Prior Payments_Allocated predates Payment_ID, running full allocation")
+                    prior_output = None
+                if prior_output is not None and len(prior_output) != payments_done:
+                    print(f"[WARN] Prior Payments_Allocated has {len(prior_output):,} rows, state expects {payments_done:,}")
+                    prior_output = None
+
+            if prior_output is not None:
+                df_final, df_long, df_state = allocate_payments_incremental(
+                    df_payments, df_schedule, prior_output, prior_long, prior_state, payments_done, schedule_done
+                )
+                recompute = "incremental"
             else:
-                receivables = schedule_dict[loan_id]
-                cum_alloc = cumulative_allocated[loan_id]
-                flags_done = flag_locked[loan_id]
-
-                if np.nansum(receivables) == 0:
-                    unallocated_reason = "Zero or null receivables"
-                else:
-                    for i in range(min(MAX_ALLOCATIONS, len(receivables))):
-                        if payment_remaining <= 0:
-                            break
-                        receivable_total = receivables[i]
-                        allocatable = receivable_total - cum_alloc[i]
-                        alloc_amt = min(allocatable, payment_remaining)
-                        alloc_amt = round(max(alloc_amt, 0), 2)
-                        alloc_row[i] = alloc_amt
-                        cum_alloc[i] += alloc_amt
-                        payment_remaining -= alloc_amt
-
-                        if not flags_done[i] and np.isclose(cum_alloc[i], receivable_total, atol=0.01):
-                            flag_row[i] = 1
-                            flags_done[i] = True
-
-                    if sum(alloc_row) == 0:
-                        total_receivables = sum(receivables)
-                        if np.isclose(sum(cum_alloc), total_receivables, atol=0.01):
-                            unallocated_reason = "Receivables already fully allocated"
-                        else:
-                            unallocated_reason = "Duplicate payment for already settled receivable"
-
-            result = row.to_dict()
-            for i in range(MAX_ALLOCATIONS):
-                result[f'Payment_Allocation_pmt{i+1}'] = alloc_row[i]
-                result[f'Payment_Allocation_flag{i+1}'] = flag_row[i]
-            result['Unallocated_Reason'] = unallocated_reason
-
-            allocation_results.append(result)
-
-            if (idx + 1) % 1000 == 0 or idx == len(df_payments) - 1:
-                print(f"[INFO] Processed {idx+1:,} of {len(df_payments):,} payments")
-
-        print(f"[TIMER] Allocation loop time: {time.time() - t_alloc:.2f}s")
-
-        # DataFrame assembly and rounding
-        t_df = time.time()
-        df_final = pd.DataFrame(allocation_results)
-        payment_cols = [col for col in df_final if col.startswith('Payment_Allocation_pmt')]
-        df_final[payment_cols] = df_final[payment_cols].round(2)
-        print(f"[TIMER] DataFrame assembly time: {time.time() - t_df:.2f}s")
+                if prior_report_date and not full_recompute:
+                    print(f"[INFO] No usable allocation state for {prior_report_date}, running full allocation")
+                df_final, df_long, df_state = allocate_payments_sharded(df_payments, df_schedule)
+                df_state = _with_last_paid(df_state, df_payments)
 
         # Write output
-        write_csv_to_gcs(df_final, output_blob)
+        state = None
+        if df_state is not None:
+            state_meta = {
+                "payments_rows": str(len(df_payments)),
+                "schedule_rows": str(len(df_schedule)),
+                "prior_report_date": prior_report_date or "",
+                "recompute": recompute,
+            }
+            state = (state_blob, df_state, state_meta)
+        write_outputs([(output_blob, df_final), (long_blob, df_long)], state)
 
-        print(f"[SUCCESS] Payments_Allocated file saved: {output_blob}")
+        print(f"[SUCCESS] Payments_Allocated files saved: {output_blob}, {long_blob}")
         print(f"[TIMER] Total runtime: {time.time() - t_start:.2f}s")
 
     except Exception as e:
         print(f"[ERROR] Failed to generate Payments_Allocated: {e}")
+        raise
@@ -0,0 +1,314 @@
+import pandas as pd
+from io import BytesIO
+from scripts.catalog import record_blobs
+from scripts.debiflow_gcs import get_bucket, DebiFlowGCS
+from scripts.loader import loan_id_scope
+from scripts.utils import build_investor_path
+
+# Bodies of /confirm and /finalise-repurchases, run by scripts.jobs on the local process pool.
+# Each takes the job's progress recorder first and returns the (endpoint, params) to show
+# once it is done; progress.message() replaces flash(), which needs a request. A period
+# whose outputs were not all produced raises, so the job is recorded as failed.
+
+
+@loan_id_scope()
+def confirm_period(progress, bucket_name, investor, report_date, previous, full_recompute=False):
+    import scripts.output_generators
+    from scripts.receivables_allocated import generate_receivables_allocated
+    from scripts.masters import append_master, master_exists, normalise_master_rows
+    from scripts.pipeline import Pipeline
+    from scripts.builds import MERGE_PREFIXES, PERIOD_STAGES, plan_period, later_periods
+
+    print(f"\n📦 Confirming merge for report_date={report_date}, previous={previous}")
+
+    bucket = get_bucket(bucket_name)
+
+    # Only the stages whose inputs changed since they were last built run again
+    with progress.stage("plan"):
+        planned = dict(plan_period(bucket, investor, report_date, previous, force=full_recompute))
+        for stage, reason in planned.items():
+            print(f"[INFO] Rebuilding {stage} for {report_date}: {reason}")
+    skipped = [stage for stage in PERIOD_STAGES if stage not in planned]
+
+    prefixes = [prefix for prefix in MERGE_PREFIXES if f"merge:{prefix}" in planned]
+    updated_files = []
+
+    # Merged masters and outputs are handed between stages in memory; uploads run write-behind
+    pipeline = Pipeline()
+    handoff_prefixes = ["Schedule_", "Payments_"]
+
+    # Fetch the four raw files together up front
+    with progress.stage("fetch raw files"):
+        raw_paths = {prefix: build_investor_path(investor, "raw", f"{prefix}{report_date}.csv") for prefix in prefixes}
+        raw_files = DebiFlowGCS.from_bucket(bucket).fetch_many(raw_paths.values(), missing_ok=True)
+
+    for prefix in prefixes:
+        with progress.stage(f"merge {prefix}Master"):
+            try:
+                raw_name = f"{prefix}{report_date}.csv"
+                master_prev_name = f"{prefix}Master_{previous}.csv"
+                master_new_name = f"{prefix}Master_{report_date}.csv"
+
+                print(f"\n🔄 Merging {raw_name} + {master_prev_name} → {master_new_name}")
+
+                # Only the new raw file is loaded; the previous master's segments are reused
+                raw_bytes = raw_files[raw_paths[prefix]]
+                if raw_bytes is None:
+                    raise FileNotFoundError(f"{raw_name} not found in raw/")
+                df_new = pd.read_csv(BytesIO(raw_bytes), dtype=str, low_memory=False)
+                df_new = normalise_master_rows(df_new, prefix)
+                progress.rows(len(df_new))
+
+                print(f"✅ Loaded new raw: {raw_name} ({len(df_new)} rows)")
+                print(f"🧾 Columns in {raw_name}: {df_new.columns.tolist()}")
+
+                # Append as a new segment and write the manifest for this period
+                manifest, df_master = append_master(
+                    bucket, investor, prefix, report_date, previous, df_new, assemble=prefix in handoff_prefixes
+                )
+                print(f"☁️ Uploaded: {master_new_name} ({manifest['rows']} rows in {len(manifest['segments'])} segments)")
+                if df_master is not None:
+                    pipeline.put(build_investor_path(investor, "master", master_new_name), df_master)
+
+                updated_files.append(master_new_name)
+                record_blobs(bucket, investor, [build_investor_path(investor, "master", master_new_name)])
+
+            except Exception as e:
+                print(f"❌ Error processing {prefix}: {e}")
+                progress.message(f"❌ Failed to merge {prefix}: {str(e)}")
+                raise RuntimeError(f"Master merge for {report_date} failed at {prefix}: {e}") from e
+
+    # Check that all required masters exist before proceeding
+    required_files = [
+        build_investor_path(investor, "master", f"Schedule_Master_{report_date}.csv"),
+        build_investor_path(investor, "master", f"Payments_Master_{report_date}.csv"),
+        build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv")
+    ]
+    missing_files = [f for f in required_files if not master_exists(bucket, f)]
+    if missing_files:
+        print("❌ Missing required files:", missing_files)
+        progress.message("❌ Missing required files for output generation:\n" + ", ".join(missing_files))
+        raise RuntimeError(f"Masters for {report_date} missing: " + ", ".join(f.split("/")[-1] for f in missing_files))
+
+    # Run allocation steps; a stage only counts as done once all its outputs were produced
+    failed = []
+    if "payments" in planned:
+        with progress.stage("Payments_Allocated"):
+            try:
+                scripts.output_generators.generate_payments_allocated(
+                    report_date=report_date,
+                    bucket=bucket_name,
+                    investor=investor,
+                    prior_report_date=previous,
+                    full_recompute=full_recompute,
+                    pipeline=pipeline
+                )
+                require_outputs(investor, "payments", report_date, previous, pipeline)
+                output = pipeline.frames.get(build_investor_path(investor, "outputs", f"Payments_Allocated_{report_date}.csv"))
+                progress.rows(len(output))
+                print(f"✅ Payments_Allocated_{report_date}.csv generated")
+                progress.message(f"✅ Payments_Allocated_{report_date}.csv generated")
+            except Exception as e:
+                print(f"❌ Error generating Payments_Allocated: {e}")
+                progress.message(f"❌ Failed to generate Payments_Allocated: {str(e)}")
+                failed.append("Payments_Allocated")
+
+    if "receivables" in planned and failed:
+        # It would read the previous run's Payment_Allocations
+        progress.message(f"❌ Receivables_Allocated_{report_date}.csv not generated: Payments_Allocated failed")
+        failed.append("Receivables_Allocated")
+    elif "receivables" in planned:
+        with progress.stage("Receivables_Allocated"):
+            try:
+                generate_receivables_allocated(
+                    report_date=report_date, bucket=bucket_name, prior_report_date=previous, investor=investor, pipeline=pipeline
+                )
+                require_outputs(investor, "receivables", report_date, previous, pipeline)
+                output = pipeline.frames.get(build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv"))
+                progress.rows(len(output))
+                print(f"✅ Receivables_Allocated_{report_date}.csv generated")
+                progress.message(f"✅ Receivables_Allocated_{report_date}.csv generated")
+            except Exception as e:
+                print(f"❌ Error generating Receivables_Allocated: {e}")
+                progress.message(f"❌ Failed to generate Receivables_Allocated: {str(e)}")
+                failed.append("Receivables_Allocated")
+
+    # Outputs must be in GCS before the summary page reads them
+    with progress.stage("upload outputs"):
+        failed_uploads = set()
+        for path, error in pipeline.flush():
+            failed_uploads.add(path)
+            print(f"❌ Upload failed for {path}: {error}")
+            progress.message(f"❌ Failed to save {path.split('/')[-1]}: {error}")
+
+        # Catalog the outputs that made it to GCS
+        output_paths = [
+            build_investor_path(investor, "outputs", name) for name in (
+                f"Payments_Allocated_{report_date}.csv",
+                f"Payment_Allocations_{report_date}.csv",
+                f"Payments_Allocation_State_{report_date}.csv.gz",
+                f"Receivables_Allocated_{report_date}.csv",
+                f"Loan_Snapshot_{report_date}.csv",
+            )
+        ]
+        output_blobs = DebiFlowGCS.from_bucket(bucket).stat_many(output_paths)
+        record_blobs(bucket, investor, [blob.name for blob in output_blobs if blob is not None])
+
+    # Build records for the stages that ran and saved their outputs
+    with progress.stage("build records"):
+        record_built_stages(bucket, investor, report_date, previous, planned, pipeline, failed_uploads)
+
+    # The job fails (and the batch exits non-zero) unless every planned output exists
+    failed += [path.split("/")[-1] for path in sorted(failed_uploads)]
+    if failed:
+        raise RuntimeError(f"Outputs for {report_date} not produced: {', '.join(failed)}")
+
+    if skipped:
+        progress.message(f"⏭️ Up to date, not rebuilt: {', '.join(skipped)}")
+    later = later_periods(bucket, investor, report_date) if planned else []
+    if later:
+        progress.message(
+            f"ℹ️ Later periods built on {report_date} may now be out of date: {', '.join(later)}. "
+            f"Re-confirm them in order (or run python -m scripts.batch --investors {investor} --from {later[0]})."
+        )
+
+    # Totals for the payment summary and request PDFs, computed once from the fresh outputs
+    with progress.stage("period metrics"):
+        refresh_period_metrics(bucket, investor, report_date)
+
+    print(f"\n✅ All files merged and outputs generated for {report_date}: {updated_files}\n")
+    progress.message(f"✅ Master file merges complete for {report_date}: " + (", ".join(updated_files) or "all up to date"))
+    return "summary", {"report_date": report_date, "investor": investor}
+
+
+@loan_id_scope()
+def finalise_repurchases(progress, bucket_name, investor, report_date, prior_date, threshold):
+    from scripts.receivables_allocated import generate_receivables_allocated, read_receivables_allocated
+    from scripts.columnar import write_table
+    from scripts.loader import load_table
+    from scripts.pipeline import Pipeline
+    from scripts.builds import plan_period
+
+    bucket = get_bucket(bucket_name)
+
+    # Load Receivables_Allocated for the current period
+    with progress.stage("select repurchases"):
+        df_recv = read_receivables_allocated(
+            bucket, investor, report_date, columns=["LoanID", "Due_Date", "Repurchase_Date", "Days_Past_Due"]
+        )
+        df_recv["Days_Past_Due"] = df_recv["Days_Past_Due"].fillna(0).astype(int)
+        progress.rows(len(df_recv))
+
+        # Select candidates
+        to_repurchase = df_recv[
+            (df_recv["Days_Past_Due"] >= threshold) & (df_recv["Repurchase_Date"].isna())
+        ][["LoanID", "Due_Date"]].copy()
+
+        if not to_repurchase.empty:
+            to_repurchase["Repurchase_Date"] = pd.to_datetime(report_date, format="%Y%m%d").normalize()
+            to_repurchase["Finalized"] = "TRUE"
+
+    with progress.stage("Repurchases_Master"):
+        # Load prior Repurchases_Master
+        try:
+            existing = load_table(
+                bucket, build_investor_path(investor, "master", f"Repurchases_Master_{prior_date}.csv")
+            )
+            print(f"[INFO] Loaded cumulative Repurchases_Master from {prior_date}")
+        except Exception as e:
+            print(f"[WARN] No prior Repurchases_Master found: {e}")
+            existing = pd.DataFrame(columns=["LoanID", "Due_Date", "Repurchase_Date", "Finalized"])
+
+        # Combine and deduplicate
+        updated = pd.concat([existing, to_repurchase], ignore_index=True)
+        updated.drop_duplicates(subset=["LoanID", "Due_Date"], keep="last", inplace=True)
+
+        # Format dates
+        updated["Due_Date"] = pd.to_datetime(updated["Due_Date"], errors="coerce").dt.strftime("%Y-%m-%d")
+        updated["Repurchase_Date"] = pd.to_datetime(updated["Repurchase_Date"], errors="coerce").dt.strftime("%Y-%m-%d")
+        progress.rows(len(updated))
+
+        # Always save back under current report date
+        repurchases_path = build_investor_path(investor, "master", f"Repurchases_Master_{report_date}.csv")
+        write_table(bucket, repurchases_path, updated)
+        record_blobs(bucket, investor, [repurchases_path])
+
+    # Re-generate Receivables_Allocated using this cumulative file, unless its inputs are
+    # unchanged (the rewritten Repurchases_Master has the same content when nothing was added)
+    with progress.stage("Receivables_Allocated"):
+        planned = dict(plan_period(bucket, investor, report_date, prior_date, stages=["receivables"]))
+        pipeline = Pipeline()
+        failed_uploads = set()
+        if planned:
+            print(f"[INFO] Rebuilding receivables for {report_date}: {planned['receivables']}")
+            generate_receivables_allocated(
+                report_date=report_date, bucket=bucket_name, prior_report_date=prior_date, investor=investor, pipeline=pipeline
+            )
+            require_outputs(investor, "receivables", report_date, prior_date, pipeline)
+            output = pipeline.frames.get(build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv"))
+            progress.rows(len(output))
+        else:
+            print(f"[INFO] Receivables_Allocated_{report_date}.csv is up to date, not regenerated")
+        for path, error in pipeline.flush():
+            failed_uploads.add(path)
+            print(f"[ERROR] Upload failed for {path}: {error}")
+            progress.message(f"❌ Failed to save {path.split('/')[-1]}: {error}")
+        record_built_stages(bucket, investor, report_date, prior_date, planned, pipeline, failed_uploads)
+        if failed_uploads:
+            raise RuntimeError(f"Outputs for {report_date} not saved: "
+                               + ", ".join(path.split("/")[-1] for path in sorted(failed_uploads)))
+
+    with progress.stage("period metrics"):
+        refresh_period_metrics(bucket, investor, report_date)
+
+    if to_repurchase.empty:
+        progress.message("✅ No new repurchases needed. Prior repurchases were carried forward.")
+    else:
+        progress.message(f"✅ Finalised {len(to_repurchase)} new repurchases and updated receivables.")
+    return "payment_summary_route", {"report_date": report_date, "investor": investor}
+
+
+def refresh_period_metrics(bucket, investor, report_date):
+    """
+    Bring the period metrics sidecar up to date. A failure only logs: the routes then
+    compute the totals themselves.
+    """
+    from scripts.period_metrics import period_metrics
+
+    try:
+        period_metrics(bucket, investor, report_date)
+    except Exception as e:
+        print(f"[WARN] Period metrics not written for {investor} {report_date}: {e}")
+
+
+def require_outputs(investor, stage, report_date, previous, pipeline):
+    """
+    Raise unless the stage handed all its outputs to the pipeline: a generator that returns
+    without them has failed, whatever it logged.
+    """
+    from scripts.builds import stage_io
+
+    _, outputs = stage_io(investor, stage, report_date, previous)
+    missing = [path.split("/")[-1] for path in outputs if path not in pipeline.frames]
+    if missing:
+        raise RuntimeError(f"{', '.join(missing)} not produced")
+
+
+def record_built_stages(bucket, investor, report_date, previous, planned, pipeline, failed_uploads):
+    """
+    Write build records for the planned stages that produced and uploaded all their
+    outputs. A stage that failed keeps its old record, so it is planned again next time.
+    """
+    from scripts.builds import stage_io, record_build
+
+    for stage in planned:
+        _, outputs = stage_io(investor, stage, report_date, previous)
+        # A failed merge ends the job before this point; generators hand their outputs on
+        produced = stage.startswith("merge:") or all(path in pipeline.frames for path in outputs)
+        if not produced or failed_uploads.intersection(outputs):
+            print(f"[WARN] {stage} for {report_date} did not complete, no build record written")
+            continue
+        try:
+            record_build(bucket, investor, stage, report_date, previous)
+        except Exception as e:
+            print(f"[WARN] Build record for {stage} {report_date} not written: {e}")
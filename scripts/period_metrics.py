@@ -0,0 +1,100 @@
+import json
+import time
+from scripts.loader import load_table
+from scripts.masters import source_generations
+from scripts.receivables_allocated import read_receivables_allocated
+from scripts.utils import build_investor_path
+
+# Period metrics sidecar: meta/Period_Metrics_<date>.json holds the handful of totals the
+# payment summary and the request PDFs show, so those read one small file instead of
+# parsing whole CSVs. Each section records the generation of the blob it was computed
+# from; a section whose source has since been regenerated (or that is missing) is
+# recomputed from the source and written back. confirm and finalise fill it in as soon as
+# their outputs are uploaded.
+METRICS_VERSION = 1
+
+
+def metrics_path(investor, report_date):
+    return build_investor_path(investor, "meta", f"Period_Metrics_{report_date}.json")
+
+
+def _receivables_metrics(bucket, investor, report_date):
+    df = read_receivables_allocated(
+        bucket, investor, report_date, columns=["LoanID", "Repurchase_Date", "Minimum_Recovery_Amount"]
+    )
+    amounts = df["Minimum_Recovery_Amount"].fillna(0)
+    repurchased = df["Repurchase_Date"].dt.strftime("%Y%m%d") == report_date
+    return {
+        "receivables_sum": float(amounts.sum()),
+        "repurchased_sum": float(amounts[repurchased].sum()),
+        "repurchased_count": int(df.loc[repurchased, "LoanID"].nunique()),
+    }
+
+
+def _repayments_metrics(bucket, investor, report_date):
+    df = load_table(
+        bucket,
+        build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv"),
+        columns=["HP_Repayment_Amount"]
+    )
+    return {"repayments_sum": float(df["HP_Repayment_Amount"].fillna(0).sum())}
+
+
+def _schedule_metrics(bucket, investor, report_date):
+    df = load_table(
+        bucket, build_investor_path(investor, "raw", f"Schedule_{report_date}.csv"), columns=["Purchase_Consideration"]
+    )
+    return {"purchase_consideration_sum": float(df["Purchase_Consideration"].fillna(0).sum())}
+
+
+# section: (source blob, function computing its values from the full table)
+SECTIONS = {
+    "receivables": (lambda investor, date: build_investor_path(investor, "outputs", f"Receivables_Allocated_{date}.csv"),
+                    _receivables_metrics),
+    "repayments": (lambda investor, date: build_investor_path(investor, "master", f"HP_Repayments_Master_{date}.csv"),
+                   _repayments_metrics),
+    "schedule": (lambda investor, date: build_investor_path(investor, "raw", f"Schedule_{date}.csv"),
+                 _schedule_metrics),
+}
+
+
+def period_metrics(bucket, investor, report_date, sections=None):
+    """
+    Merged values of the given sections (default all) for the period. Current sections
+    come from the sidecar; missing or stale ones are computed from their source and saved.
+    Raises FileNotFoundError when a source does not exist.
+    """
+    t0 = time.time()
+    sections = list(sections or SECTIONS)
+    sources = {name: SECTIONS[name][0](investor, report_date) for name in sections}
+    generations = source_generations(bucket, sources.values())
+
+    sidecar_blob = bucket.get_blob(metrics_path(investor, report_date))
+    sidecar = json.loads(sidecar_blob.download_as_text()) if sidecar_blob is not None else {}
+    if sidecar.get("version") != METRICS_VERSION:
+        sidecar = {"version": METRICS_VERSION, "sections": {}}
+
+    values, recomputed = {}, []
+    for name in sections:
+        source, generation = sources[name], generations[sources[name]]
+        if generation is None:
+            raise FileNotFoundError(f"{source} not found")
+        entry = sidecar["sections"].get(name)
+        if entry is None or entry["generation"] != str(generation):
+            entry = {"source": source, "generation": str(generation),
+                     "values": SECTIONS[name][1](bucket, investor, report_date)}
+            sidecar["sections"][name] = entry
+            recomputed.append(name)
+        values.update(entry["values"])
+
+    if recomputed:
+        # A lost race with another writer only means the section is recomputed next time
+        try:
+            bucket.blob(metrics_path(investor, report_date)).upload_from_string(
+                json.dumps(sidecar, indent=2), content_type="application/json"
+            )
+        except Exception as e:
+            print(f"[WARN] Could not save period metrics for {investor} {report_date}: {e}")
+    print(f"[TIMER] Period metrics for {investor} {report_date} in {time.time() - t0:.2f}s "
+          f"(recomputed: {', '.join(recomputed) or 'none'})")
+    return values
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class Pipeline:
+    """
+    In-memory hand-off between the /confirm stages. Each stage puts the frames it produces
+    under their GCS path and the next stage takes them from here instead of downloading and
+    re-parsing; the GCS uploads run as write-behind on a small thread pool and are awaited
+    once, in flush().
+    """
+
+    def __init__(self, max_writers: int = 4):
+        self.frames = {}
+        self._writer = ThreadPoolExecutor(max_workers=max_writers, thread_name_prefix="write-behind")
+        self._pending = []
+
+    def put(self, path, df):
+        self.frames[path] = df
+
+    def get(self, path, columns=None):
+        """
+        Copy of the frame stored under path (None if no stage produced it), limited to
+        columns the same way read_table limits a load.
+        """
+        df = self.frames.get(path)
+        if df is None:
+            return None
+        if columns is not None:
+            df = df[[col for col in df.columns if col in columns]]
+        print(f"[INFO] Handed off {path} in memory")
+        return df.copy()
+
+    def write_behind(self, paths, fn, *args):
+        """
+        Run fn(*args) on the writer pool; paths are the blobs it uploads.
+        """
+        self._pending.append((paths, self._writer.submit(fn, *args)))
+
+    def flush(self):
+        """
+        Wait for every write-behind upload. Returns [(path, error)] for every path of the
+        uploads that failed.
+        """
+        t0 = time.time()
+        wait([future for _, future in self._pending])
+        self._writer.shutdown()
+        failed = [
+            (path, future.exception()) for paths, future in self._pending if future.exception() for path in paths
+        ]
+        print(f"[TIMER] Write-behind flush ({len(self._pending)} uploads, {len(failed)} failed): {time.time() - t0:.2f}s")
+        self._pending = []
+        return failed
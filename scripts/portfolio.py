@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scripts.catalog import load_catalog
+from scripts.masters import source_generations
+from scripts.period_metrics import period_metrics
+from scripts.receivables_allocated import read_loan_snapshot
+from scripts.summary_generator import snapshot_buckets, par_bucket_edges
+from scripts.utils import build_investor_path
+
+# Portfolio view: every investor at its latest confirmed period, one thread per investor
+# (at most PORTFOLIO_WORKERS at once). Each investor reads its Loan_Snapshot and the period
+# metrics sidecar rather than Receivables_Allocated, and its figures are kept in memory
+# until the generation of one of its outputs changes, so a reload only recomputes the
+# investors whose outputs were regenerated.
+PORTFOLIO_WORKERS = int(os.getenv("PORTFOLIO_WORKERS", "8"))
+
+_overviews_lock = threading.Lock()
+_overviews = {}
+
+
+def list_investors(bucket):
+    """
+    Investor names, from the folders under Investors/.
+    """
+    iterator = bucket.list_blobs(prefix="Investors/", delimiter="/")
+    prefixes = set()
+
+    # This forces iteration and fills prefixes
+    for page in iterator.pages:
+        prefixes.update(page.prefixes)
+
+    # Clean investor names (remove "Investors/" and trailing "/")
+    return [p.replace("Investors/", "").strip("/") for p in sorted(prefixes)]
+
+
+def latest_output_date(catalog):
+    dates = [
+        date for date, names in catalog["outputs"].items()
+        if any(name.startswith("Receivables_Allocated_") for name in names)
+    ]
+    return max(dates) if dates else None
+
+
+def investor_overview(bucket, investor):
+    """
+    PAR buckets, totals and repurchases of the investor's latest period (no threshold, as
+    /summary shows by default). Served from memory while its outputs are unchanged.
+    """
+    report_date = latest_output_date(load_catalog(bucket, investor))
+    if report_date is None:
+        return {"investor": investor, "report_date": None}
+
+    sources = [
+        build_investor_path(investor, "outputs", f"Loan_Snapshot_{report_date}.csv"),
+        build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv"),
+        build_investor_path(investor, "master", f"HP_Repayments_Master_{report_date}.csv"),
+    ]
+    key = (report_date, tuple(source_generations(bucket, sources).values()))
+    with _overviews_lock:
+        cached = _overviews.get(investor)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    snapshot = read_loan_snapshot(bucket, investor, report_date)
+    metrics = period_metrics(bucket, investor, report_date, ["receivables", "repayments"])
+    bucket_values, total_portfolio, total_due = snapshot_buckets(snapshot, edges=par_bucket_edges(investor))
+    total_paid = metrics["repayments_sum"]
+    overview = {
+        "investor": investor,
+        "report_date": report_date,
+        "total_due": float(total_due),
+        "total_paid": float(total_paid),
+        "total_due_on_date": float(total_due - total_paid),
+        "total_portfolio": float(total_portfolio),
+        "buckets": [
+            {"bucket": name, "value": float(value),
+             "percentage": float(value / total_portfolio * 100) if total_portfolio > 0 else 0.0}
+            for name, value in bucket_values.items()
+        ],
+        "repurchased_count": metrics["repurchased_count"],
+        "repurchased_sum": metrics["repurchased_sum"],
+    }
+    with _overviews_lock:
+        _overviews[investor] = (key, overview)
+    return overview
+
+
+def portfolio_overview(bucket, investors=None):
+    """
+    investor_overview for every investor (default: all of them), computed in parallel.
+    An investor that fails is reported with its error instead of failing the page.
+    Returns (overviews, totals over the investors with a period).
+    """
+    t0 = time.time()
+    investors = list_investors(bucket) if investors is None else list(investors)
+
+    def overview(investor):
+        try:
+            return investor_overview(bucket, investor)
+        except Exception as e:
+            print(f"[WARN] Portfolio overview failed for {investor}: {e}")
+            return {"investor": investor, "report_date": None, "error": str(e)}
+
+    if investors:
+        with ThreadPoolExecutor(max_workers=max(1, min(PORTFOLIO_WORKERS, len(investors)))) as pool:
+            overviews = list(pool.map(overview, investors))
+    else:
+        overviews = []
+
+    reported = [o for o in overviews if o.get("report_date")]
+    totals = {
+        field: sum(o[field] for o in reported)
+        for field in ("total_due", "total_paid", "total_due_on_date", "total_portfolio",
+                      "repurchased_count", "repurchased_sum")
+    }
+    print(f"[TIMER] Portfolio overview of {len(investors)} investors in {time.time() - t0:.2f}s")
+    return overviews, totals
@@ -2,11 +2,183 @@ import pandas as pd
 import numpy as np
 import io
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+from pandas.api.extensions import take
 from scripts.debiflow_gcs import DebiFlowGCS
 from scripts.utils import build_investor_path, require_investor
+from scripts.sharding import SHARD_WORKERS, loan_shards, run_sharded, concat_shards
+from scripts.columnar import write_tables
+from scripts.loader import load_table, load_tables, apply_schema, file_type, loan_ids_as_text
+from scripts.frame_cache import cached_table
+from scripts.summary_generator import build_loan_snapshot
 
-def generate_receivables_allocated(report_date: str, bucket: str, prior_report_date: str, investor):
+def _factorize_together(arrays):
+    """
+    One factorisation across several key arrays, so equal values get the same integer code
+    in every array. Missing values (NaN / NaT) get a code of their own and match each other,
+    as they do in DataFrame.merge. Returns (codes per array, number of distinct values).
+    """
+    codes, uniques = pd.factorize(np.concatenate(arrays), use_na_sentinel=False)
+    return np.split(codes.astype(np.int64), np.cumsum([len(a) for a in arrays])[:-1]), len(uniques)
+
+
+def _key_values(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy("datetime64[ns]").view(np.int64)
+    return values.to_numpy()
+
+
+def _attach(df_calc, calc_keys, right, right_keys, columns):
+    """
+    Add columns from right to df_calc in place, looking each row's integer key up in
+    right's (unique) keys; rows without a match get NaN / NaT, as in a left join.
+    """
+    positions = pd.Index(right_keys).get_indexer(calc_keys)
+    for col in columns:
+        df_calc[col] = take(right[col].to_numpy(), positions, allow_fill=True)
+    return positions
+
+
+def calculate_receivables(df_calc, payment_long, df_prev, df_overrides, report_date_dt):
+    """
+    Attach allocations and repurchases to the schedule rows in df_calc and compute
+    Days_Past_Due and Minimum_Recovery_Amount. Works on any subset of whole loans.
+    The (LoanID, Receivable_Index) and (LoanID, Due_Date) keys are turned into integers
+    once, from a single LoanID factorisation over every frame, and each right-hand frame
+    (unique on its key) is looked up by position instead of merged, so the schedule is
+    never copied.
+    """
+    t_keys = time.time()
+    repurchases = [df for df in (df_prev, df_overrides) if df is not None]
+    loan_codes, _ = _factorize_together(
+        [_key_values(df['LoanID']) for df in [df_calc, payment_long] + repurchases]
+    )
+    (calc_index, alloc_index), n_index = _factorize_together(
+        [_key_values(df_calc['Receivable_Index']), _key_values(payment_long['Receivable_Index'])]
+    )
+    due_codes, n_due = _factorize_together([_key_values(df['Due_Date']) for df in [df_calc] + repurchases])
+    calc_due_key = loan_codes[0] * n_due + due_codes[0]
+    repurchase_keys = [codes * n_due + due for codes, due in zip(loan_codes[2:], due_codes[1:])]
+    print(f"[TIMER] Join keys: {time.time() - t_keys:.2f}s")
+
+    # Allocations by (LoanID, Receivable_Index)
+    t_merge1 = time.time()
+    _attach(
+        df_calc, loan_codes[0] * n_index + calc_index, payment_long, loan_codes[1] * n_index + alloc_index,
+        [col for col in payment_long.columns if col not in ("LoanID", "Receivable_Index")]
+    )
+    df_calc["Payment_allocated"] = df_calc["Payment_allocated"].fillna(0).round(2)
+    print(f"[TIMER] Merge allocations: {time.time() - t_merge1:.2f}s")
+
+    # Finalized repurchases from previous reporting period, by (LoanID, Due_Date)
+    t_prev = time.time()
+    if df_prev is not None:
+        _attach(df_calc, calc_due_key, df_prev, repurchase_keys.pop(0), ["Repurchase_Date"])
+        print(f"[TIMER] Merge previous repurchases: {time.time() - t_prev:.2f}s")
+    else:
+        df_calc["Repurchase_Date"] = pd.NaT
+
+    # Current repurchase overrides fill the dates the previous period did not set
+    t_curr = time.time()
+    if df_overrides is not None:
+        positions = pd.Index(repurchase_keys.pop(0)).get_indexer(calc_due_key)
+        override = take(df_overrides["Repurchase_Date"].to_numpy(), positions, allow_fill=True)
+        df_calc["Repurchase_Date"] = df_calc["Repurchase_Date"].combine_first(pd.Series(override, index=df_calc.index))
+        print(f"[TIMER] Merge current repurchases: {time.time() - t_curr:.2f}s")
+
+    # Calculate Days Past Due
+    t_dpd = time.time()
+    due_mask = (
+        (df_calc['Payment_allocated'] == 0) &
+        (df_calc['Repurchase_Date'].isna()) &
+        (df_calc['Due_Date'] < report_date_dt)
+    )
+    df_calc['Days_Past_Due'] = np.where(
+        due_mask,
+        (report_date_dt - df_calc['Due_Date']).dt.days,
+        0
+    )
+    print(f"[TIMER] Days Past Due calculation: {time.time() - t_dpd:.2f}s")
+
+    # Calculate Minimum Recovery Amount (If no repurchase date is provided, Allocation date is used.ie. Allocation_Date will only be used if Repurchase_Date is missing)
+    t_mra = time.time()
+    cutoff = df_calc['Repurchase_Date'].combine_first(df_calc['Allocation_Date'])
+    cutoff = pd.to_datetime(cutoff, errors="coerce")
+    cutoff[~((cutoff > "1900-01-01") & (cutoff < "2100-01-01"))] = pd.NaT
+    days_elapsed = (cutoff - df_calc['Purchase_Date']).dt.days.fillna(0)
+    has_cutoff = df_calc['Allocation_Date'].notna() | df_calc['Repurchase_Date'].notna()
+    df_calc['Minimum_Recovery_Amount'] = np.where(
+        has_cutoff,
+        (df_calc['Purchase_Consideration'] * (1 + df_calc['Advance_Rate'] * days_elapsed / 365)).round(2),
+        np.nan
+    )
+    print(f"[TIMER] Minimum Recovery Amount calculation: {time.time() - t_mra:.2f}s")
+    return df_calc
+
+
+def calculate_receivables_sharded(df_calc, payment_long, df_prev, df_overrides, report_date_dt, workers=None):
+    """
+    Run calculate_receivables on LoanID hash shards in a process pool. It only ever looks
+    within a loan, so the shards run independently; rows come back grouped by shard, so
+    callers restore their order (generate_receivables_allocated sorts on RowID).
+    """
+    workers = workers or SHARD_WORKERS
+    if workers <= 1:
+        return calculate_receivables(df_calc, payment_long, df_prev, df_overrides, report_date_dt)
+
+    frames = [df_calc, payment_long, df_prev, df_overrides]
+    shards = [loan_shards(df['LoanID'], workers) if df is not None else None for df in frames]
+    tasks = [
+        tuple(df[shard == k] if df is not None else None for df, shard in zip(frames, shards)) + (report_date_dt,)
+        for k in range(workers)
+    ]
+    tasks = [task for task in tasks if len(task[0])] or tasks[:1]
+    return concat_shards(run_sharded(calculate_receivables, tasks, workers))
+
+
+def allocations_from_wide(df_payments):
+    """
+    Long allocation rows from a Payments_Allocated written before Payment_Allocations existed,
+    where Payment_Allocation_pmt<i> / Payment_Allocation_flag<i> hold receivable i. Returns
+    None when the file has no such columns.
+    """
+    pmt_cols = [col for col in df_payments.columns if col.startswith("Payment_Allocation_pmt")]
+    if not pmt_cols:
+        return None
+    frames = []
+    for i in range(1, len(pmt_cols) + 1):
+        part = df_payments[["LoanID", "Paid_Date", f"Payment_Allocation_pmt{i}", f"Payment_Allocation_flag{i}"]].rename(
+            columns={f"Payment_Allocation_pmt{i}": "Payment_allocated", f"Payment_Allocation_flag{i}": "Flag"}
+        )
+        part["Receivable_Index"] = i
+        frames.append(part)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_receivables_allocated(bucket, investor, report_date, columns=None):
+    """
+    Typed Receivables_Allocated_<report_date>, parsed once per GCS generation and then
+    served from the in-process frame cache to the summary, payment summary, PDF and finalise routes.
+    """
+    path = build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv")
+    return cached_table(bucket, path, columns=columns)
+
+
+def read_loan_snapshot(bucket, investor, report_date):
+    """
+    Loan_Snapshot_<report_date> (see build_loan_snapshot), through the frame cache. Periods
+    generated before snapshots existed get one built from Receivables_Allocated.
+    """
+    path = build_investor_path(investor, "outputs", f"Loan_Snapshot_{report_date}.csv")
+    try:
+        return cached_table(bucket, path)
+    except FileNotFoundError:
+        print(f"[INFO] No Loan_Snapshot for {report_date}, building it from Receivables_Allocated")
+        return build_loan_snapshot(read_receivables_allocated(bucket, investor, report_date))
+
+
+def generate_receivables_allocated(report_date: str, bucket: str, prior_report_date: str, investor, workers: int = None,
+                                   pipeline=None):
     t_start = time.time()
     print("[INFO] Starting generate_receivables_allocated()")
 
@@ -14,30 +186,56 @@ def generate_receivables_allocated(report_date: str, bucket: str, prior_report_d
 
     gcs = DebiFlowGCS(bucket)
 
-    def read_csv_from_gcs(investor, folder, filename):
-        t0 = time.time()
+    def read_csv_from_gcs(investor, folder, filename, columns=None):
         path = build_investor_path(investor, folder, filename)
-        blob = gcs.bucket.blob(path)
-        df = pd.read_csv(io.StringIO(blob.download_as_text()), dtype={"LoanID": str}, low_memory=False)
-        print(f"[TIMER] Loaded {path} in {time.time() - t0:.2f}s")
-        return df
+        df = pipeline.get(path, columns=columns) if pipeline else None
+        if df is None:
+            return load_table(gcs.bucket, path, columns=columns)
+        return apply_schema(df, file_type(path))
 
-    def write_csv_to_gcs(df, path):
-        t0 = time.time()
+    def clean_repurchases(df):
+        df['LoanID'] = loan_ids_as_text(df['LoanID'])
+        df = df[df['Finalized'].astype(str).str.upper().str.strip() == "TRUE"]
+        return df.drop_duplicates(subset=["LoanID", "Due_Date"])
+
+    def write_outputs(tables):
+        # Independent outputs, so their uploads go up together
+        if pipeline:
+            for path, df in tables:
+                pipeline.put(path, df)
+            pipeline.write_behind([path for path, _ in tables], write_tables, gcs.bucket, tables)
+            return
         try:
-            blob = gcs.bucket.blob(path)
-            blob.upload_from_string(df.to_csv(index=False), content_type="text/csv")
-            print(f"[UPLOAD] Wrote {path} in {time.time() - t0:.2f}s")
+            write_tables(gcs.bucket, tables)
         except Exception as e:
-            print(f"[ERROR] Upload failed for {path}: {e}")
+            print(f"[ERROR] Upload failed for {', '.join(path for path, _ in tables)}: {e}")
 
     try:
         # Load Inputs
         t_load = time.time()
         output_blob = build_investor_path(investor, "outputs", f"Receivables_Allocated_{report_date}.csv")
+        snapshot_blob = build_investor_path(investor, "outputs", f"Loan_Snapshot_{report_date}.csv")
 
         df_schedule = read_csv_from_gcs(investor, "master", f"Schedule_Master_{report_date}.csv")
-        df_payments = read_csv_from_gcs(investor, "outputs", f"Payments_Allocated_{report_date}.csv")
+        try:
+            payment_long = read_csv_from_gcs(
+                investor, "outputs", f"Payment_Allocations_{report_date}.csv",
+                columns=["LoanID", "Paid_Date", "Receivable_Index", "Payment_allocated", "Flag"]
+            )
+        except FileNotFoundError:
+            # Periods allocated before Payment_Allocations existed only have the wide output
+            try:
+                payment_long = allocations_from_wide(
+                    read_csv_from_gcs(investor, "outputs", f"Payments_Allocated_{report_date}.csv")
+                )
+            except FileNotFoundError:
+                payment_long = None
+            if payment_long is None:
+                raise FileNotFoundError(
+                    f"No payment allocations for {report_date}: regenerate the allocations for this period "
+                    f"(confirm it again with Full recompute) before building Receivables_Allocated"
+                )
+            print(f"[INFO] No Payment_Allocations_{report_date}.csv, using the wide Payments_Allocated columns")
 
         print(f"[TIMER] Total CSV load time: {time.time() - t_load:.2f}s")
 
@@ -45,36 +243,21 @@ def generate_receivables_allocated(report_date: str, bucket: str, prior_report_d
         t_clean = time.time()
         df_schedule.columns = [col.strip() for col in df_schedule.columns]
         df_schedule.rename(columns={"originator_LoanID": "LoanID"}, inplace=True)
-        df_schedule['LoanID'] = df_schedule['LoanID'].astype(str).str.strip()
+        df_schedule['LoanID'] = loan_ids_as_text(df_schedule['LoanID'])
         df_schedule = df_schedule.dropna(how="all")
         df_schedule = df_schedule[df_schedule['LoanID'].notna()]
-        df_schedule['Due_Date'] = pd.to_datetime(df_schedule['Due_Date'], errors="coerce").dt.normalize()
-        df_schedule['Purchase_Date'] = pd.to_datetime(df_schedule['Purchase_Date'], errors="coerce").dt.normalize()
         print(f"[TIMER] Schedule cleaning: {time.time() - t_clean:.2f}s")
 
         # Pre-allocate
         df_calc = df_schedule.copy().reset_index(drop=True)
-        df_calc["Receivable_Index"] = df_calc.groupby("LoanID").cumcount() + 1
+        df_calc["Receivable_Index"] = df_calc.groupby("LoanID", observed=True).cumcount() + 1
         df_calc["RowID"] = df_calc.index
 
-        # Clean Payments
+        # Clean allocations (already long format: one row per payment/receivable pair)
         t_payments = time.time()
-        df_payments.columns = [col.strip() for col in df_payments.columns]
-        df_payments['LoanID'] = df_payments['LoanID'].astype(str).str.strip()
-        df_payments['Paid_Date'] = pd.to_datetime(df_payments['Paid_Date'], errors="coerce").dt.normalize()
-        print(f"[TIMER] Payments cleaning: {time.time() - t_payments:.2f}s")
-
-        # Transform to long format
-        t_long = time.time()
-        payment_cols = [col for col in df_payments.columns if col.startswith("Payment_Allocation_pmt")]
-        payment_long = pd.DataFrame()
-        for i, pmt_col in enumerate(payment_cols):
-            flag_col = f"Payment_Allocation_flag{i+1}"
-            temp = df_payments[["LoanID", "Paid_Date", pmt_col, flag_col]].copy()
-            temp.rename(columns={pmt_col: "Payment_allocated", flag_col: "Flag"}, inplace=True)
-            temp["Receivable_Index"] = i + 1
-            payment_long = pd.concat([payment_long, temp], axis=0)
-        print(f"[TIMER] Payment long transformation: {time.time() - t_long:.2f}s")
+        payment_long.columns = [col.strip() for col in payment_long.columns]
+        payment_long['LoanID'] = loan_ids_as_text(payment_long['LoanID'])
+        print(f"[TIMER] Allocations cleaning: {time.time() - t_payments:.2f}s")
 
         # Filter allocated payments
         t_filter = time.time()
@@ -84,94 +267,50 @@ def generate_receivables_allocated(report_date: str, bucket: str, prior_report_d
         payment_long = payment_long[["LoanID", "Receivable_Index", "Payment_allocated", "Allocation_Date"]]
         print(f"[TIMER] Payment filtering: {time.time() - t_filter:.2f}s")
 
-        # Merge allocations
-        t_merge1 = time.time()
-        df_calc = df_calc.merge(payment_long, on=["LoanID", "Receivable_Index"], how="left")
-        df_calc["Payment_allocated"] = df_calc["Payment_allocated"].fillna(0).round(2)
-        print(f"[TIMER] Merge allocations: {time.time() - t_merge1:.2f}s")
-
-        # Merge finalized repurchases from previous reporting period
-        t_prev = time.time()
+        # Finalized repurchases from previous reporting period
         if not prior_report_date:
             raise ValueError("prior_report_date must be provided to ensure correct repurchase continuity.")
         prior_date_str = prior_report_date
 
+        # Previous (finalized) and current repurchase masters, fetched together
+        repurchase_paths = [
+            build_investor_path(investor, "master", f"Repurchases_Master_{date_str}.csv")
+            for date_str in (prior_date_str, report_date)
+        ]
         try:
-            df_prev = read_csv_from_gcs(investor, "master", f"Repurchases_Master_{prior_date_str}.csv")
-            df_prev.columns = [col.strip() for col in df_prev.columns]
-            df_prev['LoanID'] = df_prev['LoanID'].astype(str).str.strip()
-            df_prev['Due_Date'] = pd.to_datetime(df_prev['Due_Date'], errors="coerce").dt.normalize()
-            df_prev['Repurchase_Date'] = pd.to_datetime(df_prev['Repurchase_Date'], errors="coerce").dt.normalize()
-            df_prev = df_prev[df_prev['Finalized'].astype(str).str.upper().str.strip() == "TRUE"]
-            df_prev = df_prev.drop_duplicates(subset=["LoanID", "Due_Date"])
-
-            df_calc = df_calc.merge(
-                df_prev[['LoanID', 'Due_Date', 'Repurchase_Date']],
-                on=['LoanID', 'Due_Date'],
-                how='left'
+            df_prev, df_overrides = load_tables(
+                gcs.bucket, repurchase_paths, columns=["LoanID", "Due_Date", "Repurchase_Date", "Finalized"],
+                missing_ok=True
             )
-            print(f"[TIMER] Merge previous repurchases: {time.time() - t_prev:.2f}s")
         except Exception as e:
-            print(f"[WARN] No finalized Repurchase_Master found for previous master week: {e}")
-            df_calc["Repurchase_Date"] = pd.NaT
+            print(f"[WARN] Repurchase masters could not be loaded: {e}")
+            df_prev = df_overrides = None
 
-        # Merge current repurchase overrides
-        t_curr = time.time()
-        try:
-            df_overrides = read_csv_from_gcs(investor, "master", f"Repurchases_Master_{report_date}.csv")
-            df_overrides.columns = [col.strip() for col in df_overrides.columns]
-            df_overrides['LoanID'] = df_overrides['LoanID'].astype(str).str.strip()
-            df_overrides['Due_Date'] = pd.to_datetime(df_overrides['Due_Date'], errors="coerce").dt.normalize()
-            df_overrides['Repurchase_Date'] = pd.to_datetime(df_overrides['Repurchase_Date'], errors="coerce").dt.normalize()
-            df_overrides = df_overrides[df_overrides['Finalized'].astype(str).str.upper().str.strip() == "TRUE"]
-            df_overrides = df_overrides.drop_duplicates(subset=["LoanID", "Due_Date"])
-
-            df_calc = df_calc.merge(
-                df_overrides[["LoanID", "Due_Date", "Repurchase_Date"]],
-                on=["LoanID", "Due_Date"],
-                how="left",
-                suffixes=("", "_override")
-            )
-            df_calc["Repurchase_Date"] = df_calc["Repurchase_Date"].combine_first(df_calc["Repurchase_Date_override"])
-            df_calc.drop(columns=["Repurchase_Date_override"], inplace=True)
-            print(f"[TIMER] Merge current repurchases: {time.time() - t_curr:.2f}s")
-        except Exception as e:
-            print(f"[WARN] No current Repurchase_Master: {e}")
-
-        # Calculate Days Past Due
-        t_dpd = time.time()
-        due_mask = (
-            (df_calc['Payment_allocated'] == 0) &
-            (df_calc['Repurchase_Date'].isna()) &
-            (df_calc['Due_Date'] < report_date_dt)
-        )
-        df_calc['Days_Past_Due'] = np.where(
-            due_mask,
-            (report_date_dt - df_calc['Due_Date']).dt.days,
-            0
-        )
-        print(f"[TIMER] Days Past Due calculation: {time.time() - t_dpd:.2f}s")
-
-        # Calculate Minimum Recovery Amount (If no repurchase date is provided, Allocation date is used.ie. Allocation_Date will only be used if Repurchase_Date is missing)
-        t_mra = time.time()
-        cutoff = df_calc['Repurchase_Date'].combine_first(df_calc['Allocation_Date'])
-        cutoff = pd.to_datetime(cutoff, errors="coerce")
-        cutoff[~((cutoff > "1900-01-01") & (cutoff < "2100-01-01"))] = pd.NaT
-        days_elapsed = (cutoff - df_calc['Purchase_Date']).dt.days.fillna(0)
-        has_cutoff = df_calc['Allocation_Date'].notna() | df_calc['Repurchase_Date'].notna()
-        df_calc['Minimum_Recovery_Amount'] = np.where(
-            has_cutoff,
-            (df_calc['Purchase_Consideration'] * (1 + df_calc['Advance_Rate'] * days_elapsed / 365)).round(2),
-            np.nan
-        )
-        print(f"[TIMER] Minimum Recovery Amount calculation: {time.time() - t_mra:.2f}s")
+        if df_prev is not None:
+            df_prev = clean_repurchases(df_prev)
+        else:
+            print(f"[WARN] No finalized Repurchase_Master found for previous master week: {repurchase_paths[0]} not found")
+
+        # Current repurchase overrides
+        if df_overrides is not None:
+            df_overrides = clean_repurchases(df_overrides)
+        else:
+            print(f"[WARN] No current Repurchase_Master: {repurchase_paths[1]} not found")
+
+        df_calc = calculate_receivables_sharded(df_calc, payment_long, df_prev, df_overrides, report_date_dt, workers)
 
         # Final cleanup
         df_calc.sort_values("RowID", inplace=True)
         df_calc.drop(columns=["RowID"], inplace=True)
 
-        write_csv_to_gcs(df_calc, output_blob)
+        # Compact per-loan snapshot the summary page recomputes PAR buckets from
+        t_snapshot = time.time()
+        df_snapshot = build_loan_snapshot(df_calc)
+        print(f"[TIMER] Loan snapshot: {time.time() - t_snapshot:.2f}s")
+
+        write_outputs([(output_blob, df_calc), (snapshot_blob, df_snapshot)])
         print(f"[TIMER] Total runtime: {time.time() - t_start:.2f}s")
 
     except Exception as e:
         print(f"[ERROR] Failed to generate Receivables_Allocated: {e}")
+        raise
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes for the sharded allocation / receivables stages (1 = run in-process)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+
+
+def loan_shards(loan_ids, n_shards):
+    """
+    Shard number (0..n_shards-1) for every LoanID. Uses pandas' stable hash rather than
+    hash(), which is salted per process, so the same LoanID always lands in the same shard.
+    """
+    hashes = pd.util.hash_pandas_object(pd.Series(loan_ids).reset_index(drop=True), index=False)
+    return (hashes.to_numpy() % np.uint64(n_shards)).astype(np.int64)
+
+
+def run_sharded(func, tasks, workers):
+    """
+    Run func(*args) for every args tuple in tasks on a process pool and return the
+    results in task order.
+    """
+    t0 = time.time()
+    # spawn: the caller already runs threads (write-behind uploads, the storage client pool)
+    # that a forked child would inherit mid-operation, as in scripts.jobs
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(func, *args) for args in tasks]
+        results = [future.result() for future in futures]
+    print(f"[TIMER] {func.__name__} on {len(tasks)} shards ({workers} workers): {time.time() - t0:.2f}s")
+    return results
+
+
+def concat_shards(frames):
+    """
+    Concatenate shard outputs, skipping empty ones so they cannot change column dtypes.
+    """
+    non_empty = [df for df in frames if len(df)]
+    return pd.concat(non_empty or frames[:1], ignore_index=True)
@@ -0,0 +1,95 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions as gcs_exceptions
+from scripts.catalog import record_blobs
+from scripts.debiflow_gcs import GCS_MAX_CONCURRENCY, GCS_UPLOAD_CHUNK_SIZE
+from scripts.utils import build_investor_path
+from scripts.validate_uploads import validate_stream
+
+# Direct uploads: the browser sends each raw file straight to GCS through a resumable upload
+# session on a staging blob (Investors/<investor>/staging/<token>/<file>), in chunks it can
+# resume after a dropped connection. The app then validates the staged blobs by streaming
+# them back and only copies files that pass into raw/; staged blobs are always deleted.
+# The bucket's CORS config must allow PUT from the app's origin and expose the Range header.
+STAGING_FOLDER = "staging"
+
+
+def split_findings(file_name, findings):
+    """
+    validate_stream results for one file as (errors, warnings), prefixed with the file name.
+    """
+    errors = [f"{file_name}: {f}" for f in findings if not f.startswith("Warning")]
+    warnings = [f"{file_name}: {f}" for f in findings if f.startswith("Warning")]
+    return errors, warnings
+
+
+def create_upload_sessions(bucket, investor, file_names, origin=None):
+    """
+    One resumable upload session per file, each on its own staging blob.
+    """
+    token = uuid.uuid4().hex
+    sessions = []
+    for name in file_names:
+        path = build_investor_path(investor, STAGING_FOLDER, f"{token}/{name}")
+        session_url = bucket.blob(path, chunk_size=GCS_UPLOAD_CHUNK_SIZE).create_resumable_upload_session(
+            content_type="text/csv", origin=origin
+        )
+        sessions.append({"filename": name, "staging_path": path, "session_url": session_url})
+    print(f"[INFO] Opened {len(sessions)} upload sessions for {investor} ({token})")
+    return sessions
+
+
+def is_staging_path(investor, path, file_name):
+    """
+    True if path is a staging blob this investor could have been given for file_name.
+    """
+    prefix = build_investor_path(investor, STAGING_FOLDER, "")
+    token, _, name = path[len(prefix):].partition("/") if path.startswith(prefix) else ("", "", "")
+    return bool(token) and "/" not in name and name == file_name
+
+
+def _validate_staged(bucket, file_name, path):
+    try:
+        with bucket.blob(path).open("rb", chunk_size=GCS_UPLOAD_CHUNK_SIZE) as stream:
+            return split_findings(file_name, validate_stream(file_name, stream))
+    except gcs_exceptions.NotFound:
+        return [f"{file_name}: Upload did not complete."], []
+    except Exception as e:
+        return [f"{file_name}: Could not parse CSV ({e})."], []
+
+
+def finalize_staged(bucket, investor, staged):
+    """
+    Validate staged (file_name, staging_path) pairs concurrently, streaming each from GCS.
+    If none has a hard error, copy them all into raw/ and record them in the catalog.
+    Returns (errors, warnings, raw_paths); raw_paths is empty when the batch was rejected.
+    """
+    t0 = time.time()
+    workers = max(1, min(GCS_MAX_CONCURRENCY, len(staged)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda item: _validate_staged(bucket, *item), staged))
+    errors = [e for file_errors, _ in results for e in file_errors]
+    warnings = [w for _, file_warnings in results for w in file_warnings]
+    print(f"[TIMER] Validated {len(staged)} staged files in {time.time() - t0:.2f}s ({len(errors)} errors)")
+
+    def promote(item):
+        file_name, path = item
+        blob = bucket.blob(path)
+        raw_path = build_investor_path(investor, "raw", file_name)
+        try:
+            if not errors:
+                bucket.copy_blob(blob, bucket, raw_path)
+            blob.delete()
+        except gcs_exceptions.NotFound:
+            pass
+        return raw_path
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        raw_paths = list(pool.map(promote, staged))
+    if errors:
+        return errors, warnings, []
+
+    record_blobs(bucket, investor, raw_paths)
+    print(f"[TIMER] Promoted {len(raw_paths)} files to raw/ in {time.time() - t0:.2f}s")
+    return errors, warnings, raw_paths
@@ -1,100 +1,99 @@
+import os
 import pandas as pd
 import numpy as np
 
+# PAR bucket edges in days past due: loans below the first edge are "Current", each edge k
+# gives a cumulative "PARk" bucket (max DPD >= k) and the last one is shown as "PARk+".
+# Override per investor with PAR_BUCKET_EDGES_<INVESTOR>, e.g. PAR_BUCKET_EDGES_ACME="1,30,90".
+DEFAULT_PAR_BUCKET_EDGES = os.getenv("PAR_BUCKET_EDGES", "1,7,30,60,90,120,150,180")
+
+SUMMARY_COLUMNS = ["LoanID", "Due_Date", "Allocation_Date", "Days_Past_Due",
+                   "Purchase_Consideration", "Minimum_Recovery_Amount"]
+
+
+def par_bucket_edges(investor: str = None):
+    raw = os.getenv(f"PAR_BUCKET_EDGES_{investor.upper()}", "") if investor else ""
+    edges = sorted({int(edge) for edge in (raw or DEFAULT_PAR_BUCKET_EDGES).split(",") if edge.strip()})
+    if not edges or edges[0] < 1:
+        raise ValueError(f"PAR bucket edges must be positive day counts, got {raw or DEFAULT_PAR_BUCKET_EDGES!r}")
+    return edges
+
+
+def par_buckets(loan_ids, days_past_due, purchase_consideration, edges=None):
+    """
+    PAR bucket values in one pass over the open receivables: each loan gets a bucket index
+    from its max DPD, Purchase_Consideration is summed per index, and a reverse cumulative
+    sum over the edges turns that into the cumulative PAR buckets.
+    Returns ({bucket: value}, total_portfolio).
+    """
+    edges = edges or par_bucket_edges()
+    per_loan = pd.DataFrame({
+        "LoanID": np.asarray(loan_ids),
+        "Days_Past_Due": np.asarray(days_past_due),
+        "Purchase_Consideration": np.asarray(purchase_consideration, dtype=float),
+    }).groupby("LoanID", sort=False).agg(
+        Max_Days_Past_Due=("Days_Past_Due", "max"),
+        Purchase_Consideration=("Purchase_Consideration", "sum"),
+    )
+
+    index = np.searchsorted(edges, per_loan["Max_Days_Past_Due"].to_numpy(), side="right")
+    sums = np.bincount(index, weights=per_loan["Purchase_Consideration"].to_numpy(), minlength=len(edges) + 1)
+    cumulative = np.cumsum(sums[::-1])[::-1]
+
+    labels = ["Current"] + [f"PAR{edge}" for edge in edges[:-1]] + [f"PAR{edges[-1]}+"]
+    values = [sums[0]] + list(cumulative[1:])
+    return dict(zip(labels, values)), cumulative[0]
+
+
 def generate_summary_outputs(
     receivables_df: pd.DataFrame,
     hp_repayments_df: pd.DataFrame,
     report_date: str,
     threshold: int = 999,
-    repurchase_override_df: pd.DataFrame = None
+    repurchase_override_df: pd.DataFrame = None,
+    edges=None
 ):
-    # === Clean & prep data ===
-    receivables_df['Due_Date'] = pd.to_datetime(receivables_df['Due_Date'], errors='coerce')
-    receivables_df['Allocation_Date'] = pd.to_datetime(receivables_df['Allocation_Date'], errors='coerce')
-    receivables_df['Repurchase_Date'] = pd.to_datetime(receivables_df['Repurchase_Date'], errors='coerce')
-    receivables_df['Days_Past_Due'] = pd.to_numeric(receivables_df['Days_Past_Due'], errors='coerce').fillna(0).astype(int)
-
-    hp_repayments_df['HP_Repayment_Date'] = pd.to_datetime(
-        hp_repayments_df['HP_Repayment_Date'], format="%Y-%m-%d", errors="coerce"
-    )
-
-    hp_repayments_df["HP_Repayment_Amount"] = pd.to_numeric(
-    hp_repayments_df["HP_Repayment_Amount"], errors="coerce").fillna(0)
-
+    hp_repayments_df = clean_hp_repayments(hp_repayments_df)
     total_paid = hp_repayments_df['HP_Repayment_Amount'].sum()
 
-    # === Apply repurchase overrides if present ===
+    # === Apply repurchase overrides if present (merging only the columns the summary uses) ===
     if repurchase_override_df is not None and not repurchase_override_df.empty:
-        repurchase_override_df = repurchase_override_df.copy()
-        repurchase_override_df['Repurchase_Date'] = pd.to_datetime(repurchase_override_df['Repurchase_Date'], errors='coerce')
-        repurchase_override_df['Due_Date'] = pd.to_datetime(repurchase_override_df['Due_Date'], errors='coerce', format="%Y/%m/%d")
-
-        receivables_df = pd.merge(
-            receivables_df.drop(columns=['Repurchase_Date'], errors='ignore'),
-            repurchase_override_df[['LoanID', 'Due_Date', 'Repurchase_Date']],
-            on=['LoanID', 'Due_Date'],
-            how='left'
-        )
-
-    # === Simulate threshold-based repurchases (for display only)
-    simulated = receivables_df.copy()
-    simulated['Sim_Repurchase'] = False
-    simulated.loc[
-        (simulated['Days_Past_Due'] >= threshold) &
-        (simulated['Repurchase_Date'].isna()),
-        'Sim_Repurchase'
-    ] = True
-
-
-    receivables_df["Minimum_Recovery_Amount"] = pd.to_numeric(
-    receivables_df["Minimum_Recovery_Amount"], errors="coerce").fillna(0)
-
-    # ✅ TRUE total due (unfiltered sum of all Minimum_Recovery_Amount)
-    total_due = receivables_df['Minimum_Recovery_Amount'].sum()
-
-    # ✅ PAR accounts = remaining unrepaid + unallocated + unrepurchased
-    unrepaid = simulated[
-        (simulated['Allocation_Date'].isna()) &
-        (simulated['Repurchase_Date'].isna()) &
-        (~simulated['Sim_Repurchase'])
-    ].copy()
-
-    # Compute max DPD per LoanID
-    max_dpd_per_loan = unrepaid.groupby('LoanID')['Days_Past_Due'].transform('max')
-
-
-
-    # Annotate each row
-    unrepaid['Max_Days_Past_Due_Per_Loan'] = max_dpd_per_loan
-
-    # ✅ Clean Purchase_Consideration in unrepaid (important)
-    unrepaid["Purchase_Consideration"] = pd.to_numeric(
-    unrepaid["Purchase_Consideration"], errors="coerce"
-    ).fillna(0)
-
-    receivables_df["Purchase_Consideration"] = pd.to_numeric(
-    receivables_df["Purchase_Consideration"], errors="coerce").fillna(0)
-
+        overrides = pd.DataFrame({
+            'LoanID': repurchase_override_df['LoanID'],
+            'Due_Date': pd.to_datetime(repurchase_override_df['Due_Date'], errors='coerce', format="%Y/%m/%d"),
+            'Repurchase_Date': pd.to_datetime(repurchase_override_df['Repurchase_Date'], errors='coerce'),
+        })
+        receivables_df = receivables_df[SUMMARY_COLUMNS].assign(
+            Due_Date=pd.to_datetime(receivables_df['Due_Date'], errors='coerce')
+        ).merge(overrides, on=['LoanID', 'Due_Date'], how='left')
+    repurchase_date = pd.to_datetime(receivables_df['Repurchase_Date'], errors='coerce')
 
+    days_past_due = pd.to_numeric(receivables_df['Days_Past_Due'], errors='coerce').fillna(0).astype(int)
+    allocation_date = pd.to_datetime(receivables_df['Allocation_Date'], errors='coerce')
 
-    total_portfolio = unrepaid['Purchase_Consideration'].sum()
+    # ✅ TRUE total due (unfiltered sum of all Minimum_Recovery_Amount)
+    total_due = pd.to_numeric(receivables_df['Minimum_Recovery_Amount'], errors='coerce').fillna(0).sum()
+
+    # ✅ PAR accounts = remaining unrepaid + unallocated + unrepurchased, where receivables at or
+    # past the threshold count as (simulated, display-only) repurchases
+    open_mask = (allocation_date.isna() & repurchase_date.isna() & (days_past_due < threshold)).to_numpy()
+    purchase_consideration = pd.to_numeric(receivables_df['Purchase_Consideration'], errors='coerce').fillna(0)
+
+    bucket_values, total_portfolio = par_buckets(
+        receivables_df['LoanID'].to_numpy()[open_mask],
+        days_past_due.to_numpy()[open_mask],
+        purchase_consideration.to_numpy()[open_mask],
+        edges
+    )
+    return format_summary(bucket_values, total_portfolio, total_due, total_paid)
 
-    # === Compute bucket values
-    bucket_definitions = {
-        "Current": lambda df: df['Max_Days_Past_Due_Per_Loan'] == 0,
-        "PAR1": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 1,
-        "PAR7": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 7,
-        "PAR30": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 30,
-        "PAR60": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 60,
-        "PAR90": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 90,
-        "PAR120": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 120,
-        "PAR150": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 150,
-        "PAR180+": lambda df: df['Max_Days_Past_Due_Per_Loan'] >= 180,
-    }
 
+def format_summary(bucket_values, total_portfolio, total_due, total_paid):
+    """
+    Summary table rows and totals, formatted for summary.html.
+    """
     summary_data = []
-    for bucket, condition in bucket_definitions.items():
-        value = unrepaid.loc[condition(unrepaid), 'Purchase_Consideration'].sum()
+    for bucket, value in bucket_values.items():
         percentage = (value / total_portfolio * 100) if total_portfolio > 0 else 0
         summary_data.append({
             "Bucket": bucket,
@@ -118,3 +117,60 @@ def generate_summary_outputs(
     }
 
     return summary_df, totals
+
+
+def build_loan_snapshot(receivables_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compact per-loan view of Receivables_Allocated: one row per (LoanID, State, Days_Past_Due)
+    with the receivable count and summed Purchase_Consideration / Minimum_Recovery_Amount.
+    State is Allocated, Repurchased or Open, so open receivables keep their DPD breakdown
+    and the summary can be recomputed for any threshold without the full file.
+    """
+    state = np.select(
+        [receivables_df['Allocation_Date'].notna(), receivables_df['Repurchase_Date'].notna()],
+        ["Allocated", "Repurchased"],
+        default="Open"
+    )
+    rows = pd.DataFrame({
+        "LoanID": receivables_df['LoanID'].astype(str).to_numpy(),
+        "State": state,
+        "Days_Past_Due": pd.to_numeric(receivables_df['Days_Past_Due'], errors="coerce").fillna(0).astype(int).to_numpy(),
+        "Purchase_Consideration": pd.to_numeric(receivables_df['Purchase_Consideration'], errors="coerce").fillna(0).to_numpy(),
+        "Minimum_Recovery_Amount": pd.to_numeric(receivables_df['Minimum_Recovery_Amount'], errors="coerce").fillna(0).to_numpy(),
+    })
+    return rows.groupby(["LoanID", "State", "Days_Past_Due"], as_index=False).agg(
+        Receivables=("Purchase_Consideration", "size"),
+        Purchase_Consideration=("Purchase_Consideration", "sum"),
+        Minimum_Recovery_Amount=("Minimum_Recovery_Amount", "sum"),
+    )
+
+
+def summary_from_snapshot(snapshot: pd.DataFrame, total_paid: float, threshold: int = 999, edges=None):
+    """
+    Same output as generate_summary_outputs, computed from a loan snapshot. Open receivables
+    at or past the threshold count as (simulated) repurchased; PAR buckets use each loan's
+    max DPD over its remaining open receivables (see par_buckets).
+    """
+    bucket_values, total_portfolio, total_due = snapshot_buckets(snapshot, threshold, edges)
+    return format_summary(bucket_values, total_portfolio, total_due, total_paid)
+
+
+def snapshot_buckets(snapshot: pd.DataFrame, threshold: int = 999, edges=None):
+    """
+    Unformatted figures behind summary_from_snapshot: ({bucket: value}, total_portfolio, total_due).
+    """
+    unrepaid = snapshot[(snapshot['State'] == "Open") & (snapshot['Days_Past_Due'] < threshold)]
+    total_due = snapshot['Minimum_Recovery_Amount'].sum()
+    bucket_values, total_portfolio = par_buckets(
+        unrepaid['LoanID'], unrepaid['Days_Past_Due'], unrepaid['Purchase_Consideration'], edges
+    )
+    return bucket_values, total_portfolio, total_due
+
+
+def clean_hp_repayments(hp_repayments_df: pd.DataFrame) -> pd.DataFrame:
+    hp_repayments_df['HP_Repayment_Date'] = pd.to_datetime(
+        hp_repayments_df['HP_Repayment_Date'], format="%Y-%m-%d", errors="coerce"
+    )
+    hp_repayments_df["HP_Repayment_Amount"] = pd.to_numeric(
+        hp_repayments_df["HP_Repayment_Amount"], errors="coerce").fillna(0)
+    return hp_repayments_df
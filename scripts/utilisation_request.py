@@ -1,14 +1,19 @@
-from flask import make_response, request, flash, redirect
-from io import BytesIO, StringIO
+from flask import request, flash, redirect
+from io import BytesIO
 from datetime import datetime
-import pandas as pd
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
-from google.cloud import storage
-from scripts.utils import build_investor_path, require_investor
+from scripts.debiflow_gcs import get_bucket
+from scripts.utils import build_investor_path
+from scripts.period_metrics import period_metrics
+from scripts.artifact_cache import serve_artifact
+
+# Bump when the PDF layout or wording changes, so cached copies are rebuilt
+TEMPLATE_VERSION = "1"
+
 
 def generate_utilisation_request(bucket_name, investor):
     report_date = request.args.get("report_date")
@@ -16,15 +21,24 @@ def generate_utilisation_request(bucket_name, investor):
         flash("❌ No report date provided.")
         return redirect("/pending")
 
-    gcs = storage.Client()
-    bucket = gcs.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
+    today = datetime.now().strftime("%d %B %Y")
+
+    # Served from the artifact cache unless the Schedule file was replaced (or the date changed)
+    schedule_path = build_investor_path(investor, "raw", f"Schedule_{report_date}.csv")
+    return serve_artifact(
+        bucket, investor, "utilisation_request", TEMPLATE_VERSION, [schedule_path],
+        lambda: build_utilisation_request(bucket, investor, report_date, today),
+        "application/pdf", f"Utilisation_Request_{report_date}.pdf", extra=[today]
+    )
 
-    # Load Schedule file
-    schedule_blob = bucket.blob(build_investor_path(investor, "raw", f"Schedule_{report_date}.csv"))
-    df = pd.read_csv(StringIO(schedule_blob.download_as_text()), dtype={"LoanID": str})
-    total_purchase = df["Purchase_Consideration"].sum()
 
-    today = datetime.now().strftime("%d %B %Y")
+def build_utilisation_request(bucket, investor, report_date, today):
+    """
+    Utilisation Request PDF bytes for report_date, dated today.
+    """
+    # Schedule total from the period metrics sidecar
+    total_purchase = period_metrics(bucket, investor, report_date, ["schedule"])["purchase_consideration_sum"]
 
     # Create PDF
     buffer = BytesIO()
@@ -94,9 +108,4 @@ def generate_utilisation_request(bucket_name, investor):
             story.append(Paragraph(para, normal))
 
     doc.build(story)
-
-    buffer.seek(0)
-    response = make_response(buffer.read())
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = f"attachment; filename=Utilisation_Request_{report_date}.pdf"
-    return response
+    return buffer.getvalue()
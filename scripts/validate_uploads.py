@@ -1,110 +1,260 @@
+import csv
+import io
+import os
 import pandas as pd
 
-def validate_file(file_name: str, df: pd.DataFrame) -> list:
-    """
-    Validates the uploaded file based on filename and content rules.
-    Returns a list of grouped error strings with limited examples.
-    """
-    errors = []
+# Rows parsed per chunk by validate_stream; memory stays bounded by this, not by file size
+VALIDATION_CHUNK_ROWS = int(os.getenv("VALIDATION_CHUNK_ROWS", "50000"))
+MAX_EXAMPLES = 5
 
-    # If this is a CustomerDetails file, skip validation
-    if file_name.startswith("CustomerDetails"):
-        return errors
+DATE_FORMAT = "%Y-%m-%d"
 
-    # Extract expected date from filename (for Payments only)
-    date_part = file_name.split("_")[-1].replace(".csv", "")
-    if len(date_part) != 8:
-        errors.append("Filename does not end with YYYYMMDD date.")
-        return errors
-    expected_date = f"{date_part[:4]}-{date_part[4:6]}-{date_part[6:]}"
-
-    schemas = {
-        "HP_Repayments": {
-            "columns": ["HP_Repayment_Date","BankStatement_Ref","HP_Repayment_Amount","To"],
-            "date_columns": ["HP_Repayment_Date"],
-            "match_date_column": None
+# Schema for every CSV type the app reads: the upload checks below and the typed loader
+# (scripts/loader.py) both use it. dtypes are "str", "category" (text with few distinct
+# values), "float" or "int"; columns not listed are left to the parser. Types with
+# upload=False are generated by the app, never uploaded.
+SCHEMAS = {
+    "HP_Repayments": {
+        "columns": ["HP_Repayment_Date","BankStatement_Ref","HP_Repayment_Amount","To"],
+        "date_columns": ["HP_Repayment_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {"BankStatement_Ref": "str", "HP_Repayment_Amount": "float", "To": "str"},
+        "match_date_column": None
+    },
+    "Payments": {
+        "columns": ["LoanID","Paid_Date","Amount_Paid"],
+        "date_columns": ["Paid_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {"LoanID": "str", "Amount_Paid": "float"},
+        "match_date_column": "Paid_Date"
+    },
+    "Schedule": {
+        "columns": [
+            "LoanID","Purchase_Date","Due_Date","Advance_Rate",
+            "Receivable_Outstandings","Purchase_Consideration","entity"
+        ],
+        "date_columns": ["Purchase_Date","Due_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {
+            "LoanID": "str", "Advance_Rate": "float", "Receivable_Outstandings": "float",
+            "Purchase_Consideration": "float", "entity": "category"
+        },
+        "match_date_column": None
+    },
+    "Payments_Allocated": {
+        "columns": ["LoanID","Paid_Date","Amount_Paid","Payment_ID","Unallocated_Reason"],
+        "date_columns": ["Paid_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {"LoanID": "str", "Amount_Paid": "float", "Unallocated_Reason": "category"},
+        "upload": False
+    },
+    "Payment_Allocations": {
+        "columns": ["Payment_ID","LoanID","Paid_Date","Receivable_Index","Payment_allocated","Flag"],
+        "date_columns": ["Paid_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {"LoanID": "str", "Receivable_Index": "int", "Payment_allocated": "float", "Flag": "int"},
+        "upload": False
+    },
+    "Receivables_Allocated": {
+        "columns": [
+            "LoanID","Purchase_Date","Due_Date","Advance_Rate","Receivable_Outstandings",
+            "Purchase_Consideration","entity","Receivable_Index","Payment_allocated",
+            "Allocation_Date","Repurchase_Date","Days_Past_Due","Minimum_Recovery_Amount"
+        ],
+        "date_columns": ["Purchase_Date","Due_Date","Allocation_Date","Repurchase_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {
+            "LoanID": "str", "Advance_Rate": "float", "Receivable_Outstandings": "float",
+            "Purchase_Consideration": "float", "entity": "category", "Receivable_Index": "int",
+            "Payment_allocated": "float", "Days_Past_Due": "int", "Minimum_Recovery_Amount": "float"
         },
-        "Payments": {
-            "columns": ["LoanID","Paid_Date","Amount_Paid"],
-            "date_columns": ["Paid_Date"],
-            "match_date_column": "Paid_Date"
+        "upload": False
+    },
+    "Repurchases_Master": {
+        "columns": ["LoanID","Due_Date","Repurchase_Date","Finalized"],
+        "date_columns": ["Due_Date","Repurchase_Date"],
+        "date_format": DATE_FORMAT,
+        "dtypes": {"LoanID": "str"},
+        "upload": False
+    },
+    "Loan_Snapshot": {
+        "columns": ["LoanID","State","Days_Past_Due","Receivables","Purchase_Consideration","Minimum_Recovery_Amount"],
+        "date_columns": [],
+        "date_format": DATE_FORMAT,
+        "dtypes": {
+            "LoanID": "str", "State": "category", "Days_Past_Due": "int", "Receivables": "int",
+            "Purchase_Consideration": "float", "Minimum_Recovery_Amount": "float"
         },
-        "Schedule": {
-            "columns": [
-                "LoanID","Purchase_Date","Due_Date","Advance_Rate",
-                "Receivable_Outstandings","Purchase_Consideration","entity"
-            ],
-            "date_columns": ["Purchase_Date","Due_Date"],
-            "match_date_column": None
-        }
+        "upload": False
     }
+}
 
-    file_type = next((prefix for prefix in schemas if file_name.startswith(prefix)), None)
-    if not file_type:
-        errors.append("Unknown file type.")
-        return errors
 
-    schema = schemas[file_type]
+class FileValidator:
+    """
+    Validation rules for one uploaded file, applied chunk by chunk. Each row rule keeps a
+    running count and its first MAX_EXAMPLES examples, so the result is the same whether
+    the file is checked in one piece or streamed.
+    """
+
+    def __init__(self, file_name: str, max_examples: int = MAX_EXAMPLES):
+        self.file_name = file_name
+        self.max_examples = max_examples
+        self.errors = []
+        self.skip = file_name.startswith("CustomerDetails")
+        self.schema = None
+        self.rules = {}
+        self.rows = 0
+        if self.skip:
+            return
 
-    # Normalize headers
-    df.columns = [c.strip().lstrip("\ufeff") for c in df.columns]
+        # Extract expected date from filename (for Payments only)
+        date_part = file_name.split("_")[-1].replace(".csv", "")
+        if len(date_part) != 8:
+            self.errors.append("Filename does not end with YYYYMMDD date.")
+            return
+        self.expected_date = f"{date_part[:4]}-{date_part[4:6]}-{date_part[6:]}"
 
-    if df.columns.tolist() != schema["columns"]:
-        errors.append(
-            "Column headers do not match expected format.\n"
-            f" Expected: {schema['columns']}\n"
-            f" Actual:   {df.columns.tolist()}"
+        self.file_type = next(
+            (prefix for prefix, schema in SCHEMAS.items() if schema.get("upload", True) and file_name.startswith(prefix)),
+            None
         )
-        return errors
+        if not self.file_type:
+            self.errors.append("Unknown file type.")
+            return
+        self.schema = SCHEMAS[self.file_type]
 
-    if df.empty:
-        errors.append("Warning: file contains no rows.")
-        return errors
+        for col in self.schema["date_columns"]:
+            self.rules[("date", col)] = {"total": 0, "examples": []}
+        if self.schema["match_date_column"]:
+            self.rules[("match", self.schema["match_date_column"])] = {"total": 0, "examples": []}
+        if self.file_type == "Schedule":
+            self.rules[("order", None)] = {"total": 0, "examples": []}
 
-    # Date-format checks
-    for col in schema["date_columns"]:
-        parsed = pd.to_datetime(df[col], errors="coerce", format="%Y-%m-%d")
-        invalid_rows = parsed.isnull()
-        if invalid_rows.any():
-            idxs = invalid_rows[invalid_rows].index
-            total = len(idxs)
-            examples = "\n".join(
-                [f"  Row {i+2}: value = '{df.at[i, col]}'" for i in idxs[:5]]
-            )
-            more = f"...and {total-5} more similar errors." if total > 5 else ""
-            errors.append(
-                f"Invalid date format in {col}: {total} errors found.\nExamples:\n{examples}\n{more}"
-            )
+    @property
+    def done(self):
+        """
+        True when no rows need checking (skipped file or a file-level error).
+        """
+        return self.skip or bool(self.errors)
 
-    # Filename-vs-column-date matching (Payments only)
-    if schema["match_date_column"]:
-        col = schema["match_date_column"]
-        mismatch = df[col].astype(str).str[:10] != expected_date
-        if mismatch.any():
-            idxs = mismatch[mismatch].index
-            total = len(idxs)
-            examples = "\n".join(
-                [f"  Row {i+2}: value = '{df.at[i, col]}'" for i in idxs[:5]]
-            )
-            more = f"...and {total-5} more similar errors." if total > 5 else ""
-            errors.append(
-                f"{col} does not match filename date {expected_date}: {total} rows.\nExamples:\n{examples}\n{more}"
-            )
+    @property
+    def failed(self):
+        return bool(self.errors) or any(rule["total"] for rule in self.rules.values())
 
-    # Schedule-specific: Due_Date >= Purchase_Date
-    if file_type == "Schedule":
-        pds = pd.to_datetime(df["Purchase_Date"], errors="coerce", format="%Y-%m-%d")
-        dds = pd.to_datetime(df["Due_Date"], errors="coerce", format="%Y-%m-%d")
-        invalid = dds < pds
-        if invalid.any():
-            idxs = invalid[invalid].index
-            total = len(idxs)
-            examples = "\n".join(
-                [f"  Row {i+2}: Purchase_Date='{df.at[i, 'Purchase_Date']}', Due_Date='{df.at[i, 'Due_Date']}'" for i in idxs[:5]]
+    def check_header(self, columns):
+        columns = [c.strip().lstrip("\ufeff") for c in columns]
+        if columns != self.schema["columns"]:
+            self.errors.append(
+                "Column headers do not match expected format.\n"
+                f" Expected: {self.schema['columns']}\n"
+                f" Actual:   {columns}"
             )
-            more = f"...and {total-5} more similar errors." if total > 5 else ""
-            errors.append(
-                f"Due_Date earlier than Purchase_Date in {total} rows.\nExamples:\n{examples}\n{more}"
+        return columns
+
+    def _record(self, key, mask, describe):
+        if not mask.any():
+            return
+        rule = self.rules[key]
+        idxs = mask[mask].index
+        rule["total"] += len(idxs)
+        room = self.max_examples - len(rule["examples"])
+        rule["examples"].extend(describe(i) for i in idxs[:max(room, 0)])
+
+    def check_chunk(self, df):
+        self.rows += len(df)
+
+        # Date-format checks (each date column parsed once per chunk)
+        parsed = {}
+        for col in self.schema["date_columns"]:
+            parsed[col] = pd.to_datetime(df[col], errors="coerce", format=self.schema["date_format"])
+            self._record(("date", col), parsed[col].isnull(), lambda i, col=col: f"  Row {i+2}: value = '{df.at[i, col]}'")
+
+        # Filename-vs-column-date matching (Payments only)
+        if self.schema["match_date_column"]:
+            col = self.schema["match_date_column"]
+            mismatch = df[col].astype(str).str[:10] != self.expected_date
+            self._record(("match", col), mismatch, lambda i: f"  Row {i+2}: value = '{df.at[i, col]}'")
+
+        # Schedule-specific: Due_Date >= Purchase_Date
+        if self.file_type == "Schedule":
+            invalid = parsed["Due_Date"] < parsed["Purchase_Date"]
+            self._record(
+                ("order", None), invalid,
+                lambda i: f"  Row {i+2}: Purchase_Date='{df.at[i, 'Purchase_Date']}', Due_Date='{df.at[i, 'Due_Date']}'"
             )
 
-    return errors
+    def result(self, stopped_at_row=None):
+        if self.done:
+            return list(self.errors)
+        if self.rows == 0:
+            return ["Warning: file contains no rows."]
+
+        errors = []
+        for (kind, col), rule in self.rules.items():
+            total = rule["total"]
+            if not total:
+                continue
+            examples = "\n".join(rule["examples"])
+            more = f"...and {total-self.max_examples} more similar errors." if total > self.max_examples else ""
+            if kind == "date":
+                message = f"Invalid date format in {col}: {total} errors found.\nExamples:\n{examples}\n{more}"
+            elif kind == "match":
+                message = f"{col} does not match filename date {self.expected_date}: {total} rows.\nExamples:\n{examples}\n{more}"
+            else:
+                message = f"Due_Date earlier than Purchase_Date in {total} rows.\nExamples:\n{examples}\n{more}"
+            if stopped_at_row is not None:
+                message += f"\n(Validation stopped after row {stopped_at_row + 1}; later rows were not checked.)"
+            errors.append(message)
+        return errors
+
+
+def validate_file(file_name: str, df: pd.DataFrame) -> list:
+    """
+    Validates the uploaded file based on filename and content rules.
+    Returns a list of grouped error strings with limited examples.
+    """
+    validator = FileValidator(file_name)
+    if validator.done:
+        return validator.result()
+
+    # Normalize headers
+    df.columns = validator.check_header(df.columns)
+    if validator.errors or df.empty:
+        return validator.result()
+
+    validator.check_chunk(df)
+    return validator.result()
+
+
+def validate_stream(file_name: str, stream, chunk_rows: int = None, stop_on_error: bool = True) -> list:
+    """
+    validate_file for a binary stream, without loading the file: the header is checked from
+    the first line, then rows are parsed and checked VALIDATION_CHUNK_ROWS at a time. With
+    stop_on_error, checking stops after the first chunk containing a hard error.
+    """
+    validator = FileValidator(file_name)
+    if validator.done:
+        return validator.result()
+
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    try:
+        header = next(csv.reader([text.readline()]), [])
+        columns = validator.check_header(header)
+        if validator.errors:
+            return validator.result()
+
+        chunks = pd.read_csv(
+            text, header=None, names=columns, dtype=str, chunksize=chunk_rows or VALIDATION_CHUNK_ROWS
+        )
+        for chunk in chunks:
+            validator.check_chunk(chunk)
+            if stop_on_error and validator.failed:
+                more_rows = len(chunk) == chunks.chunksize
+                return validator.result(stopped_at_row=validator.rows if more_rows else None)
+        return validator.result()
+    except pd.errors.EmptyDataError:
+        return validator.result()
+    finally:
+        # Leave the caller's stream open (e.g. to upload it afterwards)
+        text.detach()
@@ -0,0 +1,91 @@
+import time
+import zipfile
+from flask import Response, stream_with_context
+from scripts.artifact_cache import artifact_key, cached_artifact, send_artifact, tee_artifact
+from scripts.debiflow_gcs import DebiFlowGCS
+
+# ZIP downloads are streamed: each entry is compressed and sent as its blobs arrive from a
+# bounded prefetcher, so the response starts at once and memory is bounded by the prefetch
+# window instead of the archive. The output stream is not seekable, so zipfile writes each
+# entry's sizes and CRC in a data descriptor after its data. Finished archives go to the
+# artifact cache, keyed by the generations of the blobs they were built from.
+# Bump when the archive layout changes, so cached copies are rebuilt
+ZIP_VERSION = "1"
+
+
+class _ChunkSink:
+    """
+    Write-only file object for ZipFile that keeps what was written until it is drained.
+    It has no tell(), which is what makes zipfile treat the output as a stream.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(bucket, entries, window=None):
+    """
+    Generator of ZIP bytes for entries, a list of (filename, [blob paths]). An entry is its
+    blobs concatenated in order; blobs after the first drop their first (CSV header) line,
+    as for a segmented master. At most window blobs are downloaded ahead (default
+    GCS_MAX_CONCURRENCY).
+    """
+    t0 = time.time()
+    sink = _ChunkSink()
+    blobs = DebiFlowGCS.from_bucket(bucket).iter_many(
+        [path for _, paths in entries for path in paths], window=window
+    )
+    sent = 0
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for filename, paths in entries:
+                # force_zip64: the entry size is not known when its header is written
+                with zipf.open(filename, "w", force_zip64=True) as entry:
+                    for i in range(len(paths)):
+                        # The entry header (and the previous blob's data) goes out before waiting
+                        chunk = sink.drain()
+                        if chunk:
+                            sent += len(chunk)
+                            yield chunk
+                        _, data = next(blobs)
+                        entry.write(data if i == 0 else data.split(b"\n", 1)[1])
+                        del data
+        chunk = sink.drain()
+        sent += len(chunk)
+        yield chunk
+        print(f"[TIMER] Streamed ZIP of {len(entries)} files ({sent:,} bytes) in {time.time() - t0:.2f}s")
+    finally:
+        blobs.close()
+
+
+def zip_response(bucket, investor, kind, entries, download_name, window=None):
+    """
+    Attachment response for stream_zip(bucket, entries). An archive already built from the
+    same blob generations is sent from the artifact cache; otherwise it is streamed and
+    cached as it goes out.
+    """
+    names = [filename for filename, _ in entries]
+    key = artifact_key(bucket, kind, ZIP_VERSION, [path for _, paths in entries for path in paths], extra=names)
+    chunks = None
+    if key is not None:
+        path = cached_artifact(bucket, investor, key, ".zip")
+        if path is not None:
+            return send_artifact(path, "application/zip", download_name)
+        chunks = tee_artifact(stream_zip(bucket, entries, window=window), bucket, investor, key, ".zip")
+    return Response(
+        stream_with_context(chunks or stream_zip(bucket, entries, window=window)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={download_name}"},
+    )
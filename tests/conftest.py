@@ -0,0 +1,133 @@
+import base64
+import io
+import itertools
+import os
+import sys
+import zlib
+
+import pytest
+
+# The scripts package is imported from the repository root, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.api_core import exceptions as gcs_exceptions  # noqa: E402
+
+# Generations are unique across tests, so caches keyed on them never see a stale entry
+_generations = itertools.count(1)
+
+
+class MemoryBlob:
+    """
+    The parts of google.cloud.storage.Blob the app uses, over an in-memory bucket.
+    """
+
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        stored = bucket.objects.get(name)
+        self.metadata = dict(stored["metadata"]) if stored and stored["metadata"] else None
+
+    def _stored(self):
+        stored = self.bucket.objects.get(self.name)
+        if stored is None:
+            raise gcs_exceptions.NotFound(f"404 {self.name}")
+        return stored
+
+    @property
+    def generation(self):
+        stored = self.bucket.objects.get(self.name)
+        return stored["generation"] if stored else None
+
+    @property
+    def crc32c(self):
+        stored = self.bucket.objects.get(self.name)
+        return base64.b64encode(zlib.crc32(stored["data"]).to_bytes(4, "big")).decode() if stored else None
+
+    @property
+    def size(self):
+        stored = self.bucket.objects.get(self.name)
+        return len(stored["data"]) if stored else None
+
+    def exists(self, **kwargs):
+        return self.name in self.bucket.objects
+
+    def reload(self, **kwargs):
+        self.metadata = self._stored()["metadata"]
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        if if_generation_match is not None and (self.generation or 0) != if_generation_match:
+            raise gcs_exceptions.PreconditionFailed(f"412 {self.name}")
+        self.bucket.objects[self.name] = {
+            "data": data.encode("utf-8") if isinstance(data, str) else bytes(data),
+            "generation": next(_generations),
+            "metadata": dict(self.metadata) if self.metadata else None,
+            "content_type": content_type,
+        }
+
+    def upload_from_file(self, fileobj, rewind=False, content_type=None, **kwargs):
+        if rewind:
+            fileobj.seek(0)
+        self.upload_from_string(fileobj.read(), content_type=content_type)
+
+    def download_as_bytes(self, **kwargs):
+        return self._stored()["data"]
+
+    def download_as_text(self, **kwargs):
+        return self.download_as_bytes().decode("utf-8")
+
+    def open(self, mode="rb", **kwargs):
+        return io.BytesIO(self.download_as_bytes())
+
+    def delete(self, **kwargs):
+        self._stored()
+        del self.bucket.objects[self.name]
+
+
+class MemoryBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = {}
+
+    def blob(self, name, chunk_size=None, **kwargs):
+        return MemoryBlob(self, name, chunk_size)
+
+    def get_blob(self, name, **kwargs):
+        return MemoryBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix="", delimiter=None, max_results=None, **kwargs):
+        names = sorted(name for name in self.objects if name.startswith(prefix))
+        blobs = [MemoryBlob(self, name) for name in names if not (delimiter and delimiter in name[len(prefix):])]
+        return blobs[:max_results] if max_results else blobs
+
+    def copy_blob(self, blob, destination_bucket, new_name, **kwargs):
+        copy = MemoryBlob(destination_bucket, new_name)
+        copy.metadata = blob.metadata
+        copy.upload_from_string(blob.download_as_bytes())
+        return copy
+
+
+class MemoryClient:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name, **kwargs):
+        return self.buckets.setdefault(name, MemoryBucket(self, name))
+
+    def list_blobs(self, bucket, prefix="", **kwargs):
+        bucket = self.bucket(bucket) if isinstance(bucket, str) else bucket
+        return bucket.list_blobs(prefix=prefix, **kwargs)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """
+    An empty in-memory bucket, installed as the process-wide storage client so code that
+    opens a bucket by name (DebiFlowGCS, get_bucket) gets it too.
+    """
+    from scripts import debiflow_gcs
+
+    client = MemoryClient()
+    monkeypatch.setattr(debiflow_gcs, "_registry", {"pid": os.getpid(), "client": client, "buckets": {}})
+    return debiflow_gcs.get_bucket("test-bucket")
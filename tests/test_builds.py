@@ -0,0 +1,102 @@
+from scripts import builds
+from scripts.builds import PERIOD_STAGES, plan, plan_period, record_build, stage_io
+from scripts.utils import build_investor_path
+
+DATES = ["20240105", "20240112", "20240119"]
+
+
+def put(bucket, path, text):
+    bucket.blob(path).upload_from_string(text)
+
+
+def confirm(bucket, report_date, previous):
+    """
+    Write a period's raw files, masters and outputs (placeholder contents) and record each
+    stage's build, as a confirm would.
+    """
+    for stage in PERIOD_STAGES:
+        inputs, outputs = stage_io("Acme", stage, report_date, previous)
+        for path in inputs:
+            if "/raw/" in path:
+                put(bucket, path, f"raw {path}")
+        for path in outputs:
+            put(bucket, path, f"built {path}")
+        record_build(bucket, "Acme", stage, report_date, previous)
+
+
+def confirmed(bucket):
+    put(bucket, build_investor_path("Acme", "master", f"Schedule_Master_{DATES[0]}.csv"), "base")
+    put(bucket, build_investor_path("Acme", "master", f"Payments_Master_{DATES[0]}.csv"), "base")
+    confirm(bucket, DATES[1], DATES[0])
+    confirm(bucket, DATES[2], DATES[1])
+
+
+def planned_stages(result):
+    return {report_date: [stage for stage, _ in stages] for report_date, _, stages in result}
+
+
+def test_confirmed_periods_are_up_to_date(bucket):
+    confirmed(bucket)
+    assert planned_stages(plan(bucket, "Acme", DATES[1:])) == {DATES[1]: [], DATES[2]: []}
+
+    # Re-uploading the same content gives a new generation but the same checksum
+    raw = build_investor_path("Acme", "raw", f"Payments_{DATES[1]}.csv")
+    put(bucket, raw, bucket.blob(raw).download_as_text())
+    assert plan_period(bucket, "Acme", DATES[1], DATES[0]) == []
+
+
+def test_changed_raw_file_cascades_into_later_periods(bucket):
+    confirmed(bucket)
+    put(bucket, build_investor_path("Acme", "raw", f"Payments_{DATES[1]}.csv"), "corrected")
+
+    result = plan(bucket, "Acme", DATES[1:])
+    assert [(report_date, previous) for report_date, previous, _ in result] == [(DATES[1], DATES[0]), (DATES[2], DATES[1])]
+    assert planned_stages(result) == {
+        DATES[1]: ["merge:Payments_", "payments", "receivables"],
+        DATES[2]: ["merge:Payments_", "payments", "receivables"],
+    }
+    reasons = dict(result[0][2])
+    assert reasons["merge:Payments_"] == f"input changed: Payments_{DATES[1]}.csv"
+    assert reasons["receivables"] == f"input rebuilt: Payment_Allocations_{DATES[1]}.csv"
+    assert dict(result[1][2])["merge:Payments_"] == f"input rebuilt: Payments_Master_{DATES[1]}.csv"
+
+
+def test_segmented_master_is_fingerprinted_by_its_manifest(bucket):
+    confirmed(bucket)
+    master = build_investor_path("Acme", "master", f"Schedule_Master_{DATES[2]}.csv")
+    put(bucket, master[:-len(".csv")] + ".json", '{"segments": []}')
+
+    assert planned_stages(plan(bucket, "Acme", DATES[2:])) == {
+        DATES[2]: ["merge:Schedule_", "payments", "receivables"]
+    }
+    assert dict(plan_period(bucket, "Acme", DATES[2], DATES[1]))["merge:Schedule_"] == \
+        f"output missing or replaced: Schedule_Master_{DATES[2]}.csv"
+
+
+def test_missing_output_record_version_and_previous(bucket, monkeypatch):
+    confirmed(bucket)
+    bucket.blob(build_investor_path("Acme", "outputs", f"Loan_Snapshot_{DATES[2]}.csv")).delete()
+    assert plan_period(bucket, "Acme", DATES[2], DATES[1]) == [
+        ("receivables", f"output missing or replaced: Loan_Snapshot_{DATES[2]}.csv")
+    ]
+
+    bucket.blob(builds.record_path("Acme", "payments", DATES[1])).delete()
+    assert plan_period(bucket, "Acme", DATES[1], DATES[0]) == [
+        ("payments", "no build record"), ("receivables", f"input rebuilt: Payment_Allocations_{DATES[1]}.csv")
+    ]
+
+    monkeypatch.setitem(builds.BUILD_VERSIONS, "merge", "2")
+    assert [stage for stage, _ in plan_period(bucket, "Acme", DATES[2], DATES[1])] == PERIOD_STAGES
+    monkeypatch.setitem(builds.BUILD_VERSIONS, "merge", "1")
+
+    assert plan_period(bucket, "Acme", DATES[2], DATES[0], stages=["merge:Schedule_", "payments"]) == [
+        ("merge:Schedule_", f"previous period {DATES[1]} → {DATES[0]}"),
+        ("payments", f"input rebuilt: Schedule_Master_{DATES[2]}.csv"),
+    ]
+
+
+def test_force_plans_every_stage(bucket):
+    confirmed(bucket)
+    result = plan(bucket, "Acme", DATES[1:], force=True)
+    assert planned_stages(result) == {DATES[1]: PERIOD_STAGES, DATES[2]: PERIOD_STAGES}
+    assert {reason for _, _, stages in result for _, reason in stages} == {"full recompute requested"}
@@ -0,0 +1,101 @@
+import os
+import re
+from collections import defaultdict
+
+import pytest
+
+from scripts.catalog import REQUIRED_PREFIXES, catalog_path, record_blobs
+from scripts.file_tracker import get_reporting_dates
+from scripts.utils import build_investor_path
+
+DATES = ["20240105", "20240112", "20240119", "20240126"]
+
+
+def listed_reporting_dates(bucket, investor, reference_date=None):
+    """
+    get_reporting_dates as it was before the catalog: from a listing of raw/ and master/.
+    """
+    master_dates = {
+        m.group(1)
+        for blob in bucket.list_blobs(prefix=build_investor_path(investor, "master", ""))
+        for m in [re.search(r"_Master_(\d{8})\.(?:csv|json)$", blob.name)]
+        if m
+    }
+    raw_map = defaultdict(set)
+    for blob in bucket.list_blobs(prefix=build_investor_path(investor, "raw", "")):
+        for prefix in REQUIRED_PREFIXES:
+            m = re.match(rf"{prefix}(\d{{8}})\.csv$", os.path.basename(blob.name))
+            if m:
+                raw_map[m.group(1)].add(prefix)
+    complete_raw = sorted(d for d, prefixes in raw_map.items() if len(prefixes) == len(REQUIRED_PREFIXES))
+
+    if reference_date:
+        complete_raw = [d for d in complete_raw if d <= reference_date]
+        master_dates = {d for d in master_dates if d <= reference_date}
+    latest_raw = complete_raw[-1] if complete_raw else None
+    cutoff = reference_date or latest_raw
+    prior_masters = sorted(d for d in master_dates if d < cutoff)
+    return latest_raw, prior_masters[-1] if prior_masters else None
+
+
+def raw_paths(investor, date, prefixes=REQUIRED_PREFIXES):
+    return [build_investor_path(investor, "raw", f"{prefix}{date}.csv") for prefix in prefixes]
+
+
+def master_paths(investor, date):
+    # A legacy CSV master with its Parquet copy, and a segmented one listed by its manifest
+    return [
+        build_investor_path(investor, "master", f"Schedule_Master_{date}.csv"),
+        build_investor_path(investor, "master", f"Schedule_Master_{date}.parquet"),
+        build_investor_path(investor, "master", f"Payments_Master_{date}.json"),
+        build_investor_path(investor, "master/segments", f"Payments_Segment_{date}_{date}T120000000000.csv"),
+    ]
+
+
+def upload(bucket, paths):
+    for path in paths:
+        bucket.blob(path).upload_from_string("x")
+
+
+def populate(bucket, investor):
+    upload(bucket, raw_paths(investor, DATES[0]) + raw_paths(investor, DATES[1]) + raw_paths(investor, DATES[2]))
+    # The latest raw batch is incomplete, and some raw files are not part of a batch
+    upload(bucket, raw_paths(investor, DATES[3], REQUIRED_PREFIXES[:3]))
+    upload(bucket, [build_investor_path(investor, "raw", f"Repurchase_{DATES[1]}.csv"),
+                    build_investor_path(investor, "raw", f"Payments_{DATES[1]}.xlsx")])
+    upload(bucket, master_paths(investor, DATES[0]) + master_paths(investor, DATES[1]))
+    upload(bucket, [build_investor_path(investor, "outputs", f"Payments_Allocated_{DATES[1]}.csv")])
+
+
+REFERENCE_DATES = [None, DATES[0], "20240110", DATES[1], DATES[2], DATES[3], "20240301"]
+
+
+@pytest.mark.parametrize("reference_date", REFERENCE_DATES)
+def test_catalog_gives_the_listed_reporting_dates(bucket, reference_date):
+    populate(bucket, "Acme")
+    assert bucket.get_blob(catalog_path("Acme")) is None
+
+    # The first call builds the catalog from a listing, the second reads it back
+    expected = listed_reporting_dates(bucket, "Acme", reference_date)
+    assert get_reporting_dates(bucket.name, reference_date, "Acme") == expected
+    assert bucket.get_blob(catalog_path("Acme")) is not None
+    assert get_reporting_dates(bucket.name, reference_date, "Acme") == expected
+
+
+def test_recorded_blobs_keep_the_catalog_current(bucket):
+    populate(bucket, "Acme")
+    get_reporting_dates(bucket.name, None, "Acme")
+
+    # The app records what it writes: completing a raw batch and confirming a period
+    new_paths = raw_paths("Acme", DATES[3], REQUIRED_PREFIXES[3:]) + master_paths("Acme", DATES[2])
+    upload(bucket, new_paths)
+    record_blobs(bucket, "Acme", new_paths)
+    for reference_date in REFERENCE_DATES:
+        assert get_reporting_dates(bucket.name, reference_date, "Acme") == \
+            listed_reporting_dates(bucket, "Acme", reference_date)
+
+    # Files added outside the app only show up after a rebuild
+    upload(bucket, master_paths("Acme", DATES[3]))
+    assert get_reporting_dates(bucket.name, "20240301", "Acme") != listed_reporting_dates(bucket, "Acme", "20240301")
+    assert get_reporting_dates(bucket.name, "20240301", "Acme", rebuild=True) == \
+        listed_reporting_dates(bucket, "Acme", "20240301")
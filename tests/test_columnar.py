@@ -0,0 +1,100 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.columnar import parquet_path, write_table, write_tables
+from scripts.debiflow_gcs import DebiFlowGCS
+from scripts.loader import load_table
+
+TABLES = {
+    "master/HP_Repayments_Master_20240119.csv": pd.DataFrame({
+        "HP_Repayment_Date": ["2024-01-05", "2024-01-06", None],
+        "BankStatement_Ref": ["000123", "0456", "789"],
+        "HP_Repayment_Amount": [10.5, 20.0, np.nan],
+        "To": ["0100", "0200", "0100"],
+    }),
+    "master/Payments_Master_20240119.csv": pd.DataFrame({
+        "LoanID": ["00017", "0042", "00017", None],
+        "Paid_Date": ["2024-01-02", "2024-01-03", None, "2024-01-04"],
+        "Amount_Paid": [100, 25, 0, 3],
+    }),
+    "master/Schedule_Master_20240119.csv": pd.DataFrame({
+        "LoanID": ["007", "007", "010"],
+        "Purchase_Date": ["2023-12-01"] * 3,
+        "Due_Date": ["2024-01-15", "2024-02-15", "2024-01-20"],
+        "Advance_Rate": [0.12, 0.12, 0.1],
+        "Receivable_Outstandings": [100.0, 100.0, 50.25],
+        "Purchase_Consideration": [180.0, 180.0, 45.0],
+        "entity": ["01", "01", "02"],
+    }),
+    "outputs/Payment_Allocations_20240119.csv": pd.DataFrame({
+        "Payment_ID": [0, 1, 1], "LoanID": ["007", "010", "010"], "Paid_Date": ["2024-01-02"] * 3,
+        "Receivable_Index": [1, 1, 2], "Payment_allocated": [10.0, 5.5, 0.0], "Flag": [0, 1, 0],
+    }),
+    "master/CustomerDetails_Master_20240119.csv": pd.DataFrame({
+        "LoanID": ["0001", "0002"], "Customer_Ref": ["0099", "0100"], "Score": [1, 2],
+    }),
+}
+
+
+@pytest.mark.parametrize("name", sorted(TABLES))
+def test_parquet_copy_loads_like_the_csv(bucket, name):
+    path = f"Investors/Acme/{name}"
+    typed = write_table(bucket, path, TABLES[name])
+    assert bucket.get_blob(parquet_path(path)) is not None
+
+    from_parquet = load_table(bucket, path)
+    bucket.blob(parquet_path(path)).delete()
+    from_csv = load_table(bucket, path)
+    pd.testing.assert_frame_equal(from_parquet, from_csv)
+    pd.testing.assert_frame_equal(typed, from_csv)
+
+
+def test_text_references_keep_leading_zeros(bucket):
+    path = "Investors/Acme/master/HP_Repayments_Master_20240119.csv"
+    write_table(bucket, path, TABLES["master/HP_Repayments_Master_20240119.csv"])
+    stored = pd.read_parquet(io.BytesIO(bucket.blob(parquet_path(path)).download_as_bytes()))
+    assert stored["BankStatement_Ref"].tolist() == ["000123", "0456", "789"]
+    assert load_table(bucket, path)["To"].astype(str).tolist() == ["0100", "0200", "0100"]
+
+
+def test_copy_without_schema_typing_is_ignored(bucket):
+    # A copy from the old inference-based writer, tagged with the current CSV generation
+    path = "Investors/Acme/master/HP_Repayments_Master_20240119.csv"
+    write_table(bucket, path, TABLES["master/HP_Repayments_Master_20240119.csv"])
+    stale = pd.DataFrame({"HP_Repayment_Date": [pd.NaT], "BankStatement_Ref": [123], "HP_Repayment_Amount": [1.0], "To": [100]})
+    copy = bucket.blob(parquet_path(path))
+    copy.metadata = {"csv_generation": str(bucket.get_blob(path).generation)}
+    copy.upload_from_string(stale.to_parquet(index=False))
+
+    assert load_table(bucket, path)["BankStatement_Ref"].tolist() == ["000123", "0456", "789"]
+
+
+def test_write_tables_uploads_in_two_batches(bucket, monkeypatch):
+    batches = []
+    put_many = DebiFlowGCS.put_many
+
+    def recording_put_many(self, uploads, max_workers=None):
+        uploads = list(uploads)
+        batches.append(sorted(upload[0] for upload in uploads))
+        return put_many(self, uploads, max_workers)
+    monkeypatch.setattr(DebiFlowGCS, "put_many", recording_put_many)
+
+    names = sorted(TABLES)[:3]
+    state = ("Investors/Batch/outputs/State.csv.gz", b"state", "application/gzip", {"payments_rows": "3"})
+    typed = write_tables(bucket, [(f"Investors/Batch/{name}", TABLES[name]) for name in names], [state])
+
+    # The CSVs and the extra upload go up together, then the Parquet copies
+    assert batches == [
+        sorted([f"Investors/Batch/{name}" for name in names] + [state[0]]),
+        sorted(parquet_path(f"Investors/Batch/{name}") for name in names),
+    ]
+    assert bucket.get_blob(state[0]).metadata == {"payments_rows": "3"}
+    for name, df in zip(names, typed):
+        single = write_table(bucket, f"Investors/Single/{name}", TABLES[name])
+        assert bucket.blob(f"Investors/Batch/{name}").download_as_bytes() == \
+            bucket.blob(f"Investors/Single/{name}").download_as_bytes()
+        pd.testing.assert_frame_equal(df, single)
+        pd.testing.assert_frame_equal(load_table(bucket, f"Investors/Batch/{name}"), single)
@@ -0,0 +1,102 @@
+import json
+
+import pandas as pd
+
+from scripts.loader import apply_schema, load_table
+from scripts.masters import (
+    SEGMENT_FOLDER,
+    append_master,
+    load_manifest,
+    materialize_master,
+    normalise_master_rows,
+)
+from scripts.utils import build_investor_path
+
+DATES = ["20240105", "20240112", "20240119"]
+
+
+def raw_payments(date, rows):
+    # A raw upload as confirm_period reads it: every column as text
+    day = f"{date[:4]}-{date[4:6]}-{date[6:]}"
+    df = pd.DataFrame({
+        "LoanID": [f"{i % 7:04d}" for i in range(rows)],
+        "Paid_Date": [day] * rows,
+        "Amount_Paid": [f"{i * 1.25:.2f}" for i in range(rows)],
+    })
+    return df.astype(str)
+
+
+def master_path(investor, date):
+    return build_investor_path(investor, "master", f"Payments_Master_{date}.csv")
+
+
+def confirm(bucket, investor, date, previous, raw):
+    return append_master(
+        bucket, investor, "Payments_", date, previous, normalise_master_rows(raw.copy(), "Payments_"), assemble=True
+    )
+
+
+def old_merge(bucket, investor, date, raws):
+    """
+    The full master the old merge wrote for date: every raw file so far, normalised, as one CSV.
+    """
+    df = pd.concat([normalise_master_rows(raw.copy(), "Payments_") for raw in raws], ignore_index=True)
+    bucket.blob(master_path(investor, date)).upload_from_string(df.to_csv(index=False))
+
+
+def listed_segments(bucket, investor):
+    paths = set()
+    for blob in bucket.list_blobs(prefix=build_investor_path(investor, "master", "Payments_Master_")):
+        if blob.name.endswith(".json"):
+            paths |= {seg["path"] for seg in json.loads(blob.download_as_text())["segments"]}
+    return paths
+
+
+def stored_segments(bucket, investor):
+    prefix = build_investor_path(investor, SEGMENT_FOLDER, "")
+    # Parquet copies count as their CSV, so an orphaned copy shows up too
+    return {blob.name.replace(".parquet", ".csv") for blob in bucket.list_blobs(prefix=prefix)}
+
+
+def test_segmented_master_reads_like_the_full_csv(bucket):
+    raws = [raw_payments(date, 5 + i) for i, date in enumerate(DATES)]
+    bucket.blob(master_path("Acme", DATES[0])).upload_from_string(
+        normalise_master_rows(raws[0].copy(), "Payments_").to_csv(index=False)
+    )
+    for i, date in enumerate(DATES[1:], start=1):
+        manifest, df_master = confirm(bucket, "Acme", date, DATES[i - 1], raws[i])
+        old_merge(bucket, "Legacy", date, raws[:i + 1])
+
+        # One new segment per confirm after the base is laid
+        assert len(manifest["segments"]) == i + 1
+        assert manifest["rows"] == sum(len(raw) for raw in raws[:i + 1])
+        assert materialize_master(bucket, master_path("Acme", date)) == \
+            bucket.blob(master_path("Legacy", date)).download_as_bytes()
+        expected = load_table(bucket, master_path("Legacy", date))
+        pd.testing.assert_frame_equal(load_table(bucket, master_path("Acme", date)), expected)
+        pd.testing.assert_frame_equal(apply_schema(df_master, "Payments"), expected)
+
+
+def test_reconfirm_deletes_only_replaced_segments(bucket):
+    raws = [raw_payments(date, 4) for date in DATES]
+    bucket.blob(master_path("Acme", DATES[0])).upload_from_string(
+        normalise_master_rows(raws[0].copy(), "Payments_").to_csv(index=False)
+    )
+    confirm(bucket, "Acme", DATES[1], DATES[0], raws[1])
+    confirm(bucket, "Acme", DATES[2], DATES[1], raws[2])
+    before = load_manifest(bucket, master_path("Acme", DATES[1]))
+
+    # Re-confirming the middle period replaces its own segment; the later period still lists the old one
+    corrected = raw_payments(DATES[1], 6)
+    confirm(bucket, "Acme", DATES[1], DATES[0], corrected)
+    assert stored_segments(bucket, "Acme") == listed_segments(bucket, "Acme")
+    assert {seg["path"] for seg in before["segments"]} <= stored_segments(bucket, "Acme")
+    old_merge(bucket, "Legacy", DATES[1], [raws[0], corrected])
+    pd.testing.assert_frame_equal(
+        load_table(bucket, master_path("Acme", DATES[1])), load_table(bucket, master_path("Legacy", DATES[1]))
+    )
+
+    # Once the later period is re-confirmed too, the first version of the middle period's segments goes
+    confirm(bucket, "Acme", DATES[2], DATES[1], raws[2])
+    assert stored_segments(bucket, "Acme") == listed_segments(bucket, "Acme")
+    assert not {seg["path"] for seg in before["segments"]} & stored_segments(bucket, "Acme")
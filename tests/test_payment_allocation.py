@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.output_generators import (
+    allocate_payments_reference,
+    allocate_payments_vectorized,
+    allocate_payments_sharded,
+    allocate_payments_incremental,
+    _with_last_paid,
+)
+
+# Regression tests for the allocation fast paths: each must reproduce the original
+# row-by-row loop (allocate_payments_reference) exactly.
+
+
+def make_masters(seed, n_loans=40, n_schedule=240, n_payments=320):
+    """
+    Random Schedule / Payments masters in master row order. Payments include loans without
+    a schedule, missing LoanIDs and dates, zero and missing amounts, duplicates and amounts
+    on a .5 cent boundary; some loans only have zero receivables.
+    """
+    rng = np.random.default_rng(seed)
+    loans = [f"L{i:03d}" for i in range(n_loans)]
+    schedule = pd.DataFrame({
+        "LoanID": rng.choice(loans, n_schedule),
+        "Due_Date": [f"2024-{m:02d}-01" for m in rng.integers(1, 13, n_schedule)],
+        "Receivable_Outstandings": rng.integers(1, 50000, n_schedule) / 100,
+    })
+    schedule.loc[schedule["LoanID"].isin(loans[:3]), "Receivable_Outstandings"] = 0.0
+    schedule.loc[rng.random(n_schedule) < 0.05, "Receivable_Outstandings"] = np.nan
+
+    payments = pd.DataFrame({
+        "LoanID": rng.choice(loans + ["UNKNOWN"], n_payments).astype(object),
+        "Paid_Date": [f"2024-{m:02d}-{d:02d}" for m, d in zip(rng.integers(1, 13, n_payments), rng.integers(1, 29, n_payments))],
+        "Amount_Paid": rng.integers(0, 80000, n_payments) / 100,
+    })
+    payments.loc[rng.random(n_payments) < 0.05, "Amount_Paid"] = 0.0
+    payments.loc[rng.random(n_payments) < 0.05, "Amount_Paid"] = np.nan
+    payments.loc[rng.random(n_payments) < 0.05, "Amount_Paid"] += 0.005
+    payments.loc[rng.random(n_payments) < 0.03, "LoanID"] = np.nan
+    payments.loc[rng.random(n_payments) < 0.03, "Paid_Date"] = np.nan
+    payments = pd.concat([payments, payments.sample(20, random_state=seed)], ignore_index=True)
+    return payments, schedule
+
+
+def prepare(payments, schedule):
+    # As generate_payments_allocated does after loading the masters
+    payments = payments.copy()
+    payments["Payment_ID"] = payments.index
+    return payments.sort_values(by=["LoanID", "Paid_Date"]), schedule.sort_values(by=["LoanID", "Due_Date"])
+
+
+def assert_matches_reference(payments, schedule, result):
+    expected_final, expected_long = allocate_payments_reference(payments, schedule)
+    pd.testing.assert_frame_equal(result[0], expected_final)
+    pd.testing.assert_frame_equal(result[1], expected_long)
+
+
+def assert_same_outputs(result, expected):
+    for frame, expected_frame in zip(result, expected):
+        pd.testing.assert_frame_equal(frame.reset_index(drop=True), expected_frame.reset_index(drop=True))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_vectorized_matches_reference(seed):
+    payments, schedule = prepare(*make_masters(seed))
+    assert_matches_reference(payments, schedule, allocate_payments_vectorized(payments, schedule))
+
+
+def test_sharded_matches_reference():
+    payments, schedule = prepare(*make_masters(3))
+    result = allocate_payments_sharded(payments, schedule, workers=2)
+    assert_matches_reference(payments, schedule, result)
+    assert_same_outputs(result, allocate_payments_vectorized(payments, schedule))
+
+
+def test_empty_schedule():
+    payments, _ = make_masters(4)
+    payments, schedule = prepare(payments, pd.DataFrame(columns=["LoanID", "Due_Date", "Receivable_Outstandings"]))
+    result = allocate_payments_vectorized(payments, schedule)
+    assert_matches_reference(payments, schedule, result)
+    assert result[1].empty and result[2].empty
+
+
+def test_no_matching_loans():
+    payments, schedule = make_masters(5)
+    payments["LoanID"] = "UNKNOWN"
+    payments, schedule = prepare(payments, schedule)
+    result = allocate_payments_vectorized(payments, schedule)
+    assert_matches_reference(payments, schedule, result)
+    assert result[1].empty
+
+
+def incremental_run(payments, schedule, payments_done, schedule_done):
+    """
+    Allocate the first payments_done / schedule_done master rows in full, then the rest
+    incrementally, as two consecutive periods would.
+    """
+    prior_payments, prior_schedule = prepare(payments.iloc[:payments_done], schedule.iloc[:schedule_done])
+    prior_output, prior_long, prior_state = allocate_payments_vectorized(prior_payments, prior_schedule)
+    prior_state = _with_last_paid(prior_state, prior_payments)
+
+    payments, schedule = prepare(payments, schedule)
+    return allocate_payments_incremental(
+        payments, schedule, prior_output, prior_long, prior_state, payments_done, schedule_done
+    )
+
+
+def full_run(payments, schedule):
+    payments, schedule = prepare(payments, schedule)
+    df_final, df_long, df_state = allocate_payments_vectorized(payments, schedule)
+    return df_final, df_long, _with_last_paid(df_state, payments)
+
+
+@pytest.mark.parametrize("seed", [6, 7])
+def test_incremental_matches_full_run(seed):
+    # The appended rows hit loans with history (new receivables, out-of-order payments) and new loans
+    payments, schedule = make_masters(seed)
+    payments_done, schedule_done = len(payments) - 60, len(schedule) - 30
+    assert_same_outputs(incremental_run(payments, schedule, payments_done, schedule_done), full_run(payments, schedule))
+
+
+def test_incremental_continues_from_prior_state():
+    # Later payments on existing loans and schedule rows only for new loans: nothing is re-run
+    payments, schedule = make_masters(9)
+    later = payments.dropna(subset=["LoanID"]).sample(40, random_state=9).assign(Paid_Date="2025-01-15")
+    new_loans = pd.DataFrame({
+        "LoanID": ["N1", "N1", "N2"], "Due_Date": ["2025-01-01", "2025-02-01", "2025-01-01"],
+        "Receivable_Outstandings": [120.0, 80.0, 50.0],
+    })
+    new_payments = pd.DataFrame({"LoanID": ["N1", "N2", "N1"], "Paid_Date": ["2025-01-03", "2025-01-04", "2025-02-03"],
+                                 "Amount_Paid": [150.0, 50.0, 60.0]})
+    payments_done, schedule_done = len(payments), len(schedule)
+    payments = pd.concat([payments, later, new_payments], ignore_index=True)
+    schedule = pd.concat([schedule, new_loans], ignore_index=True)
+    assert_same_outputs(incremental_run(payments, schedule, payments_done, schedule_done), full_run(payments, schedule))
+
+
+def test_incremental_without_new_rows():
+    payments, schedule = make_masters(8)
+    assert_same_outputs(incremental_run(payments, schedule, len(payments), len(schedule)), full_run(payments, schedule))
+
+
+def test_incremental_with_all_frames_empty():
+    # No payment ever matches a receivable, so the prior and new allocation rows are all empty
+    schedule = pd.DataFrame({
+        "LoanID": ["A", "A"], "Due_Date": ["2024-01-01", "2024-02-01"], "Receivable_Outstandings": [10.0, 10.0],
+    })
+    payments = pd.DataFrame({
+        "LoanID": ["X", "Y"], "Paid_Date": ["2024-01-02", "2024-01-09"], "Amount_Paid": [5.0, 3.0],
+    })
+    result = incremental_run(payments, schedule, 1, len(schedule))
+    assert_same_outputs(result, full_run(payments, schedule))
+    assert result[1].empty
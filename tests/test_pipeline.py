@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+from scripts.masters import append_master, normalise_master_rows
+from scripts.output_generators import generate_payments_allocated
+from scripts.pipeline import Pipeline
+from scripts.receivables_allocated import generate_receivables_allocated
+from scripts.utils import build_investor_path
+
+REPORT_DATE, PREVIOUS, PRIOR_DATE = "20240119", "20240112", "20240105"
+
+# Whole amounts and numeric-looking IDs are where inferred and schema types part ways
+SCHEDULE = pd.DataFrame({
+    "LoanID": ["0007", "0007", "0010", "0012"],
+    "Purchase_Date": ["2023-12-01"] * 4,
+    "Due_Date": ["2024-01-05", "2024-02-05", "2024-01-10", "2024-01-15"],
+    "Advance_Rate": ["0.12", "0.12", "0.1", "0.1"],
+    "Receivable_Outstandings": ["100", "100", "50", "80"],
+    "Purchase_Consideration": ["180", "180", "45", "70"],
+    "entity": ["01", "01", "02", "02"],
+})
+PAYMENTS = pd.DataFrame({
+    "LoanID": ["0007", "0010", "0007", "0099", "0012"],
+    "Paid_Date": ["2024-01-04", "2024-01-09", "2024-01-18", "2024-01-02", "2024-01-16"],
+    "Amount_Paid": ["100", "30", "60", "10", "80"],
+})
+
+
+def outputs(bucket, investor):
+    return {
+        name: bucket.blob(build_investor_path(investor, "outputs", f"{name}_{REPORT_DATE}.csv")).download_as_bytes()
+        for name in ("Payments_Allocated", "Payment_Allocations", "Receivables_Allocated", "Loan_Snapshot")
+    }
+
+
+def confirm_masters(bucket, investor, pipeline=None):
+    # As confirm_period merges the raw files: a legacy previous master plus this period's rows
+    for prefix, raw in (("Schedule_", SCHEDULE), ("Payments_", PAYMENTS)):
+        previous = normalise_master_rows(raw.iloc[:2].copy(), prefix)
+        bucket.blob(build_investor_path(investor, "master", f"{prefix}Master_{PREVIOUS}.csv")).upload_from_string(
+            previous.to_csv(index=False)
+        )
+        _, df_master = append_master(
+            bucket, investor, prefix, REPORT_DATE, PREVIOUS, normalise_master_rows(raw.iloc[2:].copy(), prefix),
+            assemble=pipeline is not None,
+        )
+        if pipeline is not None:
+            pipeline.put(build_investor_path(investor, "master", f"{prefix}Master_{REPORT_DATE}.csv"), df_master)
+
+
+@pytest.mark.parametrize("parquet_copies", [True, False])
+def test_handed_off_frames_give_the_reloaded_outputs(bucket, monkeypatch, parquet_copies):
+    if not parquet_copies:
+        # Without typed copies, append_master re-reads the masters it hands off from their CSVs
+        def fail(*args, **kwargs):
+            raise OSError("parquet unavailable")
+        monkeypatch.setattr(pd.DataFrame, "to_parquet", fail)
+
+    pipeline = Pipeline()
+    confirm_masters(bucket, "Reload")
+    confirm_masters(bucket, "Handoff", pipeline)
+
+    generate_payments_allocated(REPORT_DATE, bucket.name, "Reload")
+    generate_receivables_allocated(REPORT_DATE, bucket.name, PRIOR_DATE, "Reload")
+    generate_payments_allocated(REPORT_DATE, bucket.name, "Handoff", pipeline=pipeline)
+    generate_receivables_allocated(REPORT_DATE, bucket.name, PRIOR_DATE, "Handoff", pipeline=pipeline)
+    assert pipeline.flush() == []
+
+    assert outputs(bucket, "Handoff") == outputs(bucket, "Reload")
+
+
+def test_failed_batch_reports_each_path():
+    pipeline = Pipeline()
+
+    def fail():
+        raise OSError("upload failed")
+    pipeline.write_behind(["a.csv", "b.csv"], fail)
+    pipeline.write_behind(["c.csv"], lambda: None)
+    assert [path for path, _ in pipeline.flush()] == ["a.csv", "b.csv"]
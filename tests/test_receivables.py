@@ -0,0 +1,230 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.loader import loan_ids_as_text
+from scripts.output_generators import allocate_payments_vectorized
+from scripts.receivables_allocated import (
+    calculate_receivables,
+    calculate_receivables_sharded,
+    generate_receivables_allocated,
+)
+from scripts.utils import build_investor_path
+
+REPORT_DATE, PRIOR_DATE = "20240930", "20240923"
+REPORT_DATE_DT = datetime(2024, 9, 30)
+
+
+def calculate_receivables_by_merge(df_calc, payment_long, df_prev, df_overrides, report_date_dt):
+    """
+    The original calculation: left merges on (LoanID, Receivable_Index) and (LoanID, Due_Date).
+    """
+    df_calc = df_calc.merge(payment_long, on=["LoanID", "Receivable_Index"], how="left")
+    df_calc["Payment_allocated"] = df_calc["Payment_allocated"].fillna(0).round(2)
+
+    if df_prev is not None:
+        df_calc = df_calc.merge(df_prev[["LoanID", "Due_Date", "Repurchase_Date"]], on=["LoanID", "Due_Date"], how="left")
+    else:
+        df_calc["Repurchase_Date"] = pd.NaT
+
+    if df_overrides is not None:
+        df_calc = df_calc.merge(
+            df_overrides[["LoanID", "Due_Date", "Repurchase_Date"]],
+            on=["LoanID", "Due_Date"],
+            how="left",
+            suffixes=("", "_override")
+        )
+        df_calc["Repurchase_Date"] = df_calc["Repurchase_Date"].combine_first(df_calc["Repurchase_Date_override"])
+        df_calc.drop(columns=["Repurchase_Date_override"], inplace=True)
+
+    due_mask = (
+        (df_calc['Payment_allocated'] == 0) &
+        (df_calc['Repurchase_Date'].isna()) &
+        (df_calc['Due_Date'] < report_date_dt)
+    )
+    df_calc['Days_Past_Due'] = np.where(due_mask, (report_date_dt - df_calc['Due_Date']).dt.days, 0)
+
+    cutoff = df_calc['Repurchase_Date'].combine_first(df_calc['Allocation_Date'])
+    cutoff = pd.to_datetime(cutoff, errors="coerce")
+    cutoff[~((cutoff > "1900-01-01") & (cutoff < "2100-01-01"))] = pd.NaT
+    days_elapsed = (cutoff - df_calc['Purchase_Date']).dt.days.fillna(0)
+    has_cutoff = df_calc['Allocation_Date'].notna() | df_calc['Repurchase_Date'].notna()
+    df_calc['Minimum_Recovery_Amount'] = np.where(
+        has_cutoff,
+        (df_calc['Purchase_Consideration'] * (1 + df_calc['Advance_Rate'] * days_elapsed / 365)).round(2),
+        np.nan
+    )
+    return df_calc
+
+
+def random_dates(rng, n, missing=0.0):
+    dates = pd.Series(pd.to_datetime("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D"))
+    dates[rng.random(n) < missing] = pd.NaT
+    return dates
+
+
+def make_inputs(seed, n_loans=60, n_schedule=400):
+    """
+    Frames as generate_receivables_allocated hands them to calculate_receivables: the schedule
+    with Receivable_Index and RowID, flagged allocations unique on (LoanID, Receivable_Index)
+    and finalised repurchases unique on (LoanID, Due_Date). Some Due_Dates are missing, and
+    repurchases key on missing Due_Dates too, since the merges match NaT to NaT.
+    """
+    rng = np.random.default_rng(seed)
+    loans = np.array([f"L{i:03d}" for i in range(n_loans)])
+    df_calc = pd.DataFrame({
+        "LoanID": rng.choice(loans, n_schedule),
+        "Due_Date": random_dates(rng, n_schedule, missing=0.03),
+        "Purchase_Date": pd.to_datetime("2023-12-01"),
+        "Purchase_Consideration": rng.integers(1000, 100000, n_schedule) / 100,
+        "Advance_Rate": rng.choice([0.1, 0.12, 0.15], n_schedule),
+    })
+    df_calc["Receivable_Index"] = df_calc.groupby("LoanID").cumcount() + 1
+    df_calc["RowID"] = df_calc.index
+
+    allocated = df_calc.sample(frac=0.5, random_state=seed)
+    payment_long = pd.DataFrame({
+        "LoanID": allocated["LoanID"].to_numpy(),
+        "Receivable_Index": allocated["Receivable_Index"].to_numpy(),
+        "Payment_allocated": rng.integers(0, 50000, len(allocated)) / 1000,
+        "Allocation_Date": random_dates(rng, len(allocated)),
+    })
+    # Allocations on loans or receivables the schedule does not have
+    payment_long = pd.concat([payment_long, pd.DataFrame({
+        "LoanID": ["UNKNOWN", loans[0]], "Receivable_Index": [1, 999],
+        "Payment_allocated": [5.0, 7.0], "Allocation_Date": pd.to_datetime(["2024-02-01", "2024-03-01"]),
+    })], ignore_index=True)
+
+    def repurchases(frac, state):
+        rows = pd.concat([df_calc[df_calc["Due_Date"].isna()], df_calc.sample(frac=frac, random_state=state)])
+        df = pd.DataFrame({
+            "LoanID": rows["LoanID"].to_numpy(),
+            "Due_Date": rows["Due_Date"].to_numpy(),
+            "Repurchase_Date": random_dates(rng, len(rows), missing=0.2),
+        })
+        df.loc[0, "Repurchase_Date"] = pd.Timestamp("1850-01-01")
+        return df.drop_duplicates(subset=["LoanID", "Due_Date"]).reset_index(drop=True)
+
+    return df_calc, payment_long, repurchases(0.1, seed + 1), repurchases(0.15, seed + 2)
+
+
+def assert_matches_merge(result, inputs):
+    expected = calculate_receivables_by_merge(*(df.copy() if df is not None else None for df in inputs), REPORT_DATE_DT)
+    result = result.sort_values("RowID").reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected.sort_values("RowID").reset_index(drop=True))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("repurchases", ["both", "previous", "overrides", "none"])
+def test_keyed_join_matches_merge(seed, repurchases):
+    df_calc, payment_long, df_prev, df_overrides = make_inputs(seed)
+    df_prev = df_prev if repurchases in ("both", "previous") else None
+    df_overrides = df_overrides if repurchases in ("both", "overrides") else None
+    inputs = (df_calc, payment_long, df_prev, df_overrides)
+    result = calculate_receivables(*(df.copy() if df is not None else None for df in inputs), REPORT_DATE_DT)
+    assert_matches_merge(result, inputs)
+
+
+def test_keyed_join_matches_merge_on_encoded_loan_ids():
+    # The typed loader hands LoanIDs over as categoricals with per-frame categories
+    inputs = make_inputs(2)
+    result = calculate_receivables(
+        *(df.assign(LoanID=loan_ids_as_text(df["LoanID"].astype("category"))) for df in inputs), REPORT_DATE_DT
+    )
+    assert_matches_merge(result.assign(LoanID=result["LoanID"].astype(str)), inputs)
+
+
+def test_keyed_join_without_allocations():
+    df_calc, payment_long, df_prev, df_overrides = make_inputs(3)
+    inputs = (df_calc, payment_long.iloc[:0], df_prev, df_overrides)
+    result = calculate_receivables(*(df.copy() for df in inputs), REPORT_DATE_DT)
+    assert_matches_merge(result, inputs)
+
+
+def upload_csv(bucket, investor, folder, name, df):
+    bucket.blob(build_investor_path(investor, folder, name)).upload_from_string(df.to_csv(index=False))
+
+
+def allocated_period(seed, n_loans=30):
+    """
+    A Schedule_Master with at most three receivables per loan (so the old wide output holds
+    every allocation) and the Payments_Allocated / Payment_Allocations allocated from it.
+    """
+    rng = np.random.default_rng(seed)
+    loans = [f"L{i:03d}" for i in range(n_loans)]
+    counts = rng.integers(1, 4, n_loans)
+    n = counts.sum()
+    schedule = pd.DataFrame({
+        "LoanID": np.repeat(loans, counts),
+        "Purchase_Date": "2024-01-01",
+        "Due_Date": [f"2024-{m:02d}-15" for m in rng.integers(1, 12, n)],
+        "Advance_Rate": 0.12,
+        "Receivable_Outstandings": rng.integers(100, 20000, n) / 100,
+        "Purchase_Consideration": rng.integers(1000, 50000, n) / 100,
+        "entity": rng.choice(["A", "B"], n),
+    })
+    payments = pd.DataFrame({
+        "LoanID": rng.choice(loans, 80),
+        "Paid_Date": [f"2024-{m:02d}-20" for m in rng.integers(1, 10, 80)],
+        "Amount_Paid": rng.integers(100, 30000, 80) / 100,
+    })
+    payments["Payment_ID"] = payments.index
+    payments = payments.sort_values(by=["LoanID", "Paid_Date"])
+    df_final, df_long, _ = allocate_payments_vectorized(payments, schedule.sort_values(by=["LoanID", "Due_Date"]))
+    return schedule, df_final, df_long
+
+
+def wide_allocations(df_final, df_long):
+    # Payments_Allocated as it was written before Payment_Allocations: three receivables per payment
+    wide = df_final.copy()
+    for i in range(1, 4):
+        rows = df_long[df_long["Receivable_Index"] == i].set_index("Payment_ID")
+        wide[f"Payment_Allocation_pmt{i}"] = wide["Payment_ID"].map(rows["Payment_allocated"]).fillna(0.0)
+        wide[f"Payment_Allocation_flag{i}"] = wide["Payment_ID"].map(rows["Flag"]).fillna(0).astype(int)
+    return wide
+
+
+def output_bytes(bucket, investor, name):
+    return bucket.blob(build_investor_path(investor, "outputs", f"{name}_{REPORT_DATE}.csv")).download_as_bytes()
+
+
+def test_period_without_payment_allocations_uses_wide_output(bucket):
+    schedule, df_final, df_long = allocated_period(0)
+    upload_csv(bucket, "Current", "master", f"Schedule_Master_{REPORT_DATE}.csv", schedule)
+    upload_csv(bucket, "Current", "outputs", f"Payment_Allocations_{REPORT_DATE}.csv", df_long)
+    upload_csv(bucket, "Legacy", "master", f"Schedule_Master_{REPORT_DATE}.csv", schedule)
+    upload_csv(bucket, "Legacy", "outputs", f"Payments_Allocated_{REPORT_DATE}.csv", wide_allocations(df_final, df_long))
+
+    for investor in ("Current", "Legacy"):
+        generate_receivables_allocated(REPORT_DATE, bucket.name, PRIOR_DATE, investor)
+    for name in ("Receivables_Allocated", "Loan_Snapshot"):
+        assert output_bytes(bucket, "Legacy", name) == output_bytes(bucket, "Current", name)
+
+
+def test_period_without_any_allocations_asks_for_regeneration(bucket):
+    schedule, df_final, _ = allocated_period(1)
+    upload_csv(bucket, "Acme", "master", f"Schedule_Master_{REPORT_DATE}.csv", schedule)
+    upload_csv(bucket, "Acme", "outputs", f"Payments_Allocated_{REPORT_DATE}.csv", df_final)
+
+    with pytest.raises(FileNotFoundError, match="regenerate the allocations for this period"):
+        generate_receivables_allocated(REPORT_DATE, bucket.name, PRIOR_DATE, "Acme")
+
+
+def test_sharded_matches_single_process():
+    inputs = make_inputs(4)
+    expected = calculate_receivables(*(df.copy() for df in inputs), REPORT_DATE_DT)
+    result = calculate_receivables_sharded(*(df.copy() for df in inputs), REPORT_DATE_DT, workers=2)
+    pd.testing.assert_frame_equal(result.sort_values("RowID").reset_index(drop=True), expected)
+
+
+def test_sharded_generation_writes_the_same_outputs(bucket):
+    schedule, _, df_long = allocated_period(2)
+    for investor in ("Single", "Sharded"):
+        upload_csv(bucket, investor, "master", f"Schedule_Master_{REPORT_DATE}.csv", schedule)
+        upload_csv(bucket, investor, "outputs", f"Payment_Allocations_{REPORT_DATE}.csv", df_long)
+    generate_receivables_allocated(REPORT_DATE, bucket.name, PRIOR_DATE, "Single", workers=1)
+    generate_receivables_allocated(REPORT_DATE, bucket.name, PRIOR_DATE, "Sharded", workers=2)
+    for name in ("Receivables_Allocated", "Loan_Snapshot"):
+        assert output_bytes(bucket, "Sharded", name) == output_bytes(bucket, "Single", name)
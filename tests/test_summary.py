@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.summary_generator import build_loan_snapshot, generate_summary_outputs, par_buckets, summary_from_snapshot
+
+REPORT_DATE = "20240930"
+
+
+def receivables(seed, n_loans=80, n=600):
+    """
+    Receivables_Allocated as the summary reads it: allocated, repurchased and open
+    receivables, with Days_Past_Due only on the open ones past their due date.
+    """
+    rng = np.random.default_rng(seed)
+    state = rng.choice(["Allocated", "Repurchased", "Open"], n, p=[0.4, 0.1, 0.5])
+    due = pd.Series(pd.to_datetime("2024-03-01") + pd.to_timedelta(rng.integers(0, 260, n), unit="D"))
+    dpd = np.where(state == "Open", (pd.Timestamp("2024-09-30") - due).dt.days.clip(lower=0), 0)
+    return pd.DataFrame({
+        "LoanID": rng.choice([f"L{i:03d}" for i in range(n_loans)], n),
+        "Due_Date": due.dt.strftime("%Y-%m-%d"),
+        "Allocation_Date": np.where(state == "Allocated", "2024-09-01", None),
+        "Repurchase_Date": np.where(state == "Repurchased", "2024-08-15", None),
+        "Days_Past_Due": dpd,
+        "Purchase_Consideration": rng.integers(1000, 100000, n) / 100,
+        "Minimum_Recovery_Amount": rng.integers(0, 120000, n) / 100,
+    })
+
+
+def masked_buckets(unrepaid, edges):
+    """
+    PAR buckets as the summary built them before par_buckets: each loan's max DPD on every
+    open receivable, then one mask per bucket. Current was max DPD == 0, i.e. below the
+    first of the fixed edges.
+    """
+    max_dpd = unrepaid.groupby("LoanID")["Days_Past_Due"].transform("max")
+    definitions = {"Current": max_dpd < edges[0]}
+    definitions.update({f"PAR{edge}": max_dpd >= edge for edge in edges[:-1]})
+    definitions[f"PAR{edges[-1]}+"] = max_dpd >= edges[-1]
+    values = {bucket: unrepaid.loc[mask, "Purchase_Consideration"].sum() for bucket, mask in definitions.items()}
+    return values, unrepaid["Purchase_Consideration"].sum()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("edges", [[1, 7, 30, 60, 90, 120, 150, 180], [1, 30, 90], [5, 45]])
+def test_par_buckets_match_masked_buckets(seed, edges):
+    df = receivables(seed)
+    unrepaid = df[df["Allocation_Date"].isna() & df["Repurchase_Date"].isna()]
+    # Loans whose max DPD sits just past, on and just below an edge
+    unrepaid = pd.concat([unrepaid, pd.DataFrame({
+        "LoanID": ["E1", "E1", "E2", "E3"],
+        "Days_Past_Due": [0, 3, 30, 44],
+        "Purchase_Consideration": [10.0, 20.0, 30.0, 40.0],
+    })], ignore_index=True)
+    expected, expected_total = masked_buckets(unrepaid, edges)
+    values, total = par_buckets(
+        unrepaid["LoanID"], unrepaid["Days_Past_Due"], unrepaid["Purchase_Consideration"], edges
+    )
+    assert list(values) == list(expected)
+    np.testing.assert_allclose(list(values.values()), list(expected.values()))
+    assert total == pytest.approx(expected_total)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("threshold", [999, 90, 30, 1])
+def test_snapshot_summary_matches_full_receivables(seed, threshold):
+    df = receivables(seed)
+    hp_repayments = pd.DataFrame({"HP_Repayment_Date": ["2024-09-05"], "HP_Repayment_Amount": ["1234.5"]})
+
+    expected_df, expected_totals = generate_summary_outputs(df.copy(), hp_repayments, REPORT_DATE, threshold)
+    summary_df, totals = summary_from_snapshot(build_loan_snapshot(df), 1234.5, threshold)
+    pd.testing.assert_frame_equal(summary_df, expected_df)
+    assert totals == expected_totals
@@ -0,0 +1,64 @@
+import io
+
+import pandas as pd
+import pytest
+
+from scripts.validate_uploads import validate_file, validate_stream
+
+
+def csv_bytes(rows, header):
+    return ("\r\n".join([",".join(header)] + [",".join(row) for row in rows]) + "\r\n").encode("utf-8")
+
+
+def payments(bad_dates=(), other_day=()):
+    rows = []
+    for i in range(23):
+        day = "2024-01-18" if i in other_day else "2024-01-19"
+        rows.append([f"{i:04d}", "19/01/2024" if i in bad_dates else day, f"{i * 1.5:.2f}"])
+    return rows
+
+
+FILES = {
+    "clean payments": ("Payments_20240119.csv", csv_bytes(payments(), ["LoanID", "Paid_Date", "Amount_Paid"])),
+    "errors across chunks": (
+        "Payments_20240119.csv",
+        csv_bytes(payments(bad_dates={2, 9, 10, 15, 16, 20, 22}, other_day={4, 17}), ["LoanID", "Paid_Date", "Amount_Paid"]),
+    ),
+    "schedule order": ("Schedule_20240119.csv", csv_bytes(
+        [[f"{i:03d}", "2024-01-01", "2023-12-01" if i % 4 == 0 else "2024-02-01", "0.1", "100", "90", "01"]
+         for i in range(30)] + [["999", "2024-01-01", "bad", "0.1", "100", "90", "01"]],
+        ["LoanID", "Purchase_Date", "Due_Date", "Advance_Rate", "Receivable_Outstandings", "Purchase_Consideration", "entity"],
+    )),
+    "hp repayments": ("HP_Repayments_20240119.csv", csv_bytes(
+        [["2024-01-05", "000123", "10.5", "0100"], ["", "0456", "20", "0200"], ["2024-13-01", "789", "", "0100"]],
+        ["HP_Repayment_Date", "BankStatement_Ref", "HP_Repayment_Amount", "To"],
+    )),
+    "header mismatch": ("Payments_20240119.csv", csv_bytes(payments(), ["LoanID", "Amount_Paid", "Paid_Date"])),
+    "byte order mark": ("Payments_20240119.csv", b"\xef\xbb\xbf" + csv_bytes(payments(), ["LoanID", "Paid_Date", "Amount_Paid"])),
+    "no rows": ("Payments_20240119.csv", csv_bytes([], ["LoanID", "Paid_Date", "Amount_Paid"])),
+    "customer details": ("CustomerDetails_20240119.csv", csv_bytes([["1", "x"]], ["LoanID", "Name"])),
+    "undated name": ("Payments_2024.csv", csv_bytes(payments(), ["LoanID", "Paid_Date", "Amount_Paid"])),
+    "unknown type": ("Other_20240119.csv", csv_bytes(payments(), ["LoanID", "Paid_Date", "Amount_Paid"])),
+}
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 4, 10000])
+@pytest.mark.parametrize("case", sorted(FILES))
+def test_stream_gives_the_file_messages(case, chunk_rows):
+    name, data = FILES[case]
+    # As /upload parsed a file for validate_file: the whole decoded file, every column as text
+    expected = validate_file(name, pd.read_csv(io.StringIO(data.decode("utf-8")), dtype=str))
+    stream = io.BytesIO(data)
+    assert validate_stream(name, stream, chunk_rows=chunk_rows, stop_on_error=False) == expected
+    assert not stream.closed
+
+
+def test_stream_stops_after_the_first_failing_chunk():
+    name, data = FILES["errors across chunks"]
+    errors = validate_stream(name, io.BytesIO(data), chunk_rows=4)
+    # Row 2 has the first bad date (which fails the filename-date match too), so only the
+    # first chunk (rows 0-3) is checked
+    assert [error.split(":")[0] for error in errors] == [
+        "Invalid date format in Paid_Date", "Paid_Date does not match filename date 2024-01-19"
+    ]
+    assert all(": 1 " in error and "stopped after row 5" in error for error in errors)